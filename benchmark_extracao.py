@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark das estratégias de extração de imagens
+Gera planilhas sintéticas (planilhas_sinteticas) e roda cada extrator sobre
+elas, medindo tempo, pico de memória e acerto contra o gabarito (a imagem
+da coluna H de cada REF). Nenhum upload é feito.
+
+Uso:
+    python benchmark_extracao.py --linhas 50 500 --imagens-por-linha 1 3 \\
+        --tamanhos 200x200,800x600 --ancoras one two --json resultado.json
+"""
+
+import argparse
+import contextlib
+import gc
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from planilhas_sinteticas import gerar_planilha, ANCORAS
+from leitor_xlsx_zip import LeitorXlsxZip
+from imagem_memoria import extrair_bytes_imagem
+
+
+class EstrategiaIndisponivel(Exception):
+    """Dependência da estratégia não instalada neste ambiente"""
+
+
+def _importar(modulo):
+    try:
+        return __import__(modulo)
+    except ImportError as e:
+        raise EstrategiaIndisponivel(str(e))
+
+
+def _linha_para_ref(contexto):
+    return {linha: ref for ref, linha in contexto['linhas'].items()}
+
+
+def _bytes_membros(arquivo, nomes):
+    """Lê xl/media/<nome> de cada imagem casada (parte do custo da estratégia)"""
+    with zipfile.ZipFile(arquivo) as xlsx:
+        return {nome: xlsx.read(f'xl/media/{nome}') for nome in set(nomes)}
+
+
+def estrategia_worksheet(arquivo, contexto):
+    """ExcelImageExtractor.extract_images_from_worksheet (load_workbook + âncoras)"""
+    modulo = _importar('excel_image_extractor')
+    extrator = modulo.ExcelImageExtractor('', '', '')
+    workbook = modulo.openpyxl.load_workbook(arquivo)
+    try:
+        por_linha = _linha_para_ref(contexto)
+        return [(por_linha.get(linha), extrair_bytes_imagem(imagem))
+                for linha, imagem in extrator.extract_images_from_worksheet(workbook.active)]
+    finally:
+        workbook.close()
+
+
+def estrategia_zip(arquivo, contexto):
+    """ExcelImageExtractor.extract_images_from_zip (xl/media em ordem → linhas sequenciais)"""
+    modulo = _importar('excel_image_extractor')
+    extrator = modulo.ExcelImageExtractor('', '', '')
+    por_linha = _linha_para_ref(contexto)
+    resultado = []
+    for linha, caminho in extrator.extract_images_from_zip(arquivo):
+        with open(caminho, 'rb') as f:
+            resultado.append((por_linha.get(linha), f.read()))
+        os.unlink(caminho)
+    return resultado
+
+
+def estrategia_corrigido(arquivo, contexto):
+    """DetectorImagensCorrigido.detectar_imagens_corrigido (+ leitura dos bytes)"""
+    detector = _importar('detector_corrigido').DetectorImagensCorrigido(debug_mode=False)
+    encontradas = detector.detectar_imagens_corrigido(arquivo)
+    dados = _bytes_membros(arquivo, [img['image_filename'] for img in encontradas])
+    return [(img['ref'], dados[img['image_filename']]) for img in encontradas]
+
+
+def estrategia_integrado(arquivo, contexto):
+    """DetectorImagensIntegrado.detectar_imagens (openpyxl, XML se vazio; + leitura dos bytes)"""
+    detector = _importar('detector_integrado').DetectorImagensIntegrado(debug_mode=False)
+    encontradas = detector.detectar_imagens(arquivo)
+    # O caminho openpyxl devolve o índice em worksheet._images (ordem do drawing)
+    nomes = [img['image_filename'] if 'image_filename' in img
+             else os.path.basename(contexto['membros_por_ancora'][img['image_index']])
+             for img in encontradas]
+    dados = _bytes_membros(arquivo, nomes)
+    return [(img['ref'], dados[nome]) for img, nome in zip(encontradas, nomes)]
+
+
+def estrategia_customizado(arquivo, contexto):
+    """DetectorImagensCustomizado.detectar_imagens_embedadas (+ leitura dos bytes)"""
+    detector = _importar('detector_customizado').DetectorImagensCustomizado(debug_mode=False)
+    encontradas = detector.detectar_imagens_embedadas(arquivo)
+    dados = _bytes_membros(arquivo, [img['image_filename'] for img in encontradas])
+    return [(img['ref'], dados[img['image_filename']]) for img in encontradas]
+
+
+def estrategia_process_excel_simple(arquivo, contexto):
+    """SistemaExcelProcessor.process_excel_simple com o upload trocado por uma captura"""
+    processador = _importar('sistema_simples').SistemaExcelProcessor()
+    capturadas = []
+
+    def capturar(images):
+        capturadas.extend(images)
+        return len(images), 0
+
+    processador.upload_images_ftp = capturar
+    resultado = processador.process_excel_simple(arquivo)
+    if not resultado.get('success'):
+        raise RuntimeError(resultado.get('error'))
+    return [(img['ref'], img['bytes']) for img in capturadas]
+
+
+ESTRATEGIAS = {
+    'worksheet': estrategia_worksheet,
+    'zip': estrategia_zip,
+    'corrigido': estrategia_corrigido,
+    'integrado': estrategia_integrado,
+    'customizado': estrategia_customizado,
+    'process_excel_simple': estrategia_process_excel_simple,
+}
+
+
+def conferir(pares, gabarito):
+    """
+    Compara (ref, bytes) devolvidos com o gabarito
+
+    Returns:
+        dict com corretas, erradas (imagem trocada ou REF inexistente),
+        faltando e acerto (corretas / REFs com foto)
+    """
+    obtidas = {}
+    erradas = 0
+    for ref, dados in pares:
+        if ref in obtidas:
+            erradas += 1
+            continue
+        obtidas[ref] = hashlib.sha256(dados).hexdigest()
+    corretas = sum(1 for ref, sha in obtidas.items() if gabarito.get(ref) == sha)
+    erradas += len(obtidas) - corretas
+    return {
+        'corretas': corretas,
+        'erradas': erradas,
+        'faltando': len(gabarito) - corretas,
+        'acerto': round(corretas / len(gabarito), 4) if gabarito else 1.0,
+    }
+
+
+@contextlib.contextmanager
+def silencioso():
+    """Cala prints e logs INFO dos extratores durante a medição"""
+    logging.disable(logging.INFO)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def medir(estrategia, arquivo, contexto, repeticoes):
+    """
+    Roda a estratégia `repeticoes` vezes para o tempo e uma vez sob tracemalloc para o pico
+
+    Returns:
+        (medição, pares (ref, bytes) da última execução cronometrada)
+    """
+    tempos = []
+    pares = None
+    for _ in range(repeticoes):
+        gc.collect()
+        with silencioso():
+            inicio = time.perf_counter()
+            pares = estrategia(arquivo, contexto)
+            tempos.append(time.perf_counter() - inicio)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        with silencioso():
+            estrategia(arquivo, contexto)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'tempo_min': round(min(tempos), 4),
+        'tempo_mediana': round(statistics.median(tempos), 4),
+        'pico_mb': round(pico / (1024 * 1024), 2),
+        'imagens_devolvidas': len(pares),
+    }, pares
+
+
+def rodar_cenario(linhas, imagens_por_linha, tamanhos, ancora, estrategias, repeticoes, lacuna=0):
+    """Gera a planilha do cenário e mede cada estratégia sobre ela"""
+    planilha = gerar_planilha(linhas, imagens_por_linha, tamanhos, ancora, lacuna=lacuna)
+    cenario = {
+        'linhas': linhas,
+        'imagens_por_linha': imagens_por_linha,
+        'tamanhos': ['x'.join(map(str, t)) for t in tamanhos],
+        'ancora': ancora,
+        'lacuna': lacuna,
+        'total_imagens': planilha.total_imagens,
+        'tamanho_xlsx_mb': round(len(planilha.dados) / (1024 * 1024), 2),
+        'resultados': {},
+    }
+
+    with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp:
+        tmp.write(planilha.dados)
+        arquivo = tmp.name
+    try:
+        with LeitorXlsxZip(arquivo) as leitor:
+            membros = [a['membro'] for a in leitor.ancoras()]
+        contexto = {'linhas': planilha.linhas, 'membros_por_ancora': membros}
+
+        for nome in estrategias:
+            try:
+                medicao, pares = medir(ESTRATEGIAS[nome], arquivo, contexto, repeticoes)
+                medicao.update(conferir(pares, planilha.gabarito))
+            except EstrategiaIndisponivel as e:
+                medicao = {'indisponivel': str(e)}
+            except Exception as e:
+                medicao = {'erro': f'{type(e).__name__}: {e}'}
+            cenario['resultados'][nome] = medicao
+    finally:
+        os.unlink(arquivo)
+    return cenario
+
+
+def imprimir_cenario(cenario):
+    print(f"\n📊 {cenario['linhas']} linhas × {cenario['imagens_por_linha']} imagem(ns)/linha, "
+          f"{','.join(cenario['tamanhos'])}, âncora {cenario['ancora']} "
+          f"({cenario['total_imagens']} imagens, {cenario['tamanho_xlsx_mb']} MB)")
+    print(f"   {'estratégia':<22}{'min (s)':>9}{'mediana':>9}{'pico MB':>9}"
+          f"{'corretas':>10}{'erradas':>9}{'faltando':>10}{'acerto':>8}")
+    for nome, r in cenario['resultados'].items():
+        if 'indisponivel' in r:
+            print(f"   {nome:<22}  ⚠️ indisponível: {r['indisponivel']}")
+        elif 'erro' in r:
+            print(f"   {nome:<22}  ❌ {r['erro']}")
+        else:
+            print(f"   {nome:<22}{r['tempo_min']:>9.3f}{r['tempo_mediana']:>9.3f}{r['pico_mb']:>9.1f}"
+                  f"{r['corretas']:>10}{r['erradas']:>9}{r['faltando']:>10}{r['acerto']:>8.0%}")
+
+
+def ler_tamanhos(texto):
+    """'200x200,800x600' → ((200, 200), (800, 600))"""
+    tamanhos = []
+    for item in texto.split(','):
+        largura, _, altura = item.strip().lower().partition('x')
+        tamanhos.append((int(largura), int(altura or largura)))
+    return tuple(tamanhos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark das estratégias de extração de imagens do Excel')
+    parser.add_argument('--linhas', type=int, nargs='+', default=[50, 500], help='REFs por planilha')
+    parser.add_argument('--imagens-por-linha', type=int, nargs='+', default=[1], help='imagens ancoradas por REF (a 1ª na coluna H)')
+    parser.add_argument('--tamanhos', type=ler_tamanhos, default=((200, 200),), help='LxA em pixels, em ciclo (ex.: 200x200,800x600)')
+    parser.add_argument('--ancoras', nargs='+', choices=ANCORAS, default=['one', 'two'], help='tipo de âncora')
+    parser.add_argument('--lacuna', type=int, default=0, help='toda n-ésima REF fica sem imagem')
+    parser.add_argument('--estrategias', nargs='+', choices=list(ESTRATEGIAS), default=list(ESTRATEGIAS))
+    parser.add_argument('--repeticoes', type=int, default=3, help='execuções medidas por estratégia')
+    parser.add_argument('--json', help='salva os resultados neste arquivo')
+    args = parser.parse_args()
+
+    print("⏱️ BENCHMARK DAS ESTRATÉGIAS DE EXTRAÇÃO")
+    print("=" * 70)
+    print(f"Python {sys.version.split()[0]} · {args.repeticoes} repetição(ões) · pico de memória via tracemalloc")
+
+    cenarios = []
+    for linhas, por_linha, ancora in itertools.product(args.linhas, args.imagens_por_linha, args.ancoras):
+        cenario = rodar_cenario(linhas, por_linha, args.tamanhos, ancora, args.estrategias,
+                                max(1, args.repeticoes), lacuna=args.lacuna)
+        imprimir_cenario(cenario)
+        cenarios.append(cenario)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version.split()[0], 'repeticoes': args.repeticoes, 'cenarios': cenarios},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Resultados salvos em {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste de carga do /upload
+Sobe um dos servidores (sistema_render_otimizado, sistema_simples ou
+sistema_ftplib) apontado para um FTP local (servidores_locais), dispara N
+clientes simultâneos postando planilhas sintéticas e mede vazão, latência
+p50/p95/p99, taxa de erro e o RSS do servidor ao longo do tempo. O relatório
+JSON tem chaves ordenadas para ser comparado entre execuções (diff).
+
+No sistema_ftplib o /upload responde 202 e a latência vai até o job terminar
+(/jobs/<id>); a latência só do aceite fica em 'aceite_s'.
+
+Uso:
+    python carga_upload.py --sistema render_otimizado --clientes 1 4 8 --requisicoes 40 \\
+        --linhas 50 --latencia 0.03 --banda 2000000 --json carga.json
+    python carga_upload.py --url http://localhost:8080 --pid 12345 --clientes 4
+"""
+
+import argparse
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from planilhas_sinteticas import gerar_planilha, ANCORAS
+from servidores_locais import ServidorFTPLocal, CondicoesRede
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+
+SISTEMAS = {
+    'render_otimizado': 'sistema_render_otimizado.py',
+    'simples': 'sistema_simples.py',
+    'ftplib': 'sistema_ftplib.py',
+}
+
+# Estados finais de um job do sistema_ftplib (fila_jobs)
+JOB_TERMINADO = ('done', 'failed')
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) com interpolação linear; None se não houver valores"""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    posicao = (len(ordenados) - 1) * p / 100
+    base = int(posicao)
+    topo = min(base + 1, len(ordenados) - 1)
+    return ordenados[base] + (ordenados[topo] - ordenados[base]) * (posicao - base)
+
+
+def resumo_latencias(valores):
+    if not valores:
+        return None
+    return {
+        'p50': round(percentil(valores, 50), 4),
+        'p95': round(percentil(valores, 95), 4),
+        'p99': round(percentil(valores, 99), 4),
+        'max': round(max(valores), 4),
+        'media': round(sum(valores) / len(valores), 4),
+    }
+
+
+def ler_rss_mb(pid):
+    """RSS do processo em MB (/proc no Linux, psutil se disponível); None se não der para ler"""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for linha in status:
+                if linha.startswith('VmRSS:'):
+                    return round(int(linha.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if PSUTIL_AVAILABLE:
+        try:
+            return round(psutil.Process(pid).memory_info().rss / (1024 * 1024), 1)
+        except psutil.Error:
+            pass
+    return None
+
+
+def corpo_multipart(nome_arquivo, dados, campos=None):
+    """(corpo, content-type) de um multipart/form-data com o arquivo em 'excel_file'"""
+    boundary = uuid.uuid4().hex
+    partes = []
+    for nome, valor in (campos or {}).items():
+        partes.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{nome}"\r\n\r\n{valor}\r\n'.encode())
+    partes.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="excel_file"; filename="{nome_arquivo}"\r\n'
+        'Content-Type: application/vnd.openxmlformats-officedocument.spreadsheetml.sheet\r\n\r\n'.encode()
+        + dados + b'\r\n'
+    )
+    partes.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(partes), f'multipart/form-data; boundary={boundary}'
+
+
+def _json(resposta):
+    try:
+        return json.loads(resposta.read().decode('utf-8'))
+    except ValueError:
+        return {}
+
+
+def _postar(url, corpo, content_type, timeout, retentar_503, resultado, inicio):
+    """POST /upload; com retentar_503, espera o Retry-After e reenvia até o timeout"""
+    while True:
+        requisicao = urllib.request.Request(f'{url}/upload', data=corpo, method='POST',
+                                            headers={'Content-Type': content_type})
+        try:
+            return urllib.request.urlopen(requisicao, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            espera = float(e.headers.get('Retry-After') or 1)
+            if e.code != 503 or not retentar_503 or time.perf_counter() - inicio + espera > timeout:
+                raise
+            resultado['recusas_503'] += 1
+            time.sleep(espera)
+
+
+def enviar_planilha(url, nome_arquivo, dados, metodo='auto', timeout=600, intervalo_job=0.25,
+                    retentar_503=False):
+    """
+    POST /upload de uma planilha; se vier 202, acompanha /jobs/<id> até terminar
+
+    Args:
+        retentar_503: respeita o Retry-After das recusas por lotação (a espera
+            entra na latência) em vez de contar o 503 como erro
+
+    Returns:
+        dict com 'ok', 'status' HTTP, 'latencia', 'aceite' (só no 202),
+        'recusas_503', 'uploads_successful', 'uploads_failed' e 'erro'
+    """
+    corpo, content_type = corpo_multipart(nome_arquivo, dados, {'method': metodo})
+    resultado = {'ok': False, 'status': None, 'aceite': None, 'erro': None, 'recusas_503': 0,
+                 'uploads_successful': 0, 'uploads_failed': 0}
+    inicio = time.perf_counter()
+    try:
+        with _postar(url, corpo, content_type, timeout, retentar_503, resultado, inicio) as resposta:
+            resultado['status'] = resposta.status
+            stats = _json(resposta)
+            local = resposta.headers.get('Location')
+
+        if resultado['status'] == 202:
+            resultado['aceite'] = time.perf_counter() - inicio
+            local = local or stats.get('status_url')
+            while True:
+                time.sleep(intervalo_job)
+                with urllib.request.urlopen(f'{url}{local}', timeout=timeout) as resposta:
+                    job = _json(resposta)
+                if job.get('status') in JOB_TERMINADO:
+                    break
+                if time.perf_counter() - inicio > timeout:
+                    raise TimeoutError(f"job {stats.get('job_id')} não terminou em {timeout}s")
+            stats = job.get('result') or {'error': job.get('error') or job.get('status')}
+
+        resultado['uploads_successful'] = stats.get('uploads_successful', 0)
+        resultado['uploads_failed'] = stats.get('uploads_failed', 0)
+        if stats.get('error'):
+            resultado['erro'] = str(stats['error'])[:200]
+        else:
+            resultado['ok'] = True
+    except urllib.error.HTTPError as e:
+        resultado['status'] = e.code
+        resultado['erro'] = f'HTTP {e.code}'
+    except Exception as e:
+        resultado['erro'] = f'{type(e).__name__}: {e}'[:200]
+    resultado['latencia'] = time.perf_counter() - inicio
+    return resultado
+
+
+class Amostrador(threading.Thread):
+    """Amostra RSS do servidor e o progresso da etapa a cada `intervalo` segundos"""
+
+    def __init__(self, pid, etapa, intervalo=1.0):
+        super().__init__(name='amostrador-carga', daemon=True)
+        self.pid = pid
+        self.etapa = etapa
+        self.intervalo = intervalo
+        self.amostras = []
+        self._parar = threading.Event()
+
+    def amostrar(self):
+        self.amostras.append({
+            't': round(time.perf_counter() - self.etapa.inicio, 2),
+            'rss_mb': ler_rss_mb(self.pid) if self.pid else None,
+            'concluidas': self.etapa.concluidas,
+            'erros': self.etapa.erros,
+            'em_andamento': self.etapa.em_andamento,
+        })
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            self.amostrar()
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+        self.amostrar()
+
+
+class Etapa:
+    """Uma rodada com N clientes simultâneos dividindo um número fixo de requisições"""
+
+    def __init__(self, url, planilhas, clientes, requisicoes, metodo='auto', timeout=600,
+                 retentar_503=False):
+        self.url = url
+        self.planilhas = planilhas
+        self.clientes = clientes
+        self.requisicoes = requisicoes
+        self.metodo = metodo
+        self.timeout = timeout
+        self.retentar_503 = retentar_503
+        self.resultados = []
+        self.concluidas = 0
+        self.erros = 0
+        self.em_andamento = 0
+        self.inicio = None
+        self._proxima = itertools.count()
+        self._lock = threading.Lock()
+
+    def _cliente(self):
+        while True:
+            with self._lock:
+                indice = next(self._proxima)
+                if indice >= self.requisicoes:
+                    return
+                self.em_andamento += 1
+            planilha = self.planilhas[indice % len(self.planilhas)]
+            resultado = enviar_planilha(self.url, f'carga_{indice:05d}.xlsx', planilha.dados,
+                                        self.metodo, self.timeout, retentar_503=self.retentar_503)
+            resultado['imagens'] = len(planilha.gabarito)
+            with self._lock:
+                self.em_andamento -= 1
+                self.concluidas += 1
+                self.erros += not resultado['ok']
+                self.resultados.append(resultado)
+
+    def rodar(self, pid=None, intervalo=1.0):
+        self.inicio = time.perf_counter()
+        amostrador = Amostrador(pid, self, intervalo)
+        amostrador.amostrar()
+        amostrador.start()
+        threads = [threading.Thread(target=self._cliente, name=f'cliente-carga-{i}', daemon=True)
+                   for i in range(self.clientes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - self.inicio
+        amostrador.parar()
+        return self.relatorio(duracao, amostrador.amostras)
+
+    def relatorio(self, duracao, amostras):
+        ok = [r for r in self.resultados if r['ok']]
+        erros = {}
+        for r in self.resultados:
+            if not r['ok']:
+                chave = r['erro'] if r['status'] in (None, 200, 202) else f"HTTP {r['status']}"
+                erros[chave] = erros.get(chave, 0) + 1
+        rss = [a['rss_mb'] for a in amostras if a['rss_mb'] is not None]
+        aceites = [r['aceite'] for r in self.resultados if r['aceite'] is not None]
+        imagens_enviadas = sum(r['uploads_successful'] for r in ok)
+        return {
+            'clientes': self.clientes,
+            'requisicoes': len(self.resultados),
+            'sucesso': len(ok),
+            'erros': len(self.resultados) - len(ok),
+            'taxa_erro': round((len(self.resultados) - len(ok)) / len(self.resultados), 4) if self.resultados else 0,
+            'erros_por_tipo': erros,
+            'recusas_503': sum(r['recusas_503'] for r in self.resultados),
+            'duracao_s': round(duracao, 3),
+            'vazao_rps': round(len(ok) / duracao, 3) if duracao else 0,
+            'imagens_por_s': round(imagens_enviadas / duracao, 2) if duracao else 0,
+            'imagens_enviadas': imagens_enviadas,
+            'imagens_falhas': sum(r['uploads_failed'] for r in self.resultados),
+            'latencia_s': resumo_latencias([r['latencia'] for r in ok]),
+            'aceite_s': resumo_latencias(aceites),
+            'rss_mb': {'inicio': rss[0], 'pico': max(rss), 'fim': rss[-1]} if rss else None,
+            'amostras': amostras,
+        }
+
+
+def aguardar_health(url, processo=None, timeout=60):
+    """Espera o /health responder 200 (falha cedo se o processo morrer)"""
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if processo is not None and processo.poll() is not None:
+            raise RuntimeError(f"servidor terminou com código {processo.returncode}")
+        try:
+            with urllib.request.urlopen(f'{url}/health', timeout=5) as resposta:
+                if resposta.status == 200:
+                    return
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.25)
+    raise TimeoutError(f"{url}/health não respondeu em {timeout}s")
+
+
+def porta_livre():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def iniciar_sistema(sistema, ftp, dados_dir, log):
+    """
+    Sobe o servidor em subprocesso, com o FTP apontado para o servidor local
+    e manifesto/checkpoints num diretório temporário (execuções independentes)
+
+    Returns:
+        (processo, url)
+    """
+    porta = porta_livre()
+    env = dict(os.environ,
+               PORT=str(porta),
+               PYTHONUNBUFFERED='1',
+               FTP_HOST=ftp.host,
+               FTP_PORT=str(ftp.porta),
+               FTP_USER=ftp.usuario,
+               FTP_PASSWORD=ftp.senha,
+               MANIFESTO_UPLOADS=os.path.join(dados_dir, 'manifesto_uploads.sqlite3'),
+               CHECKPOINTS_LOTES=os.path.join(dados_dir, 'checkpoints_lotes.sqlite3'))
+    processo = subprocess.Popen([sys.executable, os.path.join(DIRETORIO, SISTEMAS[sistema])],
+                                cwd=DIRETORIO, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{porta}'
+    try:
+        aguardar_health(url, processo)
+    except Exception:
+        processo.terminate()
+        processo.wait(10)
+        raise
+    return processo, url
+
+
+def imprimir_etapa(etapa):
+    latencia = etapa['latencia_s'] or {}
+    rss = etapa['rss_mb'] or {}
+    print(f"   {etapa['clientes']:>3} cliente(s): {etapa['sucesso']}/{etapa['requisicoes']} ok "
+          f"({etapa['taxa_erro']:.1%} erro) · {etapa['vazao_rps']:.2f} req/s · {etapa['imagens_por_s']:.1f} img/s · "
+          f"p50 {latencia.get('p50', 0):.2f}s p95 {latencia.get('p95', 0):.2f}s p99 {latencia.get('p99', 0):.2f}s · "
+          f"RSS pico {rss.get('pico', '-')} MB · {etapa['recusas_503']} recusa(s) 503")
+    for erro, quantidade in sorted(etapa['erros_por_tipo'].items(), key=lambda item: -item[1])[:3]:
+        print(f"       ❌ {quantidade}× {erro}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga do /upload com planilhas sintéticas')
+    alvo = parser.add_mutually_exclusive_group(required=True)
+    alvo.add_argument('--sistema', choices=list(SISTEMAS), help='sobe este servidor com um FTP local')
+    alvo.add_argument('--url', help='servidor já rodando (o armazenamento é o que ele estiver usando)')
+    parser.add_argument('--pid', type=int, help='PID do servidor de --url para medir o RSS')
+    parser.add_argument('--clientes', type=int, nargs='+', default=[1, 2, 4], help='clientes simultâneos (uma etapa por valor)')
+    parser.add_argument('--requisicoes', type=int, default=20, help='uploads por etapa')
+    parser.add_argument('--distintas', type=int, default=0,
+                        help='planilhas diferentes reaproveitadas em ciclo (0 = uma nova por upload)')
+    parser.add_argument('--linhas', type=int, default=20, help='REFs por planilha')
+    parser.add_argument('--imagens-por-linha', type=int, default=1)
+    parser.add_argument('--tamanho', default='200x200', help='LxA das imagens em pixels')
+    parser.add_argument('--ancora', choices=ANCORAS, default='one')
+    parser.add_argument('--metodo', default='auto', help="campo 'method' do formulário (sistema_ftplib)")
+    parser.add_argument('--retentar-503', action='store_true',
+                        help='respeita o Retry-After das recusas por lotação em vez de contar como erro')
+    parser.add_argument('--timeout', type=float, default=600, help='segundos por upload (incluindo o job)')
+    parser.add_argument('--intervalo', type=float, default=1.0, help='segundos entre amostras de RSS')
+    parser.add_argument('--latencia', type=float, default=0.0, help='FTP local: segundos por resposta')
+    parser.add_argument('--banda', type=int, help='FTP local: bytes/s por conexão')
+    parser.add_argument('--banda-total', type=int, help='FTP local: bytes/s somando as conexões')
+    parser.add_argument('--max-conexoes', type=int, help='FTP local: conexões simultâneas')
+    parser.add_argument('--queda', type=float, default=0.0, help='FTP local: probabilidade de queda por comando/bloco')
+    parser.add_argument('--semente', type=int, default=0)
+    parser.add_argument('--json', help='salva o relatório neste arquivo')
+    args = parser.parse_args()
+
+    largura, _, altura = args.tamanho.lower().partition('x')
+    tamanho = (int(largura), int(altura or largura))
+    quantidade = args.distintas or args.requisicoes
+
+    def gerar_planilhas(etapa):
+        # Sem --distintas cada etapa usa planilhas novas: o manifesto não pula uploads repetidos
+        deslocamento = 0 if args.distintas else etapa * quantidade
+        print(f"🧪 Gerando {quantidade} planilha(s): {args.linhas} linhas × {args.imagens_por_linha} "
+              f"imagem(ns) {args.tamanho}")
+        return [gerar_planilha(args.linhas, args.imagens_por_linha, (tamanho,), args.ancora,
+                               semente=args.semente * 1000000 + deslocamento + i) for i in range(quantidade)]
+
+    planilhas = gerar_planilhas(0)
+
+    condicoes = CondicoesRede(args.latencia, args.banda, args.banda_total, args.max_conexoes,
+                              args.queda, args.semente)
+    relatorio = {
+        'alvo': args.sistema or args.url,
+        'python': sys.version.split()[0],
+        'parametros': {
+            'requisicoes': args.requisicoes,
+            'distintas': quantidade,
+            'linhas': args.linhas,
+            'imagens_por_linha': args.imagens_por_linha,
+            'tamanho': args.tamanho,
+            'ancora': args.ancora,
+            'tamanho_planilha_mb': round(len(planilhas[0].dados) / (1024 * 1024), 2),
+            'metodo': args.metodo,
+            'retentar_503': args.retentar_503,
+        },
+        'etapas': [],
+    }
+
+    ftp = None
+    processo = None
+    dados_dir = tempfile.mkdtemp(prefix='carga_upload_')
+    log_servidor = open(os.path.join(dados_dir, 'servidor.log'), 'wb')
+    try:
+        if args.sistema:
+            ftp = ServidorFTPLocal(condicoes=condicoes).iniciar()
+            relatorio['ftp_local'] = {'latencia': args.latencia, 'banda': args.banda, 'banda_total': args.banda_total,
+                                      'max_conexoes': args.max_conexoes, 'queda': args.queda}
+            print(f"📡 FTP local em {ftp.host}:{ftp.porta}")
+            processo, url = iniciar_sistema(args.sistema, ftp, dados_dir, log_servidor)
+            pid = processo.pid
+            print(f"🚀 {SISTEMAS[args.sistema]} em {url} (PID {pid}, log em {log_servidor.name})")
+        else:
+            url = args.url.rstrip('/')
+            pid = args.pid
+            aguardar_health(url)
+
+        for numero, clientes in enumerate(args.clientes):
+            if numero and not args.distintas:
+                planilhas = gerar_planilhas(numero)
+            etapa = Etapa(url, planilhas, clientes, args.requisicoes, args.metodo, args.timeout,
+                          retentar_503=args.retentar_503)
+            resultado = etapa.rodar(pid, args.intervalo)
+            relatorio['etapas'].append(resultado)
+            imprimir_etapa(resultado)
+
+        if ftp is not None:
+            relatorio['ftp_local']['estatisticas'] = dict(ftp.estatisticas)
+    finally:
+        if processo is not None:
+            processo.terminate()
+            try:
+                processo.wait(10)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+        if ftp is not None:
+            ftp.parar()
+        log_servidor.close()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"💾 Relatório salvo em {args.json}")
+
+
+if __name__ == "__main__":
+    main()
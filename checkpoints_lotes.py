@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checkpoints locais de lotes de upload (SQLite)
+Cada lote é identificado pelo hash da planilha + destino e guarda o estado de
+cada REF; um job repetido (ou reenviado depois de um restart) continua da
+primeira imagem não concluída, e uma imagem grande interrompida no meio é
+retomada com REST a partir do .part que já chegou ao servidor. Um lote em uso
+por um job não é compartilhado: outro job da mesma planilha ao mesmo tempo
+recebe um lote próprio, com seus próprios .part
+"""
+
+import ftplib
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+
+# Caminho do banco (CHECKPOINTS_LOTES, padrão ao lado do código)
+CAMINHO_PADRAO = os.getenv(
+    'CHECKPOINTS_LOTES',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkpoints_lotes.sqlite3')
+)
+# Imagens menores que isso são reenviadas inteiras em vez de retomadas (REST_MINIMO)
+REST_MINIMO = int(os.getenv('REST_MINIMO', str(256 * 1024)))
+# Lotes parados há mais tempo que isso são descartados (segundos)
+IDADE_MAXIMA = 7 * 24 * 3600
+
+# Estados de uma REF no lote
+PENDENTE = 'pending'
+ENVIANDO = 'sending'
+ENVIADA = 'sent'
+FALHOU = 'failed'
+
+
+def hash_arquivo(caminho, tamanho_bloco=1024 * 1024):
+    """SHA-256 hexadecimal da planilha (caminho ou objeto file-like)"""
+    sha = hashlib.sha256()
+    if hasattr(caminho, 'read'):
+        posicao = caminho.tell()
+        for bloco in iter(lambda: caminho.read(tamanho_bloco), b''):
+            sha.update(bloco)
+        caminho.seek(posicao)
+    else:
+        with open(caminho, 'rb') as f:
+            for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+                sha.update(bloco)
+    return sha.hexdigest()
+
+
+def stor_retomavel(ftp, nome, dados, retomar=False, minimo=None, parcial=None):
+    """
+    STOR de bytes em memória; imagens grandes podem continuar um envio interrompido
+
+    Imagens >= minimo vão primeiro para `parcial` (padrão `<nome>.part`; use
+    LoteCheckpoint.parcial) e são renomeadas no fim, então um arquivo parcial
+    é sempre deste lote. Com retomar=True consulta o
+    tamanho do .part (SIZE) e envia só o restante com REST <offset>; se o
+    servidor recusar REST, envia o arquivo inteiro. Um .part já completo (só
+    o rename falhou) vai direto para o rename.
+
+    Returns:
+        offset a partir do qual os bytes foram enviados (0 = arquivo inteiro)
+    """
+    minimo = REST_MINIMO if minimo is None else minimo
+    buffer = io.BytesIO(dados)
+    if len(dados) < minimo:
+        ftp.storbinary(f'STOR {nome}', buffer)
+        return 0
+
+    parcial = parcial or f'{nome}.part'
+    offset = 0
+    if retomar:
+        try:
+            tamanho = ftp.size(parcial)
+        except ftplib.error_perm:
+            tamanho = None
+        if tamanho and 0 < tamanho <= len(dados):
+            offset = tamanho
+    if offset < len(dados):
+        try:
+            buffer.seek(offset)
+            ftp.storbinary(f'STOR {parcial}', buffer, rest=offset or None)
+        except ftplib.error_perm:
+            if not offset:
+                raise
+            # REST não suportado para STOR: recomeça do zero
+            offset = 0
+            buffer.seek(0)
+            ftp.storbinary(f'STOR {parcial}', buffer)
+    try:
+        ftp.rename(parcial, nome)
+    except ftplib.error_perm:
+        # Servidores que não sobrescrevem no RNTO
+        ftp.delete(nome)
+        ftp.rename(parcial, nome)
+    return offset
+
+
+class LoteCheckpoint:
+    """Estado persistido de um lote (planilha + destino)"""
+
+    def __init__(self, checkpoints, lote_id, retomado, estados):
+        self._checkpoints = checkpoints
+        self.id = lote_id
+        self.retomado = retomado
+        self._estados = estados
+
+    def estado(self, ref):
+        return self._estados.get(ref, PENDENTE)
+
+    def parcial(self, nome):
+        """Nome do arquivo parcial de `nome` neste lote"""
+        return f'{nome}.{self.id[:8]}.part'
+
+    def concluida(self, ref):
+        return self._estados.get(ref) == ENVIADA
+
+    def interrompida(self, ref):
+        """True se o envio da REF começou e não terminou (pode haver arquivo parcial)"""
+        return self._estados.get(ref) == ENVIANDO
+
+    def marcar(self, ref, estado, tamanho=None, erro=None):
+        self._estados[ref] = estado
+        self._checkpoints._gravar_item(self.id, ref, estado, tamanho, erro)
+
+    def concluidas(self):
+        return sum(1 for estado in self._estados.values() if estado == ENVIADA)
+
+    def concluir(self):
+        """Marca o lote como terminado (um novo envio da planilha começa do zero)"""
+        self._checkpoints._concluir(self.id)
+
+    def liberar(self):
+        """Devolve o lote para que outro job (ou um reenvio) possa retomá-lo"""
+        self._checkpoints._liberar(self.id)
+
+
+class CheckpointsLotes:
+    """Banco de checkpoints compartilhado e thread-safe"""
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho or CAMINHO_PADRAO
+        self._lock = threading.Lock()
+        self._em_uso = set()
+        self._conexao = sqlite3.connect(self.caminho, check_same_thread=False, timeout=30)
+        with self._lock, self._conexao:
+            self._conexao.execute('PRAGMA journal_mode=WAL')
+            self._conexao.execute(
+                'CREATE TABLE IF NOT EXISTS lotes ('
+                ' lote_id TEXT PRIMARY KEY,'
+                ' workbook_hash TEXT NOT NULL,'
+                ' destino TEXT NOT NULL,'
+                ' job_id TEXT,'
+                ' execucoes INTEGER NOT NULL DEFAULT 1,'
+                ' concluido INTEGER NOT NULL DEFAULT 0,'
+                ' criado_em REAL NOT NULL,'
+                ' atualizado_em REAL NOT NULL)'
+            )
+            self._conexao.execute(
+                'CREATE TABLE IF NOT EXISTS itens ('
+                ' lote_id TEXT NOT NULL,'
+                ' ref TEXT NOT NULL,'
+                ' estado TEXT NOT NULL,'
+                ' tamanho INTEGER,'
+                ' erro TEXT,'
+                ' atualizado_em REAL NOT NULL,'
+                ' PRIMARY KEY (lote_id, ref))'
+            )
+
+    def abrir_lote(self, workbook_hash, destino, job_id=None):
+        """
+        Abre o lote da planilha no destino, retomando o checkpoint se houver
+
+        Um lote já concluído é reiniciado (estados zerados); um lote
+        interrompido devolve os estados por REF gravados até a falha. O lote
+        fica reservado até liberar(); se outro job da mesma planilha estiver
+        com ele, este recebe um lote novo identificado também pelo job_id.
+        """
+        lote_id = hashlib.sha256(f'{workbook_hash}|{destino}'.encode()).hexdigest()[:32]
+        agora = time.time()
+        with self._lock, self._conexao:
+            if lote_id in self._em_uso:
+                lote_id = hashlib.sha256(f'{workbook_hash}|{destino}|{job_id}|{agora}'.encode()).hexdigest()[:32]
+            self._em_uso.add(lote_id)
+            self._conexao.execute('DELETE FROM itens WHERE lote_id IN '
+                                  '(SELECT lote_id FROM lotes WHERE atualizado_em < ?)', (agora - IDADE_MAXIMA,))
+            self._conexao.execute('DELETE FROM lotes WHERE atualizado_em < ?', (agora - IDADE_MAXIMA,))
+            linha = self._conexao.execute('SELECT concluido FROM lotes WHERE lote_id = ?', (lote_id,)).fetchone()
+            retomado = linha is not None and not linha[0]
+            if linha is None or linha[0]:
+                self._conexao.execute('DELETE FROM itens WHERE lote_id = ?', (lote_id,))
+                self._conexao.execute(
+                    'INSERT OR REPLACE INTO lotes (lote_id, workbook_hash, destino, job_id, execucoes, concluido,'
+                    ' criado_em, atualizado_em) VALUES (?, ?, ?, ?, 1, 0, ?, ?)',
+                    (lote_id, workbook_hash, destino, job_id, agora, agora)
+                )
+                estados = {}
+            else:
+                self._conexao.execute(
+                    'UPDATE lotes SET job_id = ?, execucoes = execucoes + 1, atualizado_em = ? WHERE lote_id = ?',
+                    (job_id, agora, lote_id)
+                )
+                estados = dict(self._conexao.execute(
+                    'SELECT ref, estado FROM itens WHERE lote_id = ?', (lote_id,)
+                ).fetchall())
+        return LoteCheckpoint(self, lote_id, retomado, estados)
+
+    def _gravar_item(self, lote_id, ref, estado, tamanho, erro):
+        agora = time.time()
+        with self._lock, self._conexao:
+            self._conexao.execute(
+                'INSERT OR REPLACE INTO itens (lote_id, ref, estado, tamanho, erro, atualizado_em)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (lote_id, ref, estado, tamanho, erro, agora)
+            )
+            self._conexao.execute('UPDATE lotes SET atualizado_em = ? WHERE lote_id = ?', (agora, lote_id))
+
+    def _concluir(self, lote_id):
+        with self._lock, self._conexao:
+            self._conexao.execute('UPDATE lotes SET concluido = 1, atualizado_em = ? WHERE lote_id = ?',
+                                  (time.time(), lote_id))
+
+    def _liberar(self, lote_id):
+        with self._lock:
+            self._em_uso.discard(lote_id)
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
+
+
+_checkpoints = None
+_checkpoints_lock = threading.Lock()
+
+
+def obter_checkpoints():
+    """Banco de checkpoints compartilhado do processo, aberto na primeira chamada"""
+    global _checkpoints
+    with _checkpoints_lock:
+        if _checkpoints is None:
+            _checkpoints = CheckpointsLotes()
+        return _checkpoints
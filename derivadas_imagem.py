@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Derivadas responsivas das imagens de produto (miniaturas e WebP)
+Para cada REF gera REF_<largura>.jpg (e .webp) nos tamanhos configurados e,
+opcionalmente, REF.webp em tamanho cheio; a geração roda no pool de processos
+da transcodificação e o envio usa as mesmas sessões FTP do pool. Uma REF só é
+regenerada quando o hash do original muda.
+"""
+
+import io
+import os
+
+from transcodificacao import obter_transcodificador, PIL_AVAILABLE
+from upload_paralelo import enviar_em_paralelo
+
+if PIL_AVAILABLE:
+    from PIL import Image
+
+# Lados maiores das miniaturas, ex. "160,480,1024" (DERIVADAS_TAMANHOS; vazio desativa)
+TAMANHOS_PADRAO = tuple(int(t) for t in os.getenv('DERIVADAS_TAMANHOS', '').replace(' ', '').split(',') if t)
+# Gera também as variantes WebP (DERIVADAS_WEBP=1)
+WEBP_PADRAO = os.getenv('DERIVADAS_WEBP', '').lower() in ('1', 'true', 'sim', 'yes')
+QUALIDADE_JPEG = int(os.getenv('DERIVADAS_QUALIDADE_JPEG', '85'))
+QUALIDADE_WEBP = int(os.getenv('DERIVADAS_QUALIDADE_WEBP', '80'))
+
+
+def derivadas_ativas(tamanhos=None, webp=None):
+    """True se há alguma derivada configurada"""
+    tamanhos = TAMANHOS_PADRAO if tamanhos is None else tamanhos
+    webp = WEBP_PADRAO if webp is None else webp
+    return bool(tamanhos) or webp
+
+
+def nomes_derivadas(ref, tamanhos, webp):
+    """Nomes remotos das derivadas de uma REF, na ordem em que são geradas"""
+    nomes = []
+    for tamanho in tamanhos:
+        nomes.append(f'{ref}_{tamanho}.jpg')
+        if webp:
+            nomes.append(f'{ref}_{tamanho}.webp')
+    if webp:
+        nomes.append(f'{ref}.webp')
+    return nomes
+
+
+def gerar_derivadas(ref, dados, tamanhos, webp):
+    """
+    Gera as derivadas de uma imagem (roda nos processos do pool)
+
+    Returns:
+        dict {nome remoto: bytes}; miniaturas nunca ampliam o original
+    """
+    original = Image.open(io.BytesIO(dados))
+    original.load()
+    if original.mode not in ('RGB', 'L'):
+        original = original.convert('RGB')
+
+    def codificar(img, formato, **opcoes):
+        buffer = io.BytesIO()
+        img.save(buffer, formato, **opcoes)
+        return buffer.getvalue()
+
+    arquivos = {}
+    for tamanho in tamanhos:
+        miniatura = original.copy()
+        miniatura.thumbnail((tamanho, tamanho), Image.LANCZOS)
+        arquivos[f'{ref}_{tamanho}.jpg'] = codificar(miniatura, 'JPEG', quality=QUALIDADE_JPEG, optimize=True, progressive=True)
+        if webp:
+            arquivos[f'{ref}_{tamanho}.webp'] = codificar(miniatura, 'WEBP', quality=QUALIDADE_WEBP, method=4)
+    if webp:
+        arquivos[f'{ref}.webp'] = codificar(original, 'WEBP', quality=QUALIDADE_WEBP, method=4)
+    return arquivos
+
+
+def enviar_derivadas(pool, manifesto, destino, imagens, tamanhos=None, webp=None, log=print):
+    """
+    Gera e envia as derivadas das REFs cujo original mudou
+
+    Args:
+        pool: PoolConexoesFTP já posicionado no diretório das imagens
+        manifesto: ManifestoUploads (tabela de derivadas por REF)
+        destino: identificador do destino (destino_ftp)
+        imagens: lista de (ref, bytes do original, hash do original)
+        log: função que recebe cada linha de log (print ou debug_info.append)
+
+    Returns:
+        dict com refs_geradas, refs_inalteradas, arquivos_enviados, falhas e errors
+    """
+    tamanhos = TAMANHOS_PADRAO if tamanhos is None else tuple(tamanhos)
+    webp = WEBP_PADRAO if webp is None else webp
+    resultado = {'refs_geradas': 0, 'refs_inalteradas': 0, 'arquivos_enviados': 0, 'falhas': 0, 'errors': []}
+    if not derivadas_ativas(tamanhos, webp) or not imagens:
+        return resultado
+    if not PIL_AVAILABLE:
+        log("⚠️ PIL não disponível, derivadas não geradas")
+        return resultado
+
+    pendentes = []
+    for ref, dados, hash_origem in imagens:
+        if manifesto.derivadas_atualizadas(destino, ref, hash_origem, nomes_derivadas(ref, tamanhos, webp)):
+            resultado['refs_inalteradas'] += 1
+            continue
+        pendentes.append((ref, dados, hash_origem))
+    if resultado['refs_inalteradas']:
+        log(f"⏭️ Derivadas de {resultado['refs_inalteradas']} REF(s) já atualizadas")
+
+    hashes = {ref: hash_origem for ref, _, hash_origem in pendentes}
+    geradas = obter_transcodificador().mapear(
+        gerar_derivadas, [(ref, dados, tamanhos, webp) for ref, dados, _ in pendentes]
+    )
+    for (ref, _, _, _), arquivos, erro in geradas:
+        if erro:
+            resultado['falhas'] += 1
+            resultado['errors'].append(f"Erro ao gerar derivadas de {ref}: {erro}")
+            log(f"❌ Erro ao gerar derivadas de {ref}: {erro}")
+            continue
+
+        def enviar(arquivo):
+            pool.executar(lambda ftp: ftp.storbinary(f"STOR {arquivo['ref']}", io.BytesIO(arquivo['dados'])))
+            return True
+
+        # 'ref' aqui é o nome remoto, para as mensagens de erro de enviar_em_paralelo
+        envio = enviar_em_paralelo(
+            [{'ref': nome, 'dados': dados} for nome, dados in arquivos.items()],
+            enviar,
+            max_conexoes=pool.max_conexoes
+        )
+        resultado['arquivos_enviados'] += envio['uploads_successful']
+        if envio['uploads_failed']:
+            resultado['falhas'] += 1
+            resultado['errors'].extend(envio['errors'])
+            log(f"❌ Derivadas de {ref}: {envio['uploads_failed']} arquivo(s) falharam")
+            continue
+        manifesto.registrar_derivadas(destino, ref, hashes[ref], {nome: len(dados) for nome, dados in arquivos.items()})
+        resultado['refs_geradas'] += 1
+        log(f"🖼️ Derivadas de {ref}: {', '.join(arquivos)}")
+
+    return resultado
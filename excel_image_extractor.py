@@ -15,6 +15,9 @@ import pandas as pd
 from typing import List, Tuple, Optional
 import logging
 
+from imagem_memoria import extrair_bytes_imagem, buffer_imagem
+from pool_ftp import obter_pool
+
 # Configuração de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -209,185 +212,75 @@ class ExcelImageExtractor:
             
         return closest_image
     
-    def save_image_to_temp(self, image: Image, ref_value: str) -> str:
+    def get_image_bytes(self, image: Image) -> bytes:
         """
-        Salva imagem em arquivo temporário
+        Obtém os bytes da imagem direto do membro do xlsx, sem arquivo temporário
         
         Args:
             image: Imagem do openpyxl
-            ref_value: Valor da REF para nome do arquivo
             
         Returns:
-            Caminho do arquivo temporário
+            Bytes da imagem
         """
         try:
-            # Cria nome do arquivo baseado na REF (com tratamento para REFs inválidas)
-            safe_ref = "".join(c for c in ref_value if c.isalnum() or c in ('-', '_')).strip()
-            if not safe_ref or safe_ref.upper() in ['TOTAL', 'SUBTOTAL', 'SUM', 'COUNT']:
-                safe_ref = f"imagem_{hash(ref_value) % 10000}"
-            
-            filename = f"{safe_ref}.jpg"
-            temp_path = os.path.join("/tmp", filename)
-            
-            # Salva a imagem - método robusto para diferentes tipos de objeto
-            logger.debug(f"Tipo do objeto image: {type(image)}")
-            
-            # Tenta diferentes métodos de salvamento
-            success = False
-            
-            # Método 1: Usando dados brutos (_data) - MÉTODO PRINCIPAL
-            if hasattr(image, '_data') and not success:
-                try:
-                    data = image._data
-                    if callable(data):
-                        data = data()  # Se for um método, chama ele
-                    
-                    if isinstance(data, bytes) and len(data) > 0:
-                        with open(temp_path, 'wb') as f:
-                            f.write(data)
-                            f.flush()
-                        success = True
-                        logger.debug("Imagem salva usando _data")
-                except Exception as e:
-                    logger.debug(f"Erro ao salvar usando _data: {e}")
-            
-            # Método 2: Usando ref (BytesIO) - APENAS SE _data FALHAR
-            if hasattr(image, 'ref') and not success:
-                try:
-                    ref_obj = image.ref
-                    if hasattr(ref_obj, 'read'):
-                        # É um BytesIO, mas pode estar fechado
-                        try:
-                            ref_obj.seek(0)  # Volta para o início
-                            data = ref_obj.read()
-                            if isinstance(data, bytes) and len(data) > 0:
-                                with open(temp_path, 'wb') as f:
-                                    f.write(data)
-                                    f.flush()
-                                success = True
-                                logger.debug("Imagem salva usando ref (BytesIO)")
-                        except ValueError:
-                            # BytesIO fechado, pula este método
-                            logger.debug("BytesIO fechado, pulando método ref")
-                    elif callable(ref_obj):
-                        data = ref_obj()
-                        if isinstance(data, bytes) and len(data) > 0:
-                            with open(temp_path, 'wb') as f:
-                                f.write(data)
-                                f.flush()
-                            success = True
-                            logger.debug("Imagem salva usando ref (callable)")
-                except Exception as e:
-                    logger.debug(f"Erro ao salvar usando ref: {e}")
-            
-            # Método 3: Usando save direto
-            if hasattr(image, 'save') and callable(getattr(image, 'save')) and not success:
-                try:
-                    image.save(temp_path)
-                    success = True
-                    logger.debug("Imagem salva usando save direto")
-                except Exception as e:
-                    logger.debug(f"Erro ao salvar usando save direto: {e}")
-            
-            # Método 4: Último recurso - tentar obter dados de diferentes formas
-            if not success:
-                data = None
-                for attr in ['_data', 'ref', 'data', 'image']:
-                    if hasattr(image, attr):
-                        try:
-                            potential_data = getattr(image, attr)
-                            if callable(potential_data):
-                                potential_data = potential_data()
-                            if isinstance(potential_data, bytes) and len(potential_data) > 0:
-                                data = potential_data
-                                break
-                        except Exception as e:
-                            logger.debug(f"Erro ao obter {attr}: {e}")
-                            continue
-                
-                if data:
-                    with open(temp_path, 'wb') as f:
-                        f.write(data)
-                        f.flush()
-                    success = True
-                    logger.debug("Imagem salva usando método de fallback")
-            
-            if not success:
-                raise AttributeError("Não foi possível obter dados da imagem")
-            
-            # Verifica se arquivo foi criado corretamente
-            if not os.path.exists(temp_path):
-                raise FileNotFoundError(f"Arquivo temporário não foi criado: {temp_path}")
-            
-            # Verifica se arquivo tem conteúdo
-            file_size = os.path.getsize(temp_path)
-            if file_size == 0:
-                raise ValueError(f"Arquivo temporário está vazio: {temp_path}")
-            
-            logger.info(f"Imagem salva temporariamente: {temp_path} ({file_size} bytes)")
-            return temp_path
-            
-        except AttributeError as e:
-            logger.error(f"Erro de atributo ao salvar imagem: {e}")
+            data = extrair_bytes_imagem(image)
+            logger.debug(f"Imagem lida em memória: {len(data)} bytes")
+            return data
+        except ValueError as e:
+            logger.error(f"Erro de atributo ao ler imagem: {e}")
             logger.error(f"Tipo do objeto image: {type(image)}")
             logger.error(f"Atributos disponíveis: {[attr for attr in dir(image) if not attr.startswith('_')]}")
             raise
-        except Exception as e:
-            logger.error(f"Erro ao salvar imagem temporária: {e}")
-            raise
     
-    def upload_to_ftp(self, local_file_path: str, remote_filename: str) -> bool:
+    def save_image_to_temp(self, image: Image, ref_value: str) -> str:
         """
-        Faz upload do arquivo para o servidor FTP na pasta images/products/
+        Salva imagem em arquivo temporário (usado apenas pelos scripts de teste;
+        o processamento usa get_image_bytes)
         
         Args:
-            local_file_path: Caminho do arquivo local
+            image: Imagem do openpyxl
+            ref_value: Valor da REF para nome do arquivo
+            
+        Returns:
+            Caminho do arquivo temporário
+        """
+        safe_ref = "".join(c for c in ref_value if c.isalnum() or c in ('-', '_')).strip()
+        if not safe_ref or safe_ref.upper() in ['TOTAL', 'SUBTOTAL', 'SUM', 'COUNT']:
+            safe_ref = f"imagem_{hash(ref_value) % 10000}"
+        
+        temp_path = os.path.join("/tmp", f"{safe_ref}.jpg")
+        with open(temp_path, 'wb') as f:
+            f.write(self.get_image_bytes(image))
+        
+        logger.info(f"Imagem salva temporariamente: {temp_path}")
+        return temp_path
+    
+    def upload_bytes_to_ftp(self, image_bytes: bytes, remote_filename: str) -> bool:
+        """
+        Faz upload dos bytes da imagem para o servidor FTP na pasta images/products/
+        
+        Args:
+            image_bytes: Conteúdo da imagem em memória
             remote_filename: Nome do arquivo no servidor
             
         Returns:
             True se upload foi bem-sucedido
         """
         try:
-            # Verifica se arquivo existe e tem conteúdo
-            if not os.path.exists(local_file_path):
-                logger.error(f"Arquivo local não encontrado: {local_file_path}")
+            if not image_bytes:
+                logger.error(f"Imagem vazia: {remote_filename}")
                 return False
             
-            file_size = os.path.getsize(local_file_path)
-            if file_size == 0:
-                logger.error(f"Arquivo local está vazio: {local_file_path}")
-                return False
+            logger.debug(f"Fazendo upload de {len(image_bytes)} bytes como {remote_filename}")
             
-            logger.debug(f"Fazendo upload de {local_file_path} ({file_size} bytes) como {remote_filename}")
+            # Sessão persistente do pool, já posicionada em /images/products
+            pool = obter_pool(self.ftp_host, self.ftp_user, self.ftp_password, '/images/products', timeout=300)
+            remote_path = f"images/products/{remote_filename}"
+            
+            def enviar(ftp):
+                ftp.storbinary(f'STOR {remote_filename}', buffer_imagem(image_bytes))
+            pool.executar(enviar)
             
-            with ftplib.FTP(timeout=300) as ftp:  # Timeout de 5 minutos
-                ftp.connect(self.ftp_host, 21)  # Conecta explicitamente na porta 21
-                ftp.login(self.ftp_user, self.ftp_password)
-                
-                # Cria diretórios se não existirem
-                try:
-                    ftp.mkd('images')
-                    logger.debug("Diretório 'images' criado ou já existe")
-                except:
-                    logger.debug("Diretório 'images' já existe")
-                
-                try:
-                    ftp.cwd('images')
-                    ftp.mkd('products')
-                    logger.debug("Diretório 'images/products' criado ou já existe")
-                except:
-                    logger.debug("Diretório 'images/products' já existe")
-                
-                # Volta para o diretório raiz
-                ftp.cwd('/')
-                
-                # Caminho completo para upload
-                remote_path = f"images/products/{remote_filename}"
-                
-                # Abre arquivo local e faz upload
-                with open(local_file_path, 'rb') as file:
-                    ftp.storbinary(f'STOR {remote_path}', file)
-                    
             logger.info(f"Upload concluído: {remote_path}")
             logger.info(f"Imagem disponível em: https://{self.ftp_host}/{remote_path}")
             return True
@@ -396,6 +289,24 @@ class ExcelImageExtractor:
             logger.error(f"Erro no upload FTP: {e}")
             return False
     
+    def upload_to_ftp(self, local_file_path: str, remote_filename: str) -> bool:
+        """
+        Faz upload de um arquivo local para o servidor FTP na pasta images/products/
+        
+        Args:
+            local_file_path: Caminho do arquivo local
+            remote_filename: Nome do arquivo no servidor
+            
+        Returns:
+            True se upload foi bem-sucedido
+        """
+        if not os.path.exists(local_file_path):
+            logger.error(f"Arquivo local não encontrado: {local_file_path}")
+            return False
+        
+        with open(local_file_path, 'rb') as file:
+            return self.upload_bytes_to_ftp(file.read(), remote_filename)
+    
     def process_excel_file(self, excel_file_path: str, start_row: int = 4, photo_column: str = 'H') -> dict:
         """
         Processa arquivo Excel completo: extrai REFs, imagens e faz upload
@@ -438,27 +349,16 @@ class ExcelImageExtractor:
                     image = self.find_image_for_ref(ref_row, images)
                     
                     if image:
-                        temp_path = None
-                        try:
-                            # Salva imagem temporariamente
-                            temp_path = self.save_image_to_temp(image, ref_value)
-                            
-                            # Faz upload para FTP
-                            remote_filename = f"{ref_value}.jpg"
-                            if self.upload_to_ftp(temp_path, remote_filename):
-                                stats['uploads_successful'] += 1
-                                logger.info(f"✅ REF {ref_value} (linha {ref_row}) processada com sucesso")
-                            else:
-                                stats['uploads_failed'] += 1
-                                
-                        finally:
-                            # Remove arquivo temporário se foi criado
-                            if temp_path and os.path.exists(temp_path):
-                                try:
-                                    os.remove(temp_path)
-                                    logger.debug(f"Arquivo temporário removido: {temp_path}")
-                                except Exception as e:
-                                    logger.warning(f"Erro ao remover arquivo temporário {temp_path}: {e}")
+                        # Bytes da imagem em memória, sem arquivo temporário
+                        image_bytes = self.get_image_bytes(image)
+                        
+                        # Faz upload para FTP
+                        remote_filename = f"{ref_value}.jpg"
+                        if self.upload_bytes_to_ftp(image_bytes, remote_filename):
+                            stats['uploads_successful'] += 1
+                            logger.info(f"✅ REF {ref_value} (linha {ref_row}) processada com sucesso")
+                        else:
+                            stats['uploads_failed'] += 1
                     else:
                         logger.warning(f"Nenhuma imagem encontrada para REF {ref_value} (linha {ref_row}) na coluna {photo_column}")
                         
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fila de jobs de processamento de planilhas
+/upload grava a planilha, enfileira um job e responde 202 na hora; threads
+de fundo processam os jobs e /jobs/<id> devolve o status e o dict de stats
+"""
+
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+
+# Threads processando jobs ao mesmo tempo (JOB_WORKERS, padrão 2)
+WORKERS_PADRAO = int(os.getenv('JOB_WORKERS', '2'))
+# Jobs terminados ficam consultáveis por este tempo (segundos)
+TTL_CONCLUIDOS = int(os.getenv('JOB_TTL', '3600'))
+# Limite de jobs guardados em memória
+MAX_JOBS = 500
+
+# Estados de um job
+NA_FILA = 'queued'
+PROCESSANDO = 'running'
+CONCLUIDO = 'done'
+FALHOU = 'failed'
+
+
+class FilaCheia(Exception):
+    """Há jobs demais aguardando processamento"""
+
+
+class Job:
+    """Um processamento de planilha enfileirado"""
+
+    def __init__(self, caminho, filename, parametros):
+        self.id = uuid.uuid4().hex
+        self.caminho = caminho
+        self.filename = filename
+        self.parametros = parametros
+        self.status = NA_FILA
+        self.resultado = None
+        self.erro = None
+        self.criado_em = time.time()
+        self.iniciado_em = None
+        self.concluido_em = None
+
+    @property
+    def terminado(self):
+        return self.status in (CONCLUIDO, FALHOU)
+
+    def para_dict(self):
+        """Representação JSON do job (result é o dict de stats do processamento)"""
+        fim = self.concluido_em or time.time()
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'filename': self.filename,
+            'created_at': self.criado_em,
+            'started_at': self.iniciado_em,
+            'finished_at': self.concluido_em,
+            'elapsed': round(fim - self.iniciado_em, 3) if self.iniciado_em else None,
+            'result': self.resultado,
+            'error': self.erro,
+        }
+
+
+class FilaJobs:
+    """Fila em memória com um pool fixo de threads de processamento"""
+
+    def __init__(self, processar, workers=None, max_pendentes=100, ttl_concluidos=None):
+        """
+        Args:
+            processar: função processar(job) que retorna o dict de stats
+            workers: número de threads de processamento
+            max_pendentes: jobs aguardando na fila antes de recusar novos
+            ttl_concluidos: segundos que um job terminado fica consultável
+        """
+        self.processar = processar
+        self.workers = workers or WORKERS_PADRAO
+        self.ttl_concluidos = ttl_concluidos or TTL_CONCLUIDOS
+        self._fila = queue.Queue(maxsize=max_pendentes)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def iniciar(self):
+        """Sobe as threads na primeira utilização (depois do fork do gunicorn)"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._loop, name=f'job-worker-{i + 1}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enviar(self, arquivo, filename, **parametros):
+        """
+        Grava a planilha em um arquivo temporário próprio e enfileira o job
+
+        Args:
+            arquivo: objeto com save(caminho) (FileStorage do Flask) ou bytes
+            filename: nome original, só para exibição
+
+        Raises:
+            FilaCheia: se max_pendentes jobs já estiverem aguardando
+        """
+        self.iniciar()
+        fd, caminho = tempfile.mkstemp(prefix='job_', suffix='.xlsx')
+        os.close(fd)
+        try:
+            if isinstance(arquivo, (bytes, bytearray)):
+                with open(caminho, 'wb') as f:
+                    f.write(arquivo)
+            else:
+                arquivo.save(caminho)
+            job = Job(caminho, filename, parametros)
+            with self._lock:
+                self._limpar()
+                self._jobs[job.id] = job
+            self._fila.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            os.remove(caminho)
+            raise FilaCheia('Fila de processamento cheia, tente novamente em instantes')
+        except Exception:
+            if os.path.exists(caminho):
+                os.remove(caminho)
+            raise
+        return job
+
+    def obter(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def posicao(self, job):
+        """Jobs na fila à frente deste (0 se já está processando)"""
+        if job.status != NA_FILA:
+            return 0
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.status == NA_FILA and j.criado_em < job.criado_em)
+
+    def _loop(self):
+        while True:
+            job = self._fila.get()
+            job.status = PROCESSANDO
+            job.iniciado_em = time.time()
+            status = FALHOU
+            try:
+                job.resultado = self.processar(job)
+                status = CONCLUIDO
+            except Exception as e:
+                job.erro = str(e)
+            finally:
+                try:
+                    os.remove(job.caminho)
+                except OSError:
+                    pass
+                # concluido_em antes do status: _limpar só vê jobs terminados com horário
+                job.concluido_em = time.time()
+                job.status = status
+                self._fila.task_done()
+
+    def _limpar(self):
+        """Remove jobs terminados vencidos (chamado com o lock)"""
+        agora = time.time()
+        vencidos = [jid for jid, j in self._jobs.items()
+                    if j.terminado and agora - j.concluido_em > self.ttl_concluidos]
+        for jid in vencidos:
+            del self._jobs[jid]
+        if len(self._jobs) >= MAX_JOBS:
+            terminados = sorted((j for j in self._jobs.values() if j.terminado), key=lambda j: j.concluido_em)
+            for job in terminados[:len(self._jobs) - MAX_JOBS + 1]:
+                del self._jobs[job.id]
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Extração de imagens em memória
+Obtém os bytes das imagens direto do membro do xlsx e entrega buffers prontos
+para storbinary / sftp.putfo, sem arquivos temporários
+"""
+
+import io
+
+from metricas import TEMPO_EXTRACAO
+
+
+def extrair_bytes_imagem(image):
+    """
+    Obtém os bytes de uma imagem do openpyxl sem passar por disco
+
+    Aceita também bytes já lidos do zip (leitor_xlsx_zip). Tenta, em ordem:
+    _data(), ref (BytesIO ou callable), data e, por último, image.save() em
+    um BytesIO.
+
+    Raises:
+        ValueError: se nenhum método retornar dados
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        if len(image) > 0:
+            return bytes(image)
+        raise ValueError("Não foi possível extrair dados da imagem")
+
+    # Bytes já lidos do zip foram medidos na leitura (mapear_imagens_xlsx)
+    with TEMPO_EXTRACAO.medir():
+        return _extrair_de_objeto(image)
+
+
+def _extrair_de_objeto(image):
+    """Métodos 1 a 4 de extrair_bytes_imagem para objetos do openpyxl"""
+    # Método 1: _data() (lê o membro xl/media/* já carregado pelo openpyxl)
+    data = getattr(image, '_data', None)
+    if data is not None:
+        try:
+            dados = data() if callable(data) else data
+            if dados:
+                return bytes(dados)
+        except Exception:
+            pass
+
+    # Método 2: ref (BytesIO, possivelmente já lido)
+    ref = getattr(image, 'ref', None)
+    if ref is not None:
+        try:
+            if hasattr(ref, 'read'):
+                if hasattr(ref, 'seek'):
+                    ref.seek(0)
+                dados = ref.read()
+            elif callable(ref):
+                dados = ref()
+            else:
+                dados = None
+            if isinstance(dados, (bytes, bytearray, memoryview)) and len(dados) > 0:
+                return bytes(dados)
+        except Exception:
+            pass
+
+    # Método 3: data
+    dados = getattr(image, 'data', None)
+    if isinstance(dados, (bytes, bytearray, memoryview)) and len(dados) > 0:
+        return bytes(dados)
+
+    # Método 4: image.save() em memória
+    if callable(getattr(image, 'save', None)):
+        try:
+            buffer = io.BytesIO()
+            image.save(buffer)
+            if buffer.tell() > 0:
+                return buffer.getvalue()
+        except Exception:
+            pass
+
+    raise ValueError("Não foi possível extrair dados da imagem")
+
+
+def buffer_imagem(dados):
+    """Buffer somente leitura para storbinary/putfo (BytesIO compartilha os bytes, sem cópia)"""
+    return io.BytesIO(dados)
+
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Índice de desenhos de uma planilha
+Construído em uma única passada: âncoras (linha, coluna) → imagens e
+REF → linha, para casar REFs e imagens em O(linhas + imagens)
+"""
+
+# Valores da coluna REF que não são produtos
+REFS_IGNORADAS = ('TOTAL', 'SUBTOTAL')
+
+
+def ref_valida(valor):
+    """Retorna a REF normalizada ou None se a célula não for um produto"""
+    if not valor:
+        return None
+    ref = str(valor).strip()
+    if not ref or ref.upper() in REFS_IGNORADAS:
+        return None
+    return ref
+
+
+def indice_coluna(coluna):
+    """Converte letra(s) da coluna para índice 1-based ('A' → 1, 'H' → 8)"""
+    if isinstance(coluna, int):
+        return coluna
+    indice = 0
+    for c in coluna.upper():
+        indice = indice * 26 + (ord(c) - ord('A') + 1)
+    return indice
+
+
+def posicao_ancora(anchor):
+    """(linha, coluna) 1-based da célula de origem de uma âncora do openpyxl"""
+    origem = getattr(anchor, '_from', None)
+    if origem is not None:
+        return origem.row + 1, origem.col + 1
+    if hasattr(anchor, 'row') and hasattr(anchor, 'col'):
+        return anchor.row + 1, anchor.col + 1
+    return None
+
+
+class IndiceDesenhos:
+    """Mapeia âncoras e REFs de uma planilha para consultas O(1)"""
+
+    def __init__(self):
+        self.ancoras = {}        # (linha, coluna) → [imagem, ...]
+        self.refs = []           # [(linha, ref)] na ordem da planilha
+        self.linha_por_ref = {}  # ref → primeira linha em que aparece
+
+    def adicionar_ref(self, linha, valor):
+        ref = ref_valida(valor)
+        if ref is None:
+            return
+        self.refs.append((linha, ref))
+        self.linha_por_ref.setdefault(ref, linha)
+
+    def adicionar_imagem(self, linha, coluna, imagem):
+        self.ancoras.setdefault((linha, indice_coluna(coluna)), []).append(imagem)
+
+    def imagens_em(self, linha, coluna):
+        """Imagens ancoradas na célula (lista vazia se não houver)"""
+        return self.ancoras.get((linha, indice_coluna(coluna)), [])
+
+    def imagem_da_ref(self, ref, coluna='H'):
+        """Primeira imagem ancorada na coluna, na linha da REF"""
+        linha = self.linha_por_ref.get(ref)
+        if linha is None:
+            return None
+        imagens = self.imagens_em(linha, coluna)
+        return imagens[0] if imagens else None
+
+    def pares(self, coluna='H'):
+        """Gera (linha, ref, imagem) para cada REF com imagem na coluna"""
+        col = indice_coluna(coluna)
+        for linha, ref in self.refs:
+            imagens = self.ancoras.get((linha, col))
+            if imagens:
+                yield linha, ref, imagens[0]
+
+    @property
+    def total_imagens(self):
+        return sum(len(imagens) for imagens in self.ancoras.values())
+
+    @classmethod
+    def de_worksheet(cls, worksheet, coluna_ref='A', linha_inicial=4):
+        """Constrói o índice a partir de uma planilha do openpyxl"""
+        indice = cls()
+        col_ref = indice_coluna(coluna_ref)
+        linhas = worksheet.iter_rows(min_row=linha_inicial, min_col=col_ref, max_col=col_ref, values_only=True)
+        for linha, (valor,) in enumerate(linhas, start=linha_inicial):
+            indice.adicionar_ref(linha, valor)
+
+        for imagem in getattr(worksheet, '_images', []):
+            posicao = posicao_ancora(getattr(imagem, 'anchor', None))
+            if posicao:
+                indice.adicionar_imagem(posicao[0], posicao[1], imagem)
+        return indice
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Leitor de xlsx direto do zip, sem carregar o workbook no openpyxl
+Lê apenas os membros necessários (workbook, rels, drawing da planilha ativa,
+só os <si> referenciados de sharedStrings e a coluna REF da planilha em
+streaming) e casa REFs com imagens pela posição das âncoras, como o
+detector_corrigido
+"""
+
+import posixpath
+import re
+import zipfile
+from array import array
+import xml.etree.ElementTree as ET
+
+from indice_desenhos import IndiceDesenhos, indice_coluna
+from metricas import TEMPO_WORKBOOK, TEMPO_ANCORAS, TEMPO_EXTRACAO
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_XDR = '{http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing}'
+NS_A = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+NS_R = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+TIPO_DOCUMENTO = '/officeDocument'
+TIPO_DRAWING = '/drawing'
+TIPO_IMAGEM = '/image'
+
+
+def resolver_alvo(origem, alvo):
+    """Caminho no zip do Target de uma relação, relativo ao membro de origem"""
+    if alvo.startswith('/'):
+        return alvo.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(origem), alvo))
+
+
+def caminho_rels(membro):
+    """xl/drawings/drawing1.xml → xl/drawings/_rels/drawing1.xml.rels"""
+    pasta, nome = posixpath.split(membro)
+    return posixpath.join(pasta, '_rels', nome + '.rels')
+
+
+def separar_celula(referencia):
+    """'H23' → (23, 8); retorna None se a referência não tiver linha"""
+    letras = ''.join(c for c in referencia if c.isalpha())
+    digitos = ''.join(c for c in referencia if c.isdigit())
+    if not letras or not digitos:
+        return None
+    return int(digitos), indice_coluna(letras)
+
+
+def valor_numerico(texto):
+    """Converte o <v> de uma célula numérica como o openpyxl faria (int ou float)"""
+    try:
+        return int(texto)
+    except ValueError:
+        try:
+            return float(texto)
+        except ValueError:
+            return texto
+
+
+def texto_rich(elemento):
+    """Texto de um <si>/<is>: <t> direto ou runs <r><t>, ignorando <rPh>"""
+    partes = []
+    for filho in elemento:
+        if filho.tag == NS_MAIN + 't':
+            partes.append(filho.text or '')
+        elif filho.tag == NS_MAIN + 'r':
+            t = filho.find(NS_MAIN + 't')
+            if t is not None:
+                partes.append(t.text or '')
+    return ''.join(partes)
+
+
+# Início de cada <si> (com ou sem prefixo de namespace) e a tag raiz <sst>
+RE_SI = re.compile(rb'<(?:[\w.-]+:)?si[\s/>]')
+RE_SST = re.compile(rb'<((?:[\w.-]+:)?sst)\b[^>]*>')
+
+
+class TabelaSharedStrings:
+    """
+    Tabela de shared strings compacta e preguiçosa
+
+    Guarda o sharedStrings.xml como um único bloco de bytes e um array com o
+    offset de cada <si>; só os índices consultados são decodificados (e
+    ficam em cache).
+    """
+
+    def __init__(self, dados):
+        self._dados = dados
+        raiz = RE_SST.search(dados)
+        if raiz is None or raiz.group(0).endswith(b'/>'):
+            self._abertura = b''
+            self._fechamento = b''
+            self._offsets = array('Q')
+            return
+        # A raiz original (com os xmlns) embrulha cada <si> para o parse isolado
+        self._abertura = raiz.group(0)
+        self._fechamento = b'</' + raiz.group(1) + b'>'
+        self._offsets = array('Q', (m.start() for m in RE_SI.finditer(dados, raiz.end())))
+        fim = dados.rfind(self._fechamento)
+        self._fim = fim if fim >= 0 else len(dados)
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, indice):
+        if indice < 0 or indice >= len(self._offsets):
+            raise IndexError(indice)
+        valor = self._cache.get(indice)
+        if valor is None:
+            inicio = self._offsets[indice]
+            fim = self._offsets[indice + 1] if indice + 1 < len(self._offsets) else self._fim
+            raiz = ET.fromstring(self._abertura + self._dados[inicio:fim] + self._fechamento)
+            valor = texto_rich(raiz[0]) if len(raiz) else ''
+            self._cache[indice] = valor
+        return valor
+
+    def get(self, indice, padrao=None):
+        try:
+            return self[indice]
+        except IndexError:
+            return padrao
+
+
+class LeitorXlsxZip:
+    """Acesso de baixo nível à planilha ativa de um xlsx, membro a membro"""
+
+    def __init__(self, arquivo):
+        """
+        Args:
+            arquivo: caminho ou objeto file-like (seekable) do xlsx
+        """
+        self.zip = zipfile.ZipFile(arquivo, 'r')
+        self._membros = set(self.zip.namelist())
+        self._planilha = None
+        self._tabela_strings = None
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def relacoes(self, membro):
+        """{Id: (Type, caminho no zip)} do .rels do membro (vazio se não existir)"""
+        rels = caminho_rels(membro)
+        if rels not in self._membros:
+            return {}
+        raiz = ET.fromstring(self.zip.read(rels))
+        relacoes = {}
+        for rel in raiz.iter(NS_REL + 'Relationship'):
+            if rel.get('TargetMode') == 'External':
+                continue
+            relacoes[rel.get('Id')] = (rel.get('Type', ''), resolver_alvo(membro, rel.get('Target', '')))
+        return relacoes
+
+    def caminho_workbook(self):
+        """Membro do workbook apontado por _rels/.rels (padrão xl/workbook.xml)"""
+        for tipo, alvo in self.relacoes('').values():
+            if tipo.endswith(TIPO_DOCUMENTO):
+                return alvo
+        return 'xl/workbook.xml'
+
+    def caminho_planilha_ativa(self):
+        """Membro XML da planilha ativa (activeTab do workbook, como workbook.active)"""
+        if self._planilha:
+            return self._planilha
+        workbook = self.caminho_workbook()
+        raiz = ET.fromstring(self.zip.read(workbook))
+        ativa = 0
+        view = raiz.find(f'{NS_MAIN}bookViews/{NS_MAIN}workbookView')
+        if view is not None:
+            ativa = int(view.get('activeTab', 0))
+        planilhas = raiz.findall(f'{NS_MAIN}sheets/{NS_MAIN}sheet')
+        if not planilhas:
+            raise ValueError('Workbook sem planilhas')
+        if ativa >= len(planilhas):
+            ativa = 0
+        rels = self.relacoes(workbook)
+        self._planilha = rels[planilhas[ativa].get(NS_R + 'id')][1]
+        return self._planilha
+
+    def caminho_shared_strings(self):
+        """Membro sharedStrings do workbook (None se não existir)"""
+        membro = 'xl/sharedStrings.xml'
+        for tipo, alvo in self.relacoes(self.caminho_workbook()).values():
+            if tipo.endswith('/sharedStrings'):
+                membro = alvo
+        return membro if membro in self._membros else None
+
+    def tabela_strings(self):
+        """TabelaSharedStrings do workbook, lida na primeira consulta"""
+        if self._tabela_strings is None:
+            membro = self.caminho_shared_strings()
+            self._tabela_strings = TabelaSharedStrings(self.zip.read(membro) if membro else b'')
+        return self._tabela_strings
+
+    def shared_strings(self, indices):
+        """Resolve só os índices pedidos da tabela de shared strings"""
+        if not indices:
+            return {}
+        tabela = self.tabela_strings()
+        return {indice: tabela.get(indice) for indice in indices}
+
+    def _celulas_coluna(self, col, linha_inicial, linha_final):
+        """
+        Gera (linha, tipo, texto bruto) das células da coluna em streaming
+
+        Cada <row> é descartado assim que termina e a leitura para na
+        primeira linha depois de linha_final.
+        """
+        planilha = self.caminho_planilha_ativa()
+        sheet_data = None
+        linha_atual = 0
+        col_atual = 0
+        with self.zip.open(planilha) as fp:
+            for evento, elem in ET.iterparse(fp, events=('start', 'end')):
+                tag = elem.tag
+                if evento == 'start':
+                    if tag == NS_MAIN + 'sheetData':
+                        sheet_data = elem
+                    elif tag == NS_MAIN + 'row':
+                        linha_atual = int(elem.get('r', linha_atual + 1))
+                        col_atual = 0
+                        if linha_final is not None and linha_atual > linha_final:
+                            return
+                    continue
+
+                if tag == NS_MAIN + 'c':
+                    posicao = separar_celula(elem.get('r', ''))
+                    col_atual = posicao[1] if posicao else col_atual + 1
+                    if col_atual == col and linha_atual >= linha_inicial:
+                        tipo = elem.get('t', 'n')
+                        if tipo == 'inlineStr':
+                            inline = elem.find(NS_MAIN + 'is')
+                            texto = texto_rich(inline) if inline is not None else None
+                        else:
+                            texto = elem.findtext(NS_MAIN + 'v')
+                        if texto is not None:
+                            yield linha_atual, tipo, texto
+                elif tag == NS_MAIN + 'row':
+                    elem.clear()
+                    if sheet_data is not None:
+                        sheet_data.remove(elem)
+                elif tag == NS_MAIN + 'sheetData':
+                    return
+
+    def ler_coluna(self, coluna='A', linha_inicial=1, linha_final=None):
+        """
+        Lê (linha, valor) de uma coluna da planilha ativa em streaming
+
+        Args:
+            coluna: letra ou índice 1-based da coluna
+            linha_inicial: primeira linha considerada
+            linha_final: última linha lida (None = até o fim da planilha)
+
+        Returns:
+            Lista de (linha, valor) com shared strings já resolvidas
+        """
+        brutos = list(self._celulas_coluna(indice_coluna(coluna), linha_inicial, linha_final))
+        strings = self.shared_strings({int(texto) for _, tipo, texto in brutos if tipo == 's'})
+
+        valores = []
+        for linha, tipo, texto in brutos:
+            if tipo == 's':
+                valor = strings.get(int(texto))
+            elif tipo in ('inlineStr', 'str', 'e'):
+                valor = texto
+            elif tipo == 'b':
+                valor = texto == '1'
+            else:
+                valor = valor_numerico(texto)
+            if valor is not None:
+                valores.append((linha, valor))
+        return valores
+
+    def refs_das_ancoras(self, ancoras, colunas, coluna_ref='A', linha_inicial=1):
+        """
+        {linha: ref} das linhas com imagem nas colunas pedidas
+
+        A coluna REF só é lida até a última linha ancorada nessas colunas.
+        """
+        alvo = {indice_coluna(c) for c in colunas}
+        linhas = {a['linha'] for a in ancoras if a['coluna'] in alvo and a['linha'] >= linha_inicial}
+        if not linhas:
+            return {}
+        return {linha: str(valor).strip()
+                for linha, valor in self.ler_coluna(coluna_ref, linha_inicial, max(linhas))
+                if linha in linhas}
+
+    def ancoras(self):
+        """
+        Âncoras de imagem do(s) drawing(s) da planilha ativa
+
+        Returns:
+            Lista de dicts {linha, coluna (1-based), membro, embed_id, anchor_type}
+        """
+        planilha = self.caminho_planilha_ativa()
+        encontradas = []
+        for tipo, drawing in self.relacoes(planilha).values():
+            if not tipo.endswith(TIPO_DRAWING) or drawing not in self._membros:
+                continue
+            imagens = {rid: alvo for rid, (t, alvo) in self.relacoes(drawing).items()
+                       if t.endswith(TIPO_IMAGEM)}
+            with self.zip.open(drawing) as fp:
+                for _, elem in ET.iterparse(fp):
+                    if elem.tag not in (NS_XDR + 'oneCellAnchor', NS_XDR + 'twoCellAnchor'):
+                        continue
+                    origem = elem.find(NS_XDR + 'from')
+                    blip = elem.find(f'.//{NS_A}blip')
+                    if origem is not None and blip is not None:
+                        embed_id = blip.get(NS_R + 'embed')
+                        if embed_id in imagens:
+                            encontradas.append({
+                                'linha': int(origem.findtext(NS_XDR + 'row')) + 1,
+                                'coluna': int(origem.findtext(NS_XDR + 'col')) + 1,
+                                'membro': imagens[embed_id],
+                                'embed_id': embed_id,
+                                'anchor_type': 'OneCellAnchor' if elem.tag == NS_XDR + 'oneCellAnchor' else 'TwoCellAnchor',
+                            })
+                    elem.clear()
+        return encontradas
+
+    def ler_imagem(self, membro):
+        """Bytes de um membro xl/media/*"""
+        return self.zip.read(membro)
+
+    def indice(self, coluna_ref='A', linha_inicial=4):
+        """IndiceDesenhos da planilha ativa; as imagens são os membros xl/media/*"""
+        indice = IndiceDesenhos()
+        for linha, valor in self.ler_coluna(coluna_ref, linha_inicial):
+            indice.adicionar_ref(linha, valor)
+        for ancora in self.ancoras():
+            indice.adicionar_imagem(ancora['linha'], ancora['coluna'], ancora['membro'])
+        return indice
+
+
+def mapear_imagens_xlsx(arquivo, coluna_foto='H', coluna_ref='A', linha_inicial=4):
+    """
+    Casa REFs e imagens de um xlsx lendo só os membros necessários do zip
+
+    Args:
+        arquivo: caminho ou objeto file-like do xlsx
+        coluna_foto: coluna das imagens
+        coluna_ref: coluna das REFs
+        linha_inicial: primeira linha de dados
+
+    Returns:
+        (refs, imagens, total_imagens): refs na ordem da planilha, lista de
+        dicts {ref, row, bytes, filename} e total de imagens ancoradas
+    """
+    with TEMPO_WORKBOOK.medir(leitor='zip'):
+        leitor = LeitorXlsxZip(arquivo)
+    with leitor:
+        with TEMPO_ANCORAS.medir():
+            indice = leitor.indice(coluna_ref, linha_inicial)
+            pares = list(indice.pares(coluna_foto))
+        imagens = []
+        cache = {}
+        for linha, ref, membro in pares:
+            if membro not in cache:
+                with TEMPO_EXTRACAO.medir():
+                    cache[membro] = leitor.ler_imagem(membro)
+            imagens.append({'ref': ref, 'row': linha, 'bytes': cache[membro], 'filename': membro})
+        return [ref for _, ref in indice.refs], imagens, indice.total_imagens
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Estado em cache de um diretório remoto FTP
+Uma listagem (MLSD, ou NLST se o servidor não suportar) por lote, atualizada
+à medida que os uploads terminam; a confirmação de cada envio usa SIZE só do
+arquivo recém-enviado em vez de listar o diretório inteiro
+"""
+
+import ftplib
+
+
+class ListagemRemota:
+    """Arquivos do diretório atual da sessão: nome → {'size', 'modify'}"""
+
+    def __init__(self):
+        self.arquivos = {}
+        self.carregada = False
+        self.metodo = None
+
+    def carregar(self, ftp):
+        """Lista o diretório atual uma única vez (MLSD com tamanhos, senão NLST)"""
+        self.arquivos = {}
+        try:
+            for nome, fatos in ftp.mlsd(facts=['type', 'size', 'modify']):
+                if fatos.get('type', 'file') != 'file':
+                    continue
+                tamanho = fatos.get('size')
+                self.arquivos[nome] = {
+                    'size': int(tamanho) if tamanho and tamanho.isdigit() else None,
+                    'modify': fatos.get('modify'),
+                }
+            self.metodo = 'MLSD'
+        except ftplib.error_perm:
+            for nome in ftp.nlst():
+                self.arquivos[nome.rsplit('/', 1)[-1]] = {'size': None, 'modify': None}
+            self.metodo = 'NLST'
+        self.carregada = True
+        return len(self.arquivos)
+
+    def contem(self, nome):
+        return nome in self.arquivos
+
+    def tamanho(self, nome):
+        info = self.arquivos.get(nome)
+        return info['size'] if info else None
+
+    def presente(self, nome, tamanho=None):
+        """
+        False se a listagem mostra que `nome` sumiu ou tem outro tamanho
+
+        Sem listagem carregada (ou sem tamanho conhecido) não há como
+        desmentir, então o arquivo é dado como presente.
+        """
+        if not self.carregada:
+            return True
+        if nome not in self.arquivos:
+            return False
+        remoto = self.arquivos[nome]['size']
+        return tamanho is None or remoto is None or remoto == tamanho
+
+    def registrar(self, nome, tamanho=None, modify=None):
+        """Atualiza o cache após um envio"""
+        self.arquivos[nome] = {'size': tamanho, 'modify': modify}
+
+    def remover(self, nome):
+        self.arquivos.pop(nome, None)
+
+    def verificar_envio(self, ftp, nome, tamanho_esperado):
+        """
+        Confirma um upload com SIZE do próprio arquivo e atualiza o cache
+
+        Returns:
+            True se o tamanho remoto bate (ou se o servidor não suporta SIZE),
+            False se o arquivo não existe ou tem outro tamanho
+        """
+        try:
+            tamanho = ftp.size(nome)
+        except ftplib.error_perm as e:
+            if str(e).startswith('550'):
+                self.remover(nome)
+                return False
+            # SIZE não suportado: considera o STOR bem-sucedido suficiente
+            self.registrar(nome, tamanho_esperado)
+            return True
+        self.registrar(nome, tamanho)
+        return tamanho is None or tamanho == tamanho_esperado
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Manifesto local de uploads (SQLite)
+Guarda REF → hash do conteúdo → tamanho/mtime remotos por destino, para que
+imagens idênticas às já enviadas (e ainda no servidor com o tamanho gravado)
+não sejam transferidas de novo; as derivadas (miniaturas/WebP) de cada REF
+ficam registradas com o hash do original
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Caminho do banco (MANIFESTO_UPLOADS, padrão ao lado do código)
+CAMINHO_PADRAO = os.getenv(
+    'MANIFESTO_UPLOADS',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manifesto_uploads.sqlite3')
+)
+
+
+def hash_conteudo(dados):
+    """SHA-256 hexadecimal dos bytes da imagem"""
+    return hashlib.sha256(dados).hexdigest()
+
+
+def destino_ftp(host, user, diretorio, port=21):
+    """Identificador do destino remoto usado como chave no manifesto"""
+    return f"ftp://{user}@{host}:{port}/{diretorio.strip('/')}"
+
+
+def metadados_remotos(ftp, nome):
+    """(tamanho, mtime) do arquivo remoto via SIZE/MDTM; None no que o servidor não suportar"""
+    tamanho = None
+    mtime = None
+    try:
+        tamanho = ftp.size(nome)
+    except Exception:
+        pass
+    try:
+        resposta = ftp.sendcmd(f'MDTM {nome}')
+        if resposta.startswith('213'):
+            mtime = resposta[4:].strip()
+    except Exception:
+        pass
+    return tamanho, mtime
+
+
+class ManifestoUploads:
+    """Manifesto persistente e thread-safe de imagens já enviadas"""
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho or CAMINHO_PADRAO
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(self.caminho, check_same_thread=False, timeout=30)
+        with self._lock, self._conexao:
+            self._conexao.execute('PRAGMA journal_mode=WAL')
+            self._conexao.execute(
+                'CREATE TABLE IF NOT EXISTS uploads ('
+                ' destino TEXT NOT NULL,'
+                ' ref TEXT NOT NULL,'
+                ' hash TEXT NOT NULL,'
+                ' tamanho INTEGER,'
+                ' mtime TEXT,'
+                ' enviado_em REAL NOT NULL,'
+                ' PRIMARY KEY (destino, ref))'
+            )
+            self._conexao.execute(
+                'CREATE TABLE IF NOT EXISTS derivadas ('
+                ' destino TEXT NOT NULL,'
+                ' ref TEXT NOT NULL,'
+                ' hash_origem TEXT NOT NULL,'
+                ' arquivos TEXT NOT NULL,'
+                ' enviado_em REAL NOT NULL,'
+                ' PRIMARY KEY (destino, ref))'
+            )
+
+    def consultar(self, destino, ref):
+        """Registro {hash, tamanho, mtime, enviado_em} da REF no destino, ou None"""
+        with self._lock:
+            linha = self._conexao.execute(
+                'SELECT hash, tamanho, mtime, enviado_em FROM uploads WHERE destino = ? AND ref = ?',
+                (destino, ref)
+            ).fetchone()
+        if linha is None:
+            return None
+        return {'hash': linha[0], 'tamanho': linha[1], 'mtime': linha[2], 'enviado_em': linha[3]}
+
+    def inalterada(self, destino, ref, hash_atual, listagem=None, nome=None):
+        """
+        True se a REF já foi enviada ao destino com exatamente este conteúdo
+
+        Com `listagem` (ListagemRemota carregada do destino) o arquivo `nome`
+        também precisa continuar no servidor com o tamanho gravado no envio;
+        apagado ou truncado por fora, a REF volta a ser enviada. Sem listagem
+        o manifesto é confiado como está.
+        """
+        registro = self.consultar(destino, ref)
+        if registro is None or registro['hash'] != hash_atual:
+            return False
+        return listagem is None or listagem.presente(nome or f'{ref}.jpg', registro['tamanho'])
+
+    def registrar(self, destino, ref, hash_atual, tamanho=None, mtime=None):
+        """Grava (ou substitui) o upload bem-sucedido da REF"""
+        with self._lock, self._conexao:
+            self._conexao.execute(
+                'INSERT OR REPLACE INTO uploads (destino, ref, hash, tamanho, mtime, enviado_em)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (destino, ref, hash_atual, tamanho, mtime, time.time())
+            )
+
+    def consultar_derivadas(self, destino, ref):
+        """Derivadas enviadas da REF: {hash_origem, arquivos: {nome: tamanho}, enviado_em} ou None"""
+        with self._lock:
+            linha = self._conexao.execute(
+                'SELECT hash_origem, arquivos, enviado_em FROM derivadas WHERE destino = ? AND ref = ?',
+                (destino, ref)
+            ).fetchone()
+        if linha is None:
+            return None
+        return {'hash_origem': linha[0], 'arquivos': json.loads(linha[1]), 'enviado_em': linha[2]}
+
+    def derivadas_atualizadas(self, destino, ref, hash_origem, nomes):
+        """True se todas as derivadas `nomes` já foram geradas deste mesmo original"""
+        registro = self.consultar_derivadas(destino, ref)
+        return (registro is not None and registro['hash_origem'] == hash_origem
+                and set(nomes) <= set(registro['arquivos']))
+
+    def registrar_derivadas(self, destino, ref, hash_origem, arquivos):
+        """Grava as derivadas enviadas da REF ({nome remoto: tamanho})"""
+        with self._lock, self._conexao:
+            self._conexao.execute(
+                'INSERT OR REPLACE INTO derivadas (destino, ref, hash_origem, arquivos, enviado_em)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (destino, ref, hash_origem, json.dumps(arquivos, sort_keys=True), time.time())
+            )
+
+    def esquecer(self, destino, ref=None):
+        """Remove a REF (ou o destino inteiro) para forçar novo envio"""
+        with self._lock, self._conexao:
+            for tabela in ('uploads', 'derivadas'):
+                if ref is None:
+                    self._conexao.execute(f'DELETE FROM {tabela} WHERE destino = ?', (destino,))
+                else:
+                    self._conexao.execute(f'DELETE FROM {tabela} WHERE destino = ? AND ref = ?', (destino, ref))
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
+
+
+_manifesto = None
+_manifesto_lock = threading.Lock()
+
+
+def obter_manifesto():
+    """Manifesto compartilhado do processo, aberto na primeira chamada"""
+    global _manifesto
+    with _manifesto_lock:
+        if _manifesto is None:
+            _manifesto = ManifestoUploads()
+        return _manifesto
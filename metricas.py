@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Métricas no formato texto do Prometheus (/metrics)
+Contadores, histogramas e medidores agregados em memória sem lock no caminho
+quente: cada thread escreve no seu próprio fragmento e a soma só acontece na
+coleta. Fragmentos de threads que já terminaram são consolidados na coleta,
+então pools de threads criados por lote não fazem a memória crescer.
+
+As métricas do pipeline de upload ficam definidas aqui (TEMPO_MULTIPART,
+TEMPO_WORKBOOK, ...) para todos os servidores registrarem nos mesmos nomes.
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Limites dos histogramas de tempo (segundos) e de tamanho (bytes)
+BUCKETS_TEMPO = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKETS_BYTES = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _formatar_rotulos(nomes, valores, extra=None):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return repr(valor) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    """Base: fragmentos por thread, consolidados na coleta"""
+
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=(), registro=None):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._local = threading.local()
+        self._fragmentos = []
+        self._base = {}
+        self._lock = threading.Lock()
+        (registro or REGISTRO).registrar(self)
+
+    def _fragmento(self):
+        fragmento = getattr(self._local, 'valores', None)
+        if fragmento is None:
+            fragmento = self._local.valores = {}
+            with self._lock:
+                # Threads novas a cada pool: a lista fica limitada às threads vivas
+                self._consolidar_encerrados()
+                self._fragmentos.append((threading.current_thread(), fragmento))
+        return fragmento
+
+    def _consolidar_encerrados(self):
+        """Soma na base os fragmentos das threads encerradas (chamado com o lock)"""
+        vivos = []
+        for thread, fragmento in self._fragmentos:
+            if thread.is_alive():
+                vivos.append((thread, fragmento))
+            else:
+                for chave, valor in list(fragmento.items()):
+                    self._somar_em(self._base, chave, valor)
+        self._fragmentos = vivos
+
+    def _chave(self, rotulos):
+        if len(rotulos) != len(self.rotulos):
+            raise ValueError(f"{self.nome}: rótulos esperados {self.rotulos}, recebidos {tuple(rotulos)}")
+        return tuple(str(rotulos[nome]) for nome in self.rotulos)
+
+    def _somar_em(self, destino, chave, valor):
+        raise NotImplementedError
+
+    def _coletar(self):
+        """{chave: valor} somando a base e os fragmentos vivos (consolida os das threads encerradas)"""
+        with self._lock:
+            self._consolidar_encerrados()
+            total = {}
+            for chave, valor in self._base.items():
+                self._somar_em(total, chave, valor)
+            for _, fragmento in self._fragmentos:
+                for chave, valor in list(fragmento.items()):
+                    self._somar_em(total, chave, valor)
+        return total
+
+    def exportar(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} {self.tipo}']
+        for chave, valor in sorted(self._coletar().items()):
+            linhas.extend(self._linhas(chave, valor))
+        return linhas
+
+    def _linhas(self, chave, valor):
+        return [f'{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_numero(valor)}']
+
+
+class Contador(_Metrica):
+    """Contador monotônico (o nome deve terminar em _total)"""
+
+    tipo = 'counter'
+
+    def inc(self, valor=1, **rotulos):
+        fragmento = self._fragmento()
+        chave = self._chave(rotulos)
+        fragmento[chave] = fragmento.get(chave, 0) + valor
+
+    def _somar_em(self, destino, chave, valor):
+        destino[chave] = destino.get(chave, 0) + valor
+
+
+class Medidor(Contador):
+    """
+    Valor que sobe e desce (inc/dec podem vir de threads diferentes)
+
+    Com `funcao`, o valor é lido na coleta (ex.: tamanho de uma fila).
+    """
+
+    tipo = 'gauge'
+
+    def __init__(self, nome, ajuda, rotulos=(), registro=None, funcao=None):
+        super().__init__(nome, ajuda, rotulos, registro)
+        self.funcao = funcao
+
+    def dec(self, valor=1, **rotulos):
+        self.inc(-valor, **rotulos)
+
+    @contextmanager
+    def em_andamento(self, **rotulos):
+        """Soma 1 enquanto o bloco executa"""
+        self.inc(**rotulos)
+        try:
+            yield
+        finally:
+            self.dec(**rotulos)
+
+    def _coletar(self):
+        if self.funcao is None:
+            return super()._coletar()
+        valor = self.funcao()
+        return {} if valor is None else {(): valor}
+
+
+class Histograma(_Metrica):
+    """Histograma com limites fixos; o valor de cada chave é [contagens por faixa, soma]"""
+
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, buckets=BUCKETS_TEMPO, rotulos=(), registro=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(nome, ajuda, rotulos, registro)
+
+    def observar(self, valor, **rotulos):
+        fragmento = self._fragmento()
+        chave = self._chave(rotulos)
+        dados = fragmento.get(chave)
+        if dados is None:
+            dados = fragmento[chave] = [[0] * (len(self.buckets) + 1), 0.0]
+        dados[0][bisect.bisect_left(self.buckets, valor)] += 1
+        dados[1] += valor
+
+    @contextmanager
+    def medir(self, **rotulos):
+        """Observa a duração do bloco (também quando ele levanta exceção)"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **rotulos)
+
+    def _somar_em(self, destino, chave, valor):
+        atual = destino.get(chave)
+        if atual is None:
+            destino[chave] = [list(valor[0]), valor[1]]
+        else:
+            for i, contagem in enumerate(valor[0]):
+                atual[0][i] += contagem
+            atual[1] += valor[1]
+
+    def _linhas(self, chave, valor):
+        contagens, soma = valor
+        linhas = []
+        acumulado = 0
+        for limite, contagem in zip(self.buckets + (float('inf'),), contagens):
+            acumulado += contagem
+            rotulos = _formatar_rotulos(self.rotulos, chave, f'le="{_numero(float(limite))}"')
+            linhas.append(f'{self.nome}_bucket{rotulos} {acumulado}')
+        rotulos = _formatar_rotulos(self.rotulos, chave)
+        linhas.append(f'{self.nome}_sum{rotulos} {_numero(round(soma, 6))}')
+        linhas.append(f'{self.nome}_count{rotulos} {acumulado}')
+        return linhas
+
+
+class RegistroMetricas:
+    """Conjunto de métricas exportadas juntas"""
+
+    def __init__(self):
+        self._metricas = []
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica):
+        with self._lock:
+            if any(m.nome == metrica.nome for m in self._metricas):
+                raise ValueError(f"Métrica duplicada: {metrica.nome}")
+            self._metricas.append(metrica)
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus (0.0.4)"""
+        with self._lock:
+            metricas = list(self._metricas)
+        linhas = []
+        for metrica in metricas:
+            linhas.extend(metrica.exportar())
+        return '\n'.join(linhas) + '\n'
+
+
+REGISTRO = RegistroMetricas()
+
+
+def rss_bytes():
+    """RSS do próprio processo (/proc/self/statm); None fora do Linux"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# Métricas do pipeline de upload
+TEMPO_MULTIPART = Histograma('upload_multipart_parse_seconds', 'Leitura do corpo multipart do /upload')
+TEMPO_WORKBOOK = Histograma('upload_workbook_load_seconds', 'Abertura da planilha (openpyxl ou leitura direta do zip)',
+                            rotulos=('leitor',))
+TEMPO_ANCORAS = Histograma('upload_anchor_detection_seconds', 'Casamento das âncoras de imagem com as REFs')
+TEMPO_EXTRACAO = Histograma('upload_image_extraction_seconds', 'Extração dos bytes de uma imagem')
+TEMPO_TRANSFERENCIA = Histograma('upload_transfer_seconds', 'Envio de uma imagem ao armazenamento remoto',
+                                 rotulos=('backend', 'resultado'))
+BYTES_TRANSFERENCIA = Histograma('upload_transfer_bytes', 'Tamanho das imagens enviadas com sucesso',
+                                 buckets=BUCKETS_BYTES, rotulos=('backend',))
+ERROS_BACKEND = Contador('upload_backend_errors_total', 'Tentativas de envio que falharam, por backend e tipo de erro',
+                         rotulos=('backend', 'tipo'))
+JOBS_EM_ANDAMENTO = Medidor('upload_jobs_in_flight', 'Planilhas sendo processadas agora')
+MEMORIA_RSS = Medidor('process_resident_memory_bytes', 'Memória residente do processo', funcao=rss_bytes)
+
+
+def registrar_erro(backend, erro):
+    """Conta uma tentativa que falhou (erro: exceção ou descrição curta)"""
+    tipo = type(erro).__name__ if isinstance(erro, BaseException) else str(erro)
+    ERROS_BACKEND.inc(backend=backend, tipo=tipo)
+
+
+def registrar_transferencia(backend, segundos, tamanho=None, erro=None):
+    """
+    Registra o resultado final do envio de uma imagem
+
+    Args:
+        erro: None se enviou; a exceção (ou False/descrição) se falhou de vez.
+            As tentativas intermediárias são contadas por quem repete
+            (com_retentativas, PoolConexoesFTP.executar).
+    """
+    if erro is None:
+        TEMPO_TRANSFERENCIA.observar(segundos, backend=backend, resultado='ok')
+        if tamanho is not None:
+            BYTES_TRANSFERENCIA.observar(tamanho, backend=backend)
+    else:
+        TEMPO_TRANSFERENCIA.observar(segundos, backend=backend, resultado='falha')
+        registrar_erro(backend, erro if erro is not False else 'falha')
+
+
+def exportar_metricas():
+    return REGISTRO.exportar()
+
+
+def responder_metricas(handler):
+    """GET /metrics para servidores BaseHTTPRequestHandler"""
+    corpo = exportar_metricas().encode('utf-8')
+    handler.send_response(200)
+    handler.send_header('Content-Type', CONTENT_TYPE)
+    handler.send_header('Content-Length', str(len(corpo)))
+    handler.end_headers()
+    handler.wfile.write(corpo)
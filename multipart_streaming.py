@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parser multipart/form-data incremental para os handlers BaseHTTPRequestHandler
+Lê o corpo em blocos direto do rfile, grava a parte do arquivo em um buffer
+spooled (memória até um limite, disco acima disso) e aplica o tamanho máximo
+antes de ler o corpo
+"""
+
+import os
+import re
+import tempfile
+
+# Tamanho máximo do upload (MAX_UPLOAD_MB, padrão 50 MB)
+TAMANHO_MAXIMO_PADRAO = int(os.getenv('MAX_UPLOAD_MB', '50')) * 1024 * 1024
+# Tamanho de cada leitura do socket
+TAMANHO_BLOCO = 64 * 1024
+# Acima disso o arquivo recebido vai para disco
+LIMITE_MEMORIA = 1024 * 1024
+# Limites para cabeçalhos de parte e campos simples
+MAX_CABECALHOS = 16 * 1024
+MAX_CAMPO = 64 * 1024
+
+
+class ErroMultipart(Exception):
+    """Corpo multipart inválido ou incompleto"""
+
+
+class ArquivoMuitoGrande(ErroMultipart):
+    """Upload maior que o tamanho máximo permitido"""
+
+
+class ArquivoRecebido:
+    """Arquivo extraído do multipart, pronto para openpyxl/zipfile"""
+
+    def __init__(self, filename, arquivo, tamanho, campos):
+        self.filename = filename
+        self.arquivo = arquivo
+        self.tamanho = tamanho
+        self.campos = campos
+
+    def close(self):
+        self.arquivo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def extrair_boundary(content_type):
+    """Extrai o boundary do cabeçalho Content-Type"""
+    match = re.search(r'boundary=(?:"([^"]+)"|([^;\s]+))', content_type or '')
+    if not match:
+        return None
+    return match.group(1) or match.group(2)
+
+
+def _parse_cabecalhos(bloco):
+    """Retorna (name, filename) do Content-Disposition da parte"""
+    nome = None
+    filename = None
+    for linha in bloco.decode('utf-8', errors='replace').split('\r\n'):
+        if linha.lower().startswith('content-disposition:'):
+            m = re.search(r'(?<![\w*])name="([^"]*)"', linha)
+            if m:
+                nome = m.group(1)
+            m = re.search(r'filename="([^"]*)"', linha) or re.search(r"filename='([^']*)'", linha)
+            if m:
+                filename = os.path.basename(m.group(1).replace('\\', '/'))
+    return nome, filename
+
+
+def ler_arquivo_multipart(rfile, headers, campo_arquivo=None, tamanho_maximo=None,
+                          tamanho_bloco=TAMANHO_BLOCO, limite_memoria=LIMITE_MEMORIA):
+    """
+    Lê um corpo multipart/form-data de forma incremental
+
+    Args:
+        rfile: stream de entrada do handler (self.rfile)
+        headers: cabeçalhos da requisição (self.headers)
+        campo_arquivo: nome do campo do arquivo (None = primeira parte com filename)
+        tamanho_maximo: limite do corpo em bytes (padrão MAX_UPLOAD_MB)
+
+    Returns:
+        ArquivoRecebido com o arquivo posicionado no início
+
+    Raises:
+        ArquivoMuitoGrande: Content-Length ou arquivo acima do limite
+        ErroMultipart: boundary ausente, corpo truncado ou sem arquivo
+    """
+    tamanho_maximo = tamanho_maximo or TAMANHO_MAXIMO_PADRAO
+
+    boundary = extrair_boundary(headers.get('Content-Type', ''))
+    if not boundary:
+        raise ErroMultipart('Formato de dados inválido - boundary não encontrado')
+
+    try:
+        restante = int(headers.get('Content-Length', ''))
+    except ValueError:
+        raise ErroMultipart('Content-Length ausente ou inválido')
+    if restante > tamanho_maximo:
+        raise ArquivoMuitoGrande(f'Arquivo maior que o limite de {tamanho_maximo // (1024 * 1024)}MB')
+
+    delimitador = b'\r\n--' + boundary.encode('latin-1')
+    cauda = len(delimitador) + 4
+
+    # O primeiro delimitador não tem CRLF antes; prefixar simplifica a busca
+    buffer = bytearray(b'\r\n')
+    campos = {}
+    arquivo = None
+    filename = None
+    tamanho = 0
+
+    def ler_mais():
+        nonlocal restante
+        if restante <= 0:
+            return False
+        bloco = rfile.read(min(tamanho_bloco, restante))
+        if not bloco:
+            raise ErroMultipart('Corpo da requisição truncado')
+        restante -= len(bloco)
+        buffer.extend(bloco)
+        return True
+
+    def descartar_resto():
+        nonlocal restante
+        while restante > 0:
+            bloco = rfile.read(min(tamanho_bloco, restante))
+            if not bloco:
+                break
+            restante -= len(bloco)
+
+    try:
+        # Preâmbulo até o primeiro delimitador
+        while True:
+            idx = buffer.find(delimitador)
+            if idx >= 0:
+                del buffer[:idx + len(delimitador)]
+                break
+            del buffer[:max(0, len(buffer) - cauda)]
+            if not ler_mais():
+                raise ErroMultipart('Delimitador multipart não encontrado')
+
+        while True:
+            # Após o delimitador: "--" encerra, "\r\n" inicia nova parte
+            while len(buffer) < 2:
+                if not ler_mais():
+                    raise ErroMultipart('Corpo da requisição truncado')
+            if buffer[:2] == b'--':
+                break
+            del buffer[:2]
+
+            # Cabeçalhos da parte
+            while True:
+                fim = buffer.find(b'\r\n\r\n')
+                if fim >= 0:
+                    break
+                if len(buffer) > MAX_CABECALHOS:
+                    raise ErroMultipart('Cabeçalhos da parte muito grandes')
+                if not ler_mais():
+                    raise ErroMultipart('Corpo da requisição truncado')
+            nome, nome_arquivo = _parse_cabecalhos(bytes(buffer[:fim]))
+            del buffer[:fim + 4]
+
+            e_arquivo = (arquivo is None and nome_arquivo is not None
+                         and (campo_arquivo is None or nome == campo_arquivo))
+            if e_arquivo:
+                arquivo = tempfile.SpooledTemporaryFile(max_size=limite_memoria, suffix='.xlsx')
+                filename = nome_arquivo
+            valor = bytearray()
+
+            # Corpo da parte até o próximo delimitador
+            while True:
+                idx = buffer.find(delimitador)
+                pronto = idx if idx >= 0 else max(0, len(buffer) - cauda)
+                if pronto:
+                    trecho = buffer[:pronto]
+                    if e_arquivo:
+                        tamanho += len(trecho)
+                        if tamanho > tamanho_maximo:
+                            raise ArquivoMuitoGrande(f'Arquivo maior que o limite de {tamanho_maximo // (1024 * 1024)}MB')
+                        arquivo.write(trecho)
+                    elif nome_arquivo is None and nome and len(valor) < MAX_CAMPO:
+                        valor.extend(trecho[:MAX_CAMPO - len(valor)])
+                    del buffer[:pronto]
+                if idx >= 0:
+                    del buffer[:len(delimitador)]
+                    break
+                if not ler_mais():
+                    raise ErroMultipart('Corpo da requisição truncado')
+
+            if nome_arquivo is None and nome:
+                campos[nome] = valor.decode('utf-8', errors='replace')
+
+        descartar_resto()
+    except Exception:
+        if arquivo is not None:
+            arquivo.close()
+        raise
+
+    if arquivo is None:
+        raise ErroMultipart('Arquivo não encontrado')
+
+    arquivo.seek(0)
+    return ArquivoRecebido(filename, arquivo, tamanho, campos)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Planilhas xlsx sintéticas para benchmarks e testes de carga
+Gera o xlsx direto no zip (sem openpyxl): REFs na coluna A a partir da linha 4,
+a foto de cada produto ancorada na coluna H e imagens extras nas colunas
+seguintes, com âncoras oneCell, twoCell ou misturadas. O gabarito diz qual
+imagem pertence a cada REF, para conferir o resultado de cada extrator.
+"""
+
+import hashlib
+import io
+import random
+import struct
+import zipfile
+import zlib
+from collections import namedtuple
+from xml.sax.saxutils import escape
+
+LINHA_INICIAL = 4
+COLUNA_FOTO = 7    # H (0-based, como no drawing)
+EMU_POR_PIXEL = 9525
+
+# Tipos de âncora aceitos por gerar_planilha
+ANCORAS = ('one', 'two', 'mixed')
+
+PlanilhaSintetica = namedtuple('PlanilhaSintetica', 'dados gabarito linhas total_imagens')
+PlanilhaSintetica.__doc__ = """
+dados: bytes do xlsx
+gabarito: {ref: sha256 da foto da coluna H}
+linhas: {ref: linha}
+total_imagens: imagens ancoradas (fotos + extras)
+"""
+
+NS = ('xmlns:xdr="http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing" '
+      'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+      'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"')
+REL_BASE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+
+def png_sintetico(largura, altura, semente):
+    """PNG RGB com ruído determinístico (não comprime, então o tamanho acompanha os pixels)"""
+    rng = random.Random(semente)
+    linha = largura * 3
+    bruto = rng.randbytes(linha * altura)
+    dados = b''.join(b'\x00' + bruto[i:i + linha] for i in range(0, len(bruto), linha))
+
+    def bloco(tipo, conteudo):
+        return (struct.pack('>I', len(conteudo)) + tipo + conteudo
+                + struct.pack('>I', zlib.crc32(tipo + conteudo) & 0xffffffff))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + bloco(b'IHDR', struct.pack('>IIBBBBB', largura, altura, 8, 2, 0, 0, 0))
+            + bloco(b'IDAT', zlib.compress(dados, 1))
+            + bloco(b'IEND', b''))
+
+
+def _ancora(tipo, col, linha, largura, altura, rid, numero):
+    """XML de uma âncora de imagem (col/linha 0-based)"""
+    cx, cy = largura * EMU_POR_PIXEL, altura * EMU_POR_PIXEL
+    origem = (f'<xdr:from><xdr:col>{col}</xdr:col><xdr:colOff>0</xdr:colOff>'
+              f'<xdr:row>{linha}</xdr:row><xdr:rowOff>0</xdr:rowOff></xdr:from>')
+    imagem = (f'<xdr:pic><xdr:nvPicPr><xdr:cNvPr id="{numero + 1}" name="Picture {numero}"/>'
+              f'<xdr:cNvPicPr><a:picLocks noChangeAspect="1"/></xdr:cNvPicPr></xdr:nvPicPr>'
+              f'<xdr:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch></xdr:blipFill>'
+              f'<xdr:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+              f'<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></xdr:spPr></xdr:pic><xdr:clientData/>')
+    if tipo == 'one':
+        return f'<xdr:oneCellAnchor>{origem}<xdr:ext cx="{cx}" cy="{cy}"/>{imagem}</xdr:oneCellAnchor>'
+    destino = (f'<xdr:to><xdr:col>{col + 1}</xdr:col><xdr:colOff>0</xdr:colOff>'
+               f'<xdr:row>{linha + 1}</xdr:row><xdr:rowOff>0</xdr:rowOff></xdr:to>')
+    return f'<xdr:twoCellAnchor editAs="oneCell">{origem}{destino}{imagem}</xdr:twoCellAnchor>'
+
+
+def gerar_planilha(linhas=50, imagens_por_linha=1, tamanhos=((200, 200),), ancora='one',
+                   lacuna=0, semente=0):
+    """
+    Gera um xlsx sintético em memória
+
+    Args:
+        linhas: produtos (REFs) a partir da linha 4
+        imagens_por_linha: imagens ancoradas por produto; a primeira fica na
+            coluna H (a foto) e as outras em I, J, ... (não devem ser casadas)
+        tamanhos: lista de (largura, altura) em pixels, usada em ciclo
+        ancora: 'one' (oneCellAnchor), 'two' (twoCellAnchor) ou 'mixed' (alterna)
+        lacuna: se > 0, toda n-ésima REF fica sem imagem nenhuma
+        semente: muda o conteúdo das imagens
+
+    Returns:
+        PlanilhaSintetica
+    """
+    if ancora not in ANCORAS:
+        raise ValueError(f"Âncora inválida: {ancora} (use {', '.join(ANCORAS)})")
+
+    strings = ['PLANILHA SINTÉTICA', 'REF', 'DESCRIÇÃO', 'PHOTO']
+    celulas = [
+        f'<row r="1"><c r="A1" t="s"><v>0</v></c></row>',
+        f'<row r="3"><c r="A3" t="s"><v>1</v></c><c r="B3" t="s"><v>2</v></c><c r="H3" t="s"><v>3</v></c></row>',
+    ]
+    ancoras = []
+    rels_drawing = []
+    midias = {}
+    gabarito = {}
+    linhas_ref = {}
+    numero = 0
+
+    for i in range(linhas):
+        linha = LINHA_INICIAL + i
+        ref = f'REF{i + 1:05d}'
+        strings.extend([ref, f'Produto {i + 1}'])
+        celulas.append(f'<row r="{linha}"><c r="A{linha}" t="s"><v>{len(strings) - 2}</v></c>'
+                       f'<c r="B{linha}" t="s"><v>{len(strings) - 1}</v></c></row>')
+        linhas_ref[ref] = linha
+        if lacuna and (i + 1) % lacuna == 0:
+            continue
+        for j in range(imagens_por_linha):
+            numero += 1
+            largura, altura = tamanhos[(numero - 1) % len(tamanhos)]
+            dados = png_sintetico(largura, altura, f'{semente}:{numero}')
+            nome = f'image{numero}.png'
+            midias[f'xl/media/{nome}'] = dados
+            rid = f'rId{numero}'
+            rels_drawing.append(f'<Relationship Id="{rid}" Type="{REL_BASE}/image" Target="../media/{nome}"/>')
+            tipo = ancora if ancora != 'mixed' else ('one' if numero % 2 else 'two')
+            ancoras.append(_ancora(tipo, COLUNA_FOTO + j, linha - 1, largura, altura, rid, numero))
+            if j == 0:
+                gabarito[ref] = hashlib.sha256(dados).hexdigest()
+
+    total = len(linhas_ref) + LINHA_INICIAL
+    strings.append('TOTAL')
+    celulas.append(f'<row r="{total}"><c r="A{total}" t="s"><v>{len(strings) - 1}</v></c></row>')
+
+    membros = {
+        '[Content_Types].xml': (
+            XML_DECL + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Default Extension="png" ContentType="image/png"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '<Override PartName="/xl/drawings/drawing1.xml" ContentType="application/vnd.openxmlformats-officedocument.drawing+xml"/>'
+            '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            '</Types>'),
+        '_rels/.rels': (
+            XML_DECL + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{REL_BASE}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'),
+        'xl/workbook.xml': (
+            XML_DECL + '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            f'xmlns:r="{REL_BASE}"><bookViews><workbookView activeTab="0"/></bookViews>'
+            '<sheets><sheet name="Produtos" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+        'xl/_rels/workbook.xml.rels': (
+            XML_DECL + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{REL_BASE}/worksheet" Target="worksheets/sheet1.xml"/>'
+            f'<Relationship Id="rId2" Type="{REL_BASE}/sharedStrings" Target="sharedStrings.xml"/>'
+            f'<Relationship Id="rId3" Type="{REL_BASE}/styles" Target="styles.xml"/>'
+            '</Relationships>'),
+        'xl/styles.xml': (
+            XML_DECL + '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+            '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+            '<borders count="1"><border/></borders>'
+            '<cellStyleXfs count="1"><xf/></cellStyleXfs><cellXfs count="1"><xf/></cellXfs>'
+            '</styleSheet>'),
+        'xl/sharedStrings.xml': (
+            XML_DECL + '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            f'count="{len(strings)}" uniqueCount="{len(strings)}">'
+            + ''.join(f'<si><t>{escape(s)}</t></si>' for s in strings) + '</sst>'),
+        'xl/worksheets/sheet1.xml': (
+            XML_DECL + '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            f'xmlns:r="{REL_BASE}"><sheetData>' + ''.join(celulas) + '</sheetData>'
+            + ('<drawing r:id="rId1"/>' if ancoras else '') + '</worksheet>'),
+    }
+    if ancoras:
+        membros['xl/worksheets/_rels/sheet1.xml.rels'] = (
+            XML_DECL + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{REL_BASE}/drawing" Target="../drawings/drawing1.xml"/>'
+            '</Relationships>')
+        membros['xl/drawings/drawing1.xml'] = XML_DECL + f'<xdr:wsDr {NS}>' + ''.join(ancoras) + '</xdr:wsDr>'
+        membros['xl/drawings/_rels/drawing1.xml.rels'] = (
+            XML_DECL + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + ''.join(rels_drawing) + '</Relationships>')
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as xlsx:
+        for nome, conteudo in membros.items():
+            xlsx.writestr(nome, conteudo.encode('utf-8'))
+        for nome, dados in midias.items():
+            # PNG já é comprimido: guardado sem deflate, como o Excel faz
+            xlsx.writestr(nome, dados, compress_type=zipfile.ZIP_STORED)
+    return PlanilhaSintetica(buffer.getvalue(), gabarito, linhas_ref, numero)
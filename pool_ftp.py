@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pool de conexões FTP persistentes
+Mantém sessões já autenticadas e posicionadas no diretório de destino,
+reaproveitadas por todos os caminhos de upload
+"""
+
+import ftplib
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from metricas import registrar_erro
+from resiliencia import PoliticaRetentativa
+
+# Erros que indicam sessão quebrada (421, EOF, socket fechado, timeout)
+ERROS_CONEXAO = (ftplib.error_temp, ftplib.error_reply, EOFError, OSError, socket.timeout)
+
+
+def entrar_diretorio(ftp, diretorio):
+    """Navega até o diretório, criando cada nível que não existir"""
+    if diretorio.startswith('/'):
+        ftp.cwd('/')
+    for parte in [p for p in diretorio.split('/') if p]:
+        try:
+            ftp.cwd(parte)
+        except ftplib.error_perm:
+            ftp.mkd(parte)
+            ftp.cwd(parte)
+
+
+class ConexaoFTP:
+    """Sessão FTP do pool com marcação de uso"""
+
+    def __init__(self, ftp):
+        self.ftp = ftp
+        self.criada_em = time.monotonic()
+        self.ultimo_uso = self.criada_em
+
+    def ociosa_ha(self):
+        return time.monotonic() - self.ultimo_uso
+
+    def fechar(self):
+        try:
+            self.ftp.quit()
+        except Exception:
+            try:
+                self.ftp.close()
+            except Exception:
+                pass
+
+
+class PoolConexoesFTP:
+    """Pool limitado e thread-safe de sessões FTP no mesmo host/usuário/diretório"""
+
+    def __init__(self, host, user, password, diretorio, port=21, max_conexoes=4,
+                 timeout=60, max_ocioso=120, intervalo_noop=15):
+        """
+        Args:
+            host, user, password, port: credenciais do servidor FTP
+            diretorio: diretório de destino (relativo ao home ou absoluto)
+            max_conexoes: número máximo de sessões simultâneas
+            timeout: timeout de socket de cada sessão
+            max_ocioso: sessões paradas há mais tempo que isso são descartadas
+            intervalo_noop: sessões paradas há mais tempo que isso recebem NOOP antes do uso
+        """
+        self.host = host
+        self.user = user
+        self.password = password
+        self.diretorio = diretorio
+        self.port = port
+        self.max_conexoes = max_conexoes
+        self.timeout = timeout
+        self.max_ocioso = max_ocioso
+        self.intervalo_noop = intervalo_noop
+
+        self._ociosas = []
+        self._fechado = False
+        self._lock = threading.Lock()
+        self._vagas = threading.BoundedSemaphore(max_conexoes)
+        self.estatisticas = {'abertas': 0, 'reutilizadas': 0, 'descartadas': 0}
+
+    def _abrir(self):
+        """Abre uma nova sessão já autenticada e no diretório de destino"""
+        ftp = ftplib.FTP()
+        ftp.connect(self.host, self.port, timeout=self.timeout)
+        try:
+            ftp.login(self.user, self.password)
+            entrar_diretorio(ftp, self.diretorio)
+        except Exception:
+            ftp.close()
+            raise
+        with self._lock:
+            self.estatisticas['abertas'] += 1
+        return ConexaoFTP(ftp)
+
+    def _descartar(self, conexao):
+        conexao.fechar()
+        with self._lock:
+            self.estatisticas['descartadas'] += 1
+
+    def _saudavel(self, conexao):
+        """Verifica a sessão com NOOP se ela ficou parada por algum tempo"""
+        if conexao.ociosa_ha() < self.intervalo_noop:
+            return True
+        try:
+            conexao.ftp.voidcmd('NOOP')
+            return True
+        except Exception:
+            return False
+
+    def _retirar_ociosa(self):
+        """Retira a sessão ociosa mais recente, descartando as expiradas"""
+        expiradas = []
+        conexao = None
+        with self._lock:
+            while self._ociosas:
+                candidata = self._ociosas.pop()
+                if candidata.ociosa_ha() > self.max_ocioso:
+                    expiradas.append(candidata)
+                    continue
+                conexao = candidata
+                break
+        for expirada in expiradas:
+            self._descartar(expirada)
+        return conexao
+
+    @contextmanager
+    def conexao(self):
+        """Empresta uma sessão do pool; sessões com erro não voltam para o pool"""
+        self._vagas.acquire()
+        conexao = None
+        try:
+            while True:
+                conexao = self._retirar_ociosa()
+                if conexao is None:
+                    conexao = self._abrir()
+                    break
+                if self._saudavel(conexao):
+                    with self._lock:
+                        self.estatisticas['reutilizadas'] += 1
+                    break
+                self._descartar(conexao)
+                conexao = None
+
+            try:
+                yield conexao.ftp
+            except BaseException:
+                self._descartar(conexao)
+                conexao = None
+                raise
+        finally:
+            if conexao is not None:
+                conexao.ultimo_uso = time.monotonic()
+                with self._lock:
+                    devolver = not self._fechado
+                    if devolver:
+                        self._ociosas.append(conexao)
+                # Pool já fechado (substituído em obter_pool): a sessão sai com QUIT
+                if not devolver:
+                    self._descartar(conexao)
+            self._vagas.release()
+
+    def executar(self, operacao, tentativas=2):
+        """
+        Executa operacao(ftp) com uma sessão do pool, reconectando se a sessão cair
+
+        A sessão quebrada é descartada e a nova tentativa abre outra depois de
+        um backoff com jitter (evita reconexões em rajada após um 421).
+        Erros de protocolo permanentes (5xx) são propagados sem nova tentativa.
+        """
+        politica = PoliticaRetentativa(tentativas)
+        for tentativa in range(tentativas):
+            try:
+                with self.conexao() as ftp:
+                    return operacao(ftp)
+            except ERROS_CONEXAO as e:
+                if tentativa == tentativas - 1:
+                    raise
+                registrar_erro('ftp', e)
+                time.sleep(politica.espera(tentativa))
+
+    def limpar_ociosas(self):
+        """Descarta sessões ociosas há mais de max_ocioso segundos"""
+        with self._lock:
+            expiradas = [c for c in self._ociosas if c.ociosa_ha() > self.max_ocioso]
+            self._ociosas = [c for c in self._ociosas if c.ociosa_ha() <= self.max_ocioso]
+        for conexao in expiradas:
+            self._descartar(conexao)
+
+    def fechar(self):
+        """Fecha as sessões ociosas; as emprestadas são fechadas quando voltarem"""
+        with self._lock:
+            self._fechado = True
+            ociosas, self._ociosas = self._ociosas, []
+        for conexao in ociosas:
+            self._descartar(conexao)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def obter_pool(host, user, password, diretorio, port=21, **kwargs):
+    """Retorna o pool compartilhado para host/porta/usuário/diretório, criando se necessário"""
+    chave = (host, port, user, diretorio)
+    with _pools_lock:
+        pool = _pools.get(chave)
+        max_conexoes = kwargs.get('max_conexoes')
+        if (pool is None or pool.password != password
+                or (max_conexoes is not None and pool.max_conexoes != max_conexoes)):
+            if pool is not None:
+                pool.fechar()
+            pool = PoolConexoesFTP(host, user, password, diretorio, port=port, **kwargs)
+            _pools[chave] = pool
+        return pool
+
+
+def fechar_pools():
+    """Fecha todos os pools compartilhados"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.fechar()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Eventos de progresso por upload, entregues via Server-Sent Events
+O processamento publica eventos (found, uploaded, failed, ...) em um canal;
+a rota SSE acompanha o canal e repassa cada evento ao navegador
+"""
+
+import json
+import threading
+import time
+
+# Eventos guardados por canal (os mais antigos são descartados)
+MAX_EVENTOS = 5000
+# Canais encerrados somem depois disso; abertos, depois de CANAL_TTL
+RETENCAO_ENCERRADOS = 120
+CANAL_TTL = 3600
+# Quanto a rota SSE espera o upload criar um canal desconhecido antes do 404
+ESPERA_CANAL = 10
+
+
+def formatar_sse(evento):
+    """Serializa um evento no formato text/event-stream"""
+    return (f"id: {evento['seq']}\n"
+            f"event: {evento['type']}\n"
+            f"data: {json.dumps(evento, ensure_ascii=False)}\n\n").encode('utf-8')
+
+
+class CanalProgresso:
+    """Sequência de eventos de um upload; publicar() é O(1) e não bloqueia"""
+
+    def __init__(self, canal_id):
+        self.id = canal_id
+        self.criado_em = time.monotonic()
+        self.encerrado_em = None
+        self._inicio = time.perf_counter()
+        self._eventos = []
+        self._primeiro_seq = 1
+        self._seq = 0
+        self._condicao = threading.Condition()
+
+    @property
+    def encerrado(self):
+        return self.encerrado_em is not None
+
+    def publicar(self, tipo, **dados):
+        """Acrescenta um evento com seq e tempo decorrido desde a criação do canal"""
+        dados['type'] = tipo
+        dados['elapsed'] = round(time.perf_counter() - self._inicio, 3)
+        with self._condicao:
+            self._seq += 1
+            dados['seq'] = self._seq
+            self._eventos.append(dados)
+            if len(self._eventos) > MAX_EVENTOS:
+                descartados = len(self._eventos) - MAX_EVENTOS
+                del self._eventos[:descartados]
+                self._primeiro_seq += descartados
+            self._condicao.notify_all()
+
+    def encerrar(self, **dados):
+        """Publica o evento final 'done' e acorda os leitores"""
+        self.publicar('done', **dados)
+        with self._condicao:
+            self.encerrado_em = time.monotonic()
+            self._condicao.notify_all()
+
+    def aguardar(self, depois_de, timeout=15):
+        """
+        Eventos com seq > depois_de, esperando até timeout se ainda não houver
+
+        Returns:
+            (eventos, encerrado)
+        """
+        with self._condicao:
+            if self._seq <= depois_de and not self.encerrado:
+                self._condicao.wait(timeout)
+            inicio = max(0, depois_de + 1 - self._primeiro_seq)
+            return self._eventos[inicio:], self.encerrado
+
+
+class RegistroProgresso:
+    """Canais de progresso por id (criados pelo upload; a rota SSE só acompanha)"""
+
+    def __init__(self):
+        self._canais = {}
+        self._lock = threading.Lock()
+        self._criado = threading.Condition(self._lock)
+
+    def obter(self, canal_id, criar=True):
+        with self._lock:
+            self._limpar()
+            canal = self._canais.get(canal_id)
+            if canal is None and criar:
+                canal = CanalProgresso(canal_id)
+                self._canais[canal_id] = canal
+                self._criado.notify_all()
+            return canal
+
+    def aguardar(self, canal_id, timeout=ESPERA_CANAL):
+        """
+        Canal existente, esperando até timeout o upload criá-lo
+
+        O navegador abre o SSE antes de enviar o arquivo; ids que nenhum
+        upload cria devolvem None em vez de abrir um canal vazio por uma hora.
+        """
+        limite = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                canal = self._canais.get(canal_id)
+                restante = limite - time.monotonic()
+                if canal is not None or restante <= 0:
+                    return canal
+                self._criado.wait(restante)
+
+    def _limpar(self):
+        agora = time.monotonic()
+        vencidos = [cid for cid, c in self._canais.items()
+                    if (c.encerrado and agora - c.encerrado_em > RETENCAO_ENCERRADOS)
+                    or agora - c.criado_em > CANAL_TTL]
+        for cid in vencidos:
+            del self._canais[cid]
+
+
+def transmitir(wfile, canal, intervalo_keepalive=15, duracao_maxima=CANAL_TTL, ultimo_id=0):
+    """
+    Escreve os eventos do canal em wfile até o evento 'done' (ou desconexão)
+
+    Envia um comentário de keep-alive quando nada acontece por
+    intervalo_keepalive segundos, para proxies não derrubarem a conexão.
+    """
+    limite = time.monotonic() + duracao_maxima
+    ultimo = ultimo_id
+    try:
+        while time.monotonic() < limite:
+            eventos, encerrado = canal.aguardar(ultimo, timeout=intervalo_keepalive)
+            if eventos:
+                wfile.write(b''.join(formatar_sse(evento) for evento in eventos))
+                ultimo = eventos[-1]['seq']
+            elif not encerrado:
+                wfile.write(b': keep-alive\n\n')
+            wfile.flush()
+            # 'done' é publicado antes de marcar o canal como encerrado
+            if encerrado:
+                break
+    except (BrokenPipeError, ConnectionResetError):
+        pass
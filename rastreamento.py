@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rastro de um processamento: spans com tempo monotônico e eventos com nível
+Substitui as listas debug_info, que ganhavam várias strings por imagem e iam
+inteiras em toda resposta JSON. O evento guarda a mensagem e os argumentos e
+só é formatado na exportação; os eventos ficam num buffer circular (os mais
+antigos saem). Os spans são agregados por caminho (process_excel > upload_ftp >
+imagem), então mil imagens viram um nó com contagem, total e máximo.
+
+O texto (árvore de tempos + últimos eventos) só é montado quando pedido:
+    rastro = Rastro('process_excel', logger=logger)
+    with rastro.span('upload_ftp'):
+        rastro.debug("⬆️ Upload FTP: %s.jpg", ref)
+    if rastro_pedido(request.values.get('debug')):
+        resposta['debug_info'] = rastro.exportar()
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+AVISO = logging.WARNING
+ERRO = logging.ERROR
+
+NOMES_NIVEIS = {DEBUG: 'DEBUG', INFO: 'INFO', AVISO: 'AVISO', ERRO: 'ERRO'}
+
+# Eventos guardados por rastro (RASTRO_EVENTOS, padrão 200)
+RASTRO_EVENTOS = max(1, int(os.getenv('RASTRO_EVENTOS', '200')))
+
+# Nível mínimo guardado (RASTRO_NIVEL: DEBUG, INFO, AVISO ou ERRO; padrão INFO)
+RASTRO_NIVEL = {nome: nivel for nivel, nome in NOMES_NIVEIS.items()}.get(
+    os.getenv('RASTRO_NIVEL', 'INFO').upper(), INFO)
+
+
+def rastro_pedido(valor):
+    """True se o parâmetro `debug` da requisição pede o rastro ('1', 'true', 'sim', 'on')"""
+    return str(valor or '').strip().lower() in ('1', 'true', 'sim', 'on')
+
+
+def _formatar(mensagem, args):
+    if not args:
+        return mensagem
+    try:
+        return mensagem % args
+    except (TypeError, ValueError):
+        return f"{mensagem} {args!r}"
+
+
+class _No:
+    """Spans de mesmo nome sob o mesmo pai: chamadas, tempo total e máximo"""
+
+    __slots__ = ('nome', 'chamadas', 'total', 'maximo', 'filhos')
+
+    def __init__(self, nome):
+        self.nome = nome
+        self.chamadas = 0
+        self.total = 0.0
+        self.maximo = 0.0
+        self.filhos = {}
+
+
+class Rastro:
+    """
+    Spans e eventos de um processamento (um upload, um job)
+
+    Args:
+        nome: nome da raiz da árvore de tempos
+        capacidade: eventos guardados; além disso os mais antigos são descartados
+        nivel: eventos abaixo deste nível não são guardados nem formatados
+        logger: se dado, cada evento também vai para ele (formatação adiada pelo logging)
+    """
+
+    def __init__(self, nome='rastro', capacidade=None, nivel=None, logger=None):
+        self.raiz = _No(nome)
+        self.nivel = RASTRO_NIVEL if nivel is None else nivel
+        self.logger = logger
+        self.descartados = 0
+        self.contagem = {}
+        self._eventos = deque(maxlen=capacidade or RASTRO_EVENTOS)
+        self._inicio = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _pilha(self):
+        pilha = getattr(self._local, 'pilha', None)
+        if pilha is None:
+            pilha = self._local.pilha = [self.raiz]
+        return pilha
+
+    @contextmanager
+    def span(self, nome):
+        """Mede o bloco como filho do span aberto nesta thread (ou da raiz)"""
+        pilha = self._pilha()
+        with self._lock:
+            no = pilha[-1].filhos.get(nome)
+            if no is None:
+                no = pilha[-1].filhos[nome] = _No(nome)
+        pilha.append(no)
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracao = time.perf_counter() - inicio
+            pilha.pop()
+            with self._lock:
+                no.chamadas += 1
+                no.total += duracao
+                if duracao > no.maximo:
+                    no.maximo = duracao
+
+    def evento(self, nivel, mensagem, *args):
+        """Registra um evento; `mensagem % args` só é feito na exportação"""
+        if self.logger is not None and self.logger.isEnabledFor(nivel):
+            self.logger.log(nivel, mensagem, *args)
+        if nivel < self.nivel:
+            return
+        with self._lock:
+            self.contagem[nivel] = self.contagem.get(nivel, 0) + 1
+            if len(self._eventos) == self._eventos.maxlen:
+                self.descartados += 1
+            self._eventos.append((time.perf_counter(), nivel, mensagem, args))
+
+    def debug(self, mensagem, *args):
+        self.evento(DEBUG, mensagem, *args)
+
+    def info(self, mensagem, *args):
+        self.evento(INFO, mensagem, *args)
+
+    def aviso(self, mensagem, *args):
+        self.evento(AVISO, mensagem, *args)
+
+    def erro(self, mensagem, *args):
+        self.evento(ERRO, mensagem, *args)
+
+    def linhas(self, linhas, nivel=INFO):
+        """Eventos já formatados (ex.: o diagnóstico guardado de um health check)"""
+        for linha in linhas:
+            self.evento(nivel, linha)
+
+    def arvore(self):
+        """Linhas da árvore de tempos: nome, chamadas, total e máximo (se repetido)"""
+        with self._lock:
+            linhas = [f"{self.raiz.nome} {time.perf_counter() - self._inicio:.3f}s"]
+
+            def descer(no, profundidade):
+                for filho in no.filhos.values():
+                    linha = f"{'  ' * profundidade}{filho.nome} {filho.chamadas}× {filho.total:.3f}s"
+                    if filho.chamadas > 1:
+                        linha += f" (máx {filho.maximo:.3f}s)"
+                    linhas.append(linha)
+                    descer(filho, profundidade + 1)
+
+            descer(self.raiz, 1)
+        return linhas
+
+    def exportar(self, eventos=True):
+        """Texto compacto: árvore de tempos e, se `eventos`, os eventos guardados"""
+        linhas = self.arvore()
+        if not eventos:
+            return '\n'.join(linhas)
+        with self._lock:
+            guardados = list(self._eventos)
+            descartados = self.descartados
+            contagem = dict(self.contagem)
+        resumo = ', '.join(f"{contagem[nivel]} {NOMES_NIVEIS.get(nivel, nivel)}" for nivel in sorted(contagem))
+        linhas.append(f"eventos: {resumo or 'nenhum'}")
+        if descartados:
+            linhas.append(f"… {descartados} evento(s) mais antigo(s) descartado(s)")
+        for instante, nivel, mensagem, args in guardados:
+            linhas.append(f"+{instante - self._inicio:.3f}s {NOMES_NIVEIS.get(nivel, nivel):<5} "
+                          f"{_formatar(mensagem, args)}")
+        return '\n'.join(linhas)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Camada de resiliência das transferências FTP/SSH
+Retentativas por imagem com backoff exponencial e jitter para erros
+transitórios (421, EOF, conexão resetada, timeout) e um disjuntor por backend:
+depois de várias falhas seguidas o backend fica "aberto" por um tempo e as
+chamadas falham na hora, para o tráfego ir ao backend saudável
+"""
+
+import ftplib
+import os
+import random
+import socket
+import threading
+import time
+
+from metricas import registrar_erro
+
+# Tentativas por operação e backoff (RETRY_TENTATIVAS, RETRY_BASE, RETRY_MAXIMO)
+TENTATIVAS_PADRAO = int(os.getenv('RETRY_TENTATIVAS', '4'))
+BASE_PADRAO = float(os.getenv('RETRY_BASE', '0.5'))
+MAXIMO_PADRAO = float(os.getenv('RETRY_MAXIMO', '8'))
+# Disjuntor: falhas seguidas para abrir e segundos aberto (DISJUNTOR_FALHAS, DISJUNTOR_ABERTO)
+LIMITE_FALHAS = int(os.getenv('DISJUNTOR_FALHAS', '5'))
+TEMPO_ABERTO = float(os.getenv('DISJUNTOR_ABERTO', '60'))
+
+# Estados do disjuntor
+FECHADO = 'closed'
+ABERTO = 'open'
+MEIO_ABERTO = 'half_open'
+
+# Exceções do paramiko tratadas como transitórias (sem importar o paramiko aqui)
+ERROS_SSH_TRANSITORIOS = {'SSHException', 'ChannelException', 'NoValidConnectionsError', 'ProxyCommandFailure'}
+
+
+class DisjuntorAberto(Exception):
+    """O backend está com o circuito aberto; a chamada nem foi tentada"""
+
+
+def erro_transitorio(erro):
+    """
+    True se vale a pena tentar de novo (sessão caiu, servidor ocupado, timeout)
+
+    Erros permanentes de protocolo (5xx do FTP, arquivo/permissão) não são
+    repetidos.
+    """
+    if isinstance(erro, DisjuntorAberto):
+        return False
+    if isinstance(erro, ftplib.error_perm):
+        return False
+    if isinstance(erro, (ftplib.error_temp, ftplib.error_reply, EOFError, socket.timeout, ConnectionError)):
+        return True
+    if type(erro).__name__ in ERROS_SSH_TRANSITORIOS:
+        return True
+    if isinstance(erro, (FileNotFoundError, PermissionError)):
+        return False
+    return isinstance(erro, OSError)
+
+
+class PoliticaRetentativa:
+    """Quantas vezes tentar e quanto esperar entre as tentativas"""
+
+    def __init__(self, tentativas=None, base=None, maximo=None):
+        self.tentativas = max(1, tentativas or TENTATIVAS_PADRAO)
+        self.base = BASE_PADRAO if base is None else base
+        self.maximo = MAXIMO_PADRAO if maximo is None else maximo
+
+    def espera(self, tentativa):
+        """Backoff exponencial com jitter completo: uniforme em [0, base * 2^tentativa]"""
+        return random.uniform(0, min(self.maximo, self.base * (2 ** tentativa)))
+
+
+class Disjuntor:
+    """
+    Disjuntor de um backend: fechado → aberto após falhas seguidas → meio-aberto
+
+    No meio-aberto só uma chamada de teste passa (admitir); as demais são
+    recusadas até ela voltar, para não irem todas pagar o timeout juntas.
+    """
+
+    def __init__(self, nome, limite_falhas=None, tempo_aberto=None):
+        self.nome = nome
+        self.limite_falhas = limite_falhas or LIMITE_FALHAS
+        self.tempo_aberto = TEMPO_ABERTO if tempo_aberto is None else tempo_aberto
+        self.falhas_seguidas = 0
+        self.aberto_em = None
+        self.ultimo_erro = None
+        self._testando = False
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self):
+        if self.aberto_em is None:
+            return FECHADO
+        if time.monotonic() - self.aberto_em >= self.tempo_aberto:
+            return MEIO_ABERTO
+        return ABERTO
+
+    def permite(self):
+        """False enquanto aberto ou enquanto a chamada de teste do meio-aberto não volta"""
+        with self._lock:
+            estado = self.estado
+            return estado == FECHADO or (estado == MEIO_ABERTO and not self._testando)
+
+    def admitir(self):
+        """Como permite(), mas no meio-aberto reserva a única chamada de teste"""
+        with self._lock:
+            estado = self.estado
+            if estado == MEIO_ABERTO and not self._testando:
+                self._testando = True
+                return True
+            return estado == FECHADO
+
+    def liberar_teste(self):
+        """A chamada de teste terminou sem dizer nada do backend (erro permanente)"""
+        with self._lock:
+            self._testando = False
+
+    def reabre_em(self):
+        """Segundos até o disjuntor aberto voltar a aceitar chamadas"""
+        if self.aberto_em is None:
+            return 0
+        return max(0.0, self.tempo_aberto - (time.monotonic() - self.aberto_em))
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self.falhas_seguidas = 0
+            self.aberto_em = None
+            self._testando = False
+
+    def registrar_falha(self, erro=None):
+        with self._lock:
+            self.falhas_seguidas += 1
+            self.ultimo_erro = str(erro) if erro is not None else None
+            # Meio-aberto: uma falha reabre; fechado: abre ao atingir o limite
+            if self.aberto_em is not None or self.falhas_seguidas >= self.limite_falhas:
+                self.aberto_em = time.monotonic()
+            self._testando = False
+
+    def resumo(self):
+        return {
+            'state': self.estado,
+            'consecutive_failures': self.falhas_seguidas,
+            'retry_in': round(self.reabre_em(), 1),
+            'last_error': self.ultimo_erro,
+        }
+
+
+def com_retentativas(operacao, politica=None, disjuntor=None, ao_falhar=None):
+    """
+    Executa operacao() repetindo erros transitórios com backoff
+
+    Args:
+        operacao: função sem argumentos
+        politica: PoliticaRetentativa (padrão: variáveis RETRY_*)
+        disjuntor: Disjuntor do backend; recusa a chamada se aberto (ou se o
+            meio-aberto já tem uma chamada de teste) e recebe o resultado de
+            cada tentativa
+        ao_falhar: callback ao_falhar(tentativa, erro) antes de esperar e
+            tentar de novo (ex.: reconectar)
+
+    Raises:
+        DisjuntorAberto: se o circuito do backend está aberto
+        a última exceção, se as tentativas acabarem ou o erro for permanente
+    """
+    politica = politica or PoliticaRetentativa()
+    for tentativa in range(politica.tentativas):
+        if disjuntor is not None and not disjuntor.admitir():
+            raise DisjuntorAberto(
+                f"Backend {disjuntor.nome} indisponível (circuito aberto, nova tentativa em {disjuntor.reabre_em():.0f}s)"
+            )
+        try:
+            resultado = operacao()
+        except Exception as e:
+            transitorio = erro_transitorio(e)
+            if disjuntor is not None:
+                if transitorio:
+                    disjuntor.registrar_falha(e)
+                else:
+                    disjuntor.liberar_teste()
+            if not transitorio or tentativa == politica.tentativas - 1:
+                raise
+            # A falha final é contada por quem chamou (registrar_transferencia)
+            registrar_erro(disjuntor.nome if disjuntor is not None else 'desconhecido', e)
+            if ao_falhar is not None:
+                ao_falhar(tentativa + 1, e)
+            time.sleep(politica.espera(tentativa))
+            continue
+        if disjuntor is not None:
+            disjuntor.registrar_sucesso()
+        return resultado
+
+
+_disjuntores = {}
+_disjuntores_lock = threading.Lock()
+
+
+def obter_disjuntor(nome):
+    """Disjuntor compartilhado do backend (ex.: 'ftp', 'ssh', 'sftp')"""
+    with _disjuntores_lock:
+        disjuntor = _disjuntores.get(nome)
+        if disjuntor is None:
+            disjuntor = _disjuntores[nome] = Disjuntor(nome)
+        return disjuntor
+
+
+def resumo_disjuntores():
+    """Estado de todos os disjuntores (para /health)"""
+    with _disjuntores_lock:
+        return {nome: disjuntor.resumo() for nome, disjuntor in _disjuntores.items()}
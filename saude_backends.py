@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registro de saúde dos backends de upload (FTP/SSH)
+Sonda cada backend em uma thread de fundo a cada intervalo e guarda a última
+configuração que funcionou com um TTL; uploads e /health só leem o cache
+"""
+
+import threading
+import time
+
+# Padrões: sonda a cada 60s, resultado vale por 180s
+INTERVALO_PADRAO = 60
+TTL_PADRAO = 180
+
+
+class EstadoBackend:
+    """Resultado da última sonda de um backend (imutável depois de criado)"""
+
+    def __init__(self, config, debug, duracao):
+        self.config = config
+        self.debug = list(debug)
+        self.duracao = duracao
+        self.verificado_em = time.monotonic()
+        self.timestamp = time.time()
+
+    @property
+    def ok(self):
+        return self.config is not None
+
+    def idade(self):
+        return time.monotonic() - self.verificado_em
+
+
+class RegistroSaude:
+    """Cache de saúde por backend, atualizado em segundo plano"""
+
+    def __init__(self, sondas, intervalo=INTERVALO_PADRAO, ttl=TTL_PADRAO):
+        """
+        Args:
+            sondas: {nome: função sem argumentos que retorna (config ou None, debug)}
+            intervalo: segundos entre sondas em segundo plano
+            ttl: idade máxima de um resultado antes de ser considerado vencido
+        """
+        self.sondas = dict(sondas)
+        self.intervalo = intervalo
+        self.ttl = ttl
+        self._estados = {}
+        self._locks = {nome: threading.Lock() for nome in self.sondas}
+        self._acordar = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def sondar(self, nome):
+        """Executa a sonda agora e atualiza o cache (uma sonda por backend de cada vez)"""
+        lock = self._locks[nome]
+        inicio_espera = time.monotonic()
+        with lock:
+            # Outra thread terminou uma sonda enquanto esperávamos: reaproveita
+            estado = self._estados.get(nome)
+            if estado is not None and estado.verificado_em >= inicio_espera:
+                return estado
+            inicio = time.monotonic()
+            try:
+                config, debug = self.sondas[nome]()
+            except Exception as e:
+                config, debug = None, [f"❌ Erro na sonda {nome}: {e}"]
+            estado = EstadoBackend(config, debug, time.monotonic() - inicio)
+            self._estados[nome] = estado
+            return estado
+
+    def obter(self, nome, bloquear=True):
+        """
+        Estado em cache de um backend
+
+        Se o resultado estiver ausente ou vencido, com bloquear=True sonda na
+        hora; com bloquear=False devolve o que houver (pode ser None) e pede
+        uma nova sonda à thread de fundo.
+        """
+        self.iniciar()
+        estado = self._estados.get(nome)
+        if estado is not None and estado.idade() <= self.ttl:
+            return estado
+        if bloquear:
+            return self.sondar(nome)
+        self._acordar.set()
+        return estado
+
+    def config(self, nome):
+        """(config, debug) como as funções test_*_connections, lido do cache"""
+        estado = self.obter(nome)
+        return estado.config, estado.debug
+
+    def invalidar(self, nome):
+        """Descarta o resultado em cache (ex.: upload falhou com a config em cache)"""
+        self._estados.pop(nome, None)
+        self._acordar.set()
+
+    def resumo(self):
+        """Estado de todos os backends para /health, sem sondar"""
+        self.iniciar()
+        resumo = {}
+        for nome in self.sondas:
+            estado = self._estados.get(nome)
+            if estado is None:
+                self._acordar.set()
+                resumo[nome] = {'ok': False, 'config': None, 'debug': ['⏳ Aguardando primeira verificação'],
+                                'idade': None, 'vencido': True}
+                continue
+            resumo[nome] = {
+                'ok': estado.ok,
+                'config': estado.config,
+                'debug': estado.debug,
+                'idade': round(estado.idade(), 1),
+                'duracao': round(estado.duracao, 3),
+                'verificado_em': estado.timestamp,
+                'vencido': estado.idade() > self.ttl,
+            }
+        return resumo
+
+    def iniciar(self):
+        """Sobe a thread de fundo na primeira utilização"""
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='saude-backends', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            for nome in self.sondas:
+                estado = self._estados.get(nome)
+                # Sonda o que estiver ausente ou perto de completar o intervalo
+                if estado is None or estado.idade() >= self.intervalo * 0.9:
+                    self.sondar(nome)
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
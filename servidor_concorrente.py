@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Servidor HTTP concorrente para os handlers BaseHTTPRequestHandler
+Pool fixo de threads atendendo as conexões e limites de uploads e de streams
+SSE simultâneos: /health e as páginas continuam respondendo durante uploads
+longos ou com vários navegadores acompanhando o progresso, e o que passar do
+limite recebe 503 com Retry-After na hora. Cada conexão tem timeout de socket,
+então cliente lento ou parado não prende uma thread para sempre.
+"""
+
+import json
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import HTTPServer
+
+# Threads atendendo requisições (HTTP_WORKERS, padrão 16)
+WORKERS_PADRAO = int(os.getenv('HTTP_WORKERS', '16'))
+# Uploads processados ao mesmo tempo (MAX_UPLOADS_SIMULTANEOS, padrão 2)
+MAX_UPLOADS_PADRAO = int(os.getenv('MAX_UPLOADS_SIMULTANEOS', '2'))
+# Streams SSE (/progress/<id>) abertos ao mesmo tempo (MAX_STREAMS_SIMULTANEOS, padrão 4)
+MAX_STREAMS_PADRAO = int(os.getenv('MAX_STREAMS_SIMULTANEOS', '4'))
+# Timeout de cada leitura/escrita no socket de uma conexão (HTTP_TIMEOUT, padrão 60s)
+TIMEOUT_CONEXAO = float(os.getenv('HTTP_TIMEOUT', '60'))
+# Conexões aguardando uma thread livre antes de recusar com 503
+FILA_PADRAO = int(os.getenv('HTTP_FILA', '32'))
+# Segundos sugeridos ao cliente no Retry-After
+RETRY_AFTER = int(os.getenv('HTTP_RETRY_AFTER', '5'))
+# Corpo descartado de um upload recusado (para o cliente conseguir ler o 503)
+LIMITE_DESCARTE = 1024 * 1024
+
+RESPOSTA_SOBRECARGA = (
+    'HTTP/1.0 503 Service Unavailable\r\n'
+    f'Retry-After: {RETRY_AFTER}\r\n'
+    'Content-Type: application/json\r\n'
+    'Connection: close\r\n'
+    '\r\n'
+    '{"error": "Servidor sobrecarregado, tente novamente em instantes"}'
+).encode('utf-8')
+
+
+class ServidorHTTPConcorrente(HTTPServer):
+    """HTTPServer que atende cada conexão em um pool limitado de threads"""
+
+    def __init__(self, endereco, handler, workers=None, max_uploads=None, max_fila=None,
+                 max_streams=None, timeout_conexao=None):
+        """
+        Args:
+            endereco: (host, porta)
+            handler: classe BaseHTTPRequestHandler
+            workers: threads do pool (deve sobrar folga além de max_uploads + max_streams)
+            max_uploads: uploads admitidos ao mesmo tempo (ver admissao_upload)
+            max_fila: conexões esperando thread livre antes de recusar
+            max_streams: streams SSE admitidos ao mesmo tempo (ver admissao_stream)
+            timeout_conexao: segundos de cada operação no socket (None desliga)
+        """
+        super().__init__(endereco, handler)
+        self.workers = workers or WORKERS_PADRAO
+        self.max_uploads = max_uploads or MAX_UPLOADS_PADRAO
+        self.max_streams = max_streams or MAX_STREAMS_PADRAO
+        self.max_fila = FILA_PADRAO if max_fila is None else max_fila
+        self.timeout_conexao = TIMEOUT_CONEXAO if timeout_conexao is None else timeout_conexao
+        self._uploads = threading.BoundedSemaphore(self.max_uploads)
+        self._streams = threading.BoundedSemaphore(self.max_streams)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='http')
+        self._pendentes = 0
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        """Entrega a conexão ao pool (ou responde 503 se a fila estiver cheia)"""
+        with self._lock:
+            if self._pendentes >= self.workers + self.max_fila:
+                recusar = True
+            else:
+                recusar = False
+                self._pendentes += 1
+        if recusar:
+            self._recusar(request)
+            return
+        self._executor.submit(self._atender, request, client_address)
+
+    def _atender(self, request, client_address):
+        try:
+            # Cliente que para de ler ou de enviar libera a thread no timeout
+            request.settimeout(self.timeout_conexao)
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._lock:
+                self._pendentes -= 1
+
+    def _recusar(self, request):
+        try:
+            request.settimeout(1)
+            request.sendall(RESPOSTA_SOBRECARGA)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def admitir_upload(self):
+        return self._uploads.acquire(blocking=False)
+
+    def liberar_upload(self):
+        self._uploads.release()
+
+    def admitir_stream(self):
+        return self._streams.acquire(blocking=False)
+
+    def liberar_stream(self):
+        self._streams.release()
+
+    def em_andamento(self):
+        """Conexões sendo atendidas ou aguardando thread"""
+        return self._pendentes
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=False)
+
+
+def responder_ocupado(handler, mensagem='Limite de uploads simultâneos atingido, tente novamente em instantes'):
+    """Responde 503 com Retry-After sem processar o corpo da requisição"""
+    corpo = json.dumps({'error': mensagem, 'retry_after': RETRY_AFTER}).encode()
+    handler.send_response(503)
+    handler.send_header('Content-Type', 'application/json')
+    handler.send_header('Retry-After', str(RETRY_AFTER))
+    handler.send_header('Access-Control-Allow-Origin', '*')
+    handler.send_header('Content-Length', str(len(corpo)))
+    handler.send_header('Connection', 'close')
+    handler.end_headers()
+    handler.wfile.write(corpo)
+    handler.wfile.flush()
+    handler.close_connection = True
+    # Lê (e descarta) até LIMITE_DESCARTE do corpo para o cliente não receber
+    # um RST antes de ler a resposta; corpos maiores são simplesmente cortados
+    try:
+        restante = min(int(handler.headers.get('Content-Length', 0) or 0), LIMITE_DESCARTE)
+        handler.connection.settimeout(2)
+        while restante > 0:
+            bloco = handler.rfile.read(min(65536, restante))
+            if not bloco:
+                break
+            restante -= len(bloco)
+    except (ValueError, OSError, socket.timeout):
+        pass
+
+
+@contextmanager
+def admissao_upload(handler):
+    """
+    Reserva uma vaga de upload no servidor do handler
+
+    Produz True se o upload pode seguir; se o limite foi atingido já
+    respondeu 503 e produz False. Em servidores sem limite sempre admite.
+    """
+    servidor = handler.server
+    if not isinstance(servidor, ServidorHTTPConcorrente):
+        yield True
+        return
+    if not servidor.admitir_upload():
+        responder_ocupado(handler)
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        servidor.liberar_upload()
+
+
+@contextmanager
+def admissao_stream(handler):
+    """
+    Reserva uma vaga de stream SSE (cada stream prende uma thread do pool)
+
+    Mesmo contrato de admissao_upload: produz False depois de responder 503.
+    """
+    servidor = handler.server
+    if not isinstance(servidor, ServidorHTTPConcorrente):
+        yield True
+        return
+    if not servidor.admitir_stream():
+        responder_ocupado(handler, 'Limite de acompanhamentos de progresso atingido, tente novamente em instantes')
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        servidor.liberar_stream()
@@ -0,0 +1,824 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Servidores FTP e SFTP locais para medir os uploads sem rede
+Sobem em 127.0.0.1 numa porta efêmera, gravam num diretório temporário e
+simulam as condições do servidor real: latência por resposta, limite de banda
+(por conexão e total), limite de conexões simultâneas (421 no FTP, conexão
+derrubada no SSH) e quedas aleatórias no meio dos comandos e transferências.
+
+Uso em código:
+    with ServidorFTPLocal(condicoes=CondicoesRede(latencia=0.05, banda=2_000_000)) as ftp:
+        upload_via_ftp_config(images, ftp.config(), debug_info)
+
+Uso na linha de comando (fica no ar até Ctrl+C):
+    python servidores_locais.py --latencia 0.05 --banda 2000000 --max-conexoes 4 --queda 0.01
+"""
+
+import argparse
+import os
+import posixpath
+import random
+import shutil
+import socket
+import socketserver
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    import paramiko
+    PARAMIKO_AVAILABLE = True
+except ImportError:
+    PARAMIKO_AVAILABLE = False
+
+TAMANHO_BLOCO = 64 * 1024
+
+
+class CondicoesRede:
+    """Condições simuladas da rede/servidor"""
+
+    def __init__(self, latencia=0.0, banda=None, banda_total=None, max_conexoes=None,
+                 queda=0.0, semente=None):
+        """
+        Args:
+            latencia: segundos somados a cada resposta do servidor
+            banda: bytes/s recebidos por conexão (None = sem limite)
+            banda_total: bytes/s recebidos somando todas as conexões
+            max_conexoes: conexões simultâneas aceitas (None = sem limite)
+            queda: probabilidade de derrubar a conexão a cada comando FTP ou
+                bloco de dados recebido
+            semente: semente do sorteio das quedas (reprodutível)
+        """
+        self.latencia = latencia
+        self.banda = banda
+        self.banda_total = banda_total
+        self.max_conexoes = max_conexoes
+        self.queda = queda
+        self._rng = random.Random(semente)
+        self._rng_lock = threading.Lock()
+
+    def sortear_queda(self):
+        if not self.queda:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < self.queda
+
+
+class LimitadorBanda:
+    """Balde de fichas: consumir(n) dorme o necessário para manter `taxa` bytes/s"""
+
+    def __init__(self, taxa):
+        self.taxa = taxa
+        self._disponivel = 0.0
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consumir(self, n):
+        with self._lock:
+            agora = time.monotonic()
+            # Rajada máxima de 100 ms de banda
+            self._disponivel = min(self.taxa * 0.1, self._disponivel + (agora - self._ultimo) * self.taxa)
+            self._ultimo = agora
+            self._disponivel -= n
+            espera = -self._disponivel / self.taxa if self._disponivel < 0 else 0
+        if espera:
+            time.sleep(espera)
+
+
+class ConexaoDerrubada(ConnectionResetError):
+    """Queda simulada pelo servidor local"""
+
+
+class CanalCondicionado:
+    """
+    Socket do servidor com latência, limite de banda e quedas aplicados
+
+    Repassa o resto da interface do socket (o Transport do paramiko usa
+    este objeto como socket).
+    """
+
+    def __init__(self, sock, servidor, atrasar=True, ao_derrubar=None, queda_como_eof=False):
+        """
+        Args:
+            atrasar: aplica a latência em cada envio (respostas do servidor)
+            ao_derrubar: chamada depois de uma queda (ex.: derrubar o controle FTP junto com os dados)
+            queda_como_eof: na queda, recv devolve b'' em vez de levantar erro
+        """
+        self._sock = sock
+        self._servidor = servidor
+        self._atrasar = atrasar
+        self._ao_derrubar = ao_derrubar
+        self._queda_como_eof = queda_como_eof
+        condicoes = servidor.condicoes
+        self._limitador = LimitadorBanda(condicoes.banda) if condicoes.banda else None
+
+    def recv(self, n):
+        dados = self._sock.recv(n)
+        if dados:
+            if self._limitador:
+                self._limitador.consumir(len(dados))
+            if self._servidor._limitador_total:
+                self._servidor._limitador_total.consumir(len(dados))
+            self._servidor._somar('bytes_recebidos', len(dados))
+            if self._servidor.condicoes.sortear_queda():
+                self.derrubar()
+                if self._queda_como_eof:
+                    return b''
+                raise ConexaoDerrubada("Conexão derrubada (queda simulada)")
+        return dados
+
+    def send(self, dados):
+        if self._atrasar and self._servidor.condicoes.latencia:
+            time.sleep(self._servidor.condicoes.latencia)
+        return self._sock.send(dados)
+
+    def sendall(self, dados):
+        if self._atrasar and self._servidor.condicoes.latencia:
+            time.sleep(self._servidor.condicoes.latencia)
+        return self._sock.sendall(dados)
+
+    def derrubar(self, contar=True):
+        """Fecha a conexão sem aviso (o cliente vê EOF/reset)"""
+        if contar:
+            self._servidor._somar('quedas')
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        if self._ao_derrubar:
+            self._ao_derrubar()
+
+    def __getattr__(self, nome):
+        return getattr(self._sock, nome)
+
+
+class _ServidorLocal:
+    """Base comum: diretório raiz, credenciais, condições, limite de conexões e estatísticas"""
+
+    def __init__(self, raiz=None, usuario='teste', senha='teste', condicoes=None):
+        self._raiz_temporaria = raiz is None
+        self.raiz = os.path.abspath(raiz or tempfile.mkdtemp(prefix='servidor_local_'))
+        self.usuario = usuario
+        self.senha = senha
+        self.condicoes = condicoes or CondicoesRede()
+        self._limitador_total = LimitadorBanda(self.condicoes.banda_total) if self.condicoes.banda_total else None
+        self._lock = threading.Lock()
+        self.ativas = 0
+        self.estatisticas = {'conexoes': 0, 'recusadas': 0, 'quedas': 0,
+                             'arquivos_recebidos': 0, 'bytes_recebidos': 0}
+        self.host = '127.0.0.1'
+        self.porta = None
+
+    def _somar(self, chave, valor=1):
+        with self._lock:
+            self.estatisticas[chave] += valor
+
+    def _admitir(self):
+        """Reserva uma vaga de conexão; False se o limite foi atingido"""
+        with self._lock:
+            limite = self.condicoes.max_conexoes
+            if limite is not None and self.ativas >= limite:
+                self.estatisticas['recusadas'] += 1
+                return False
+            self.ativas += 1
+            self.estatisticas['conexoes'] += 1
+            return True
+
+    def _liberar(self):
+        with self._lock:
+            self.ativas -= 1
+
+    def caminho_local(self, caminho, atual='/'):
+        """Caminho virtual (absoluto ou relativo a `atual`) → caminho dentro da raiz"""
+        virtual = posixpath.normpath(posixpath.join(atual, caminho or '.'))
+        if not virtual.startswith('/'):
+            virtual = '/' + virtual
+        virtual = posixpath.normpath(virtual)
+        return virtual, os.path.join(self.raiz, virtual.lstrip('/'))
+
+    def arquivos(self):
+        """{caminho virtual: tamanho} de tudo que está gravado na raiz"""
+        encontrados = {}
+        for pasta, _, nomes in os.walk(self.raiz):
+            for nome in nomes:
+                local = os.path.join(pasta, nome)
+                encontrados['/' + os.path.relpath(local, self.raiz).replace(os.sep, '/')] = os.path.getsize(local)
+        return encontrados
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+        return False
+
+    def _remover_raiz(self):
+        if self._raiz_temporaria:
+            shutil.rmtree(self.raiz, ignore_errors=True)
+
+
+# --------------------------------------------------------------------- FTP
+
+class _SessaoFTP(socketserver.BaseRequestHandler):
+    """Uma sessão de controle FTP (modo passivo, binário)"""
+
+    def setup(self):
+        self.servidor = self.server.local
+        self.admitida = self.servidor._admitir()
+        self.canal = CanalCondicionado(self.request, self.servidor)
+        self.buffer = b''
+        self.atual = '/'
+        self.usuario = None
+        self.autenticado = False
+        self.passivo = None
+        self.rest = 0
+        self.renomear_de = None
+        self.encerrar = False
+
+    def finish(self):
+        if self.passivo is not None:
+            self.passivo.close()
+        if self.admitida:
+            self.servidor._liberar()
+
+    def responder(self, linha):
+        self.canal.sendall((linha + '\r\n').encode('utf-8'))
+
+    def ler_linha(self):
+        while b'\n' not in self.buffer:
+            dados = self.canal.recv(4096)
+            if not dados:
+                return None
+            self.buffer += dados
+        linha, self.buffer = self.buffer.split(b'\n', 1)
+        return linha.rstrip(b'\r').decode('utf-8', 'replace')
+
+    def handle(self):
+        try:
+            if not self.admitida:
+                self.responder(f'421 Too many connections ({self.servidor.condicoes.max_conexoes})')
+                return
+            self.responder('220 Servidor FTP local')
+            while not self.encerrar:
+                linha = self.ler_linha()
+                if linha is None:
+                    return
+                comando, _, argumento = linha.partition(' ')
+                self.executar(comando.upper(), argumento)
+        except (OSError, ConnectionError):
+            pass
+
+    def executar(self, comando, argumento):
+        publicos = {'USER', 'PASS', 'QUIT', 'SYST', 'FEAT', 'NOOP', 'OPTS'}
+        if not self.autenticado and comando not in publicos:
+            self.responder('530 Please login with USER and PASS')
+            return
+        metodo = getattr(self, f'ftp_{comando}', None)
+        if metodo is None:
+            self.responder(f'502 Command {comando} not implemented')
+            return
+        try:
+            metodo(argumento)
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            self.responder(f'550 {argumento}: No such file or directory')
+        except FileExistsError:
+            self.responder(f'550 {argumento}: File exists')
+
+    def ftp_USER(self, argumento):
+        self.usuario = argumento
+        self.responder('331 Password required')
+
+    def ftp_PASS(self, argumento):
+        if self.usuario == self.servidor.usuario and argumento == self.servidor.senha:
+            self.autenticado = True
+            self.responder('230 Login successful')
+        else:
+            self.responder('530 Login incorrect')
+
+    def ftp_QUIT(self, argumento):
+        self.responder('221 Goodbye')
+        self.encerrar = True
+
+    def ftp_SYST(self, argumento):
+        self.responder('215 UNIX Type: L8')
+
+    def ftp_FEAT(self, argumento):
+        self.responder('211-Features:\r\n MDTM\r\n SIZE\r\n REST STREAM\r\n MLST type*;size*;modify*;\r\n UTF8\r\n EPSV\r\n211 End')
+
+    def ftp_OPTS(self, argumento):
+        self.responder('200 OK')
+
+    def ftp_NOOP(self, argumento):
+        self.responder('200 NOOP ok')
+
+    def ftp_TYPE(self, argumento):
+        self.responder(f'200 Type set to {argumento or "I"}')
+
+    def ftp_PWD(self, argumento):
+        self.responder(f'257 "{self.atual}" is the current directory')
+
+    ftp_XPWD = ftp_PWD
+
+    def ftp_CWD(self, argumento):
+        virtual, local = self.servidor.caminho_local(argumento, self.atual)
+        if not os.path.isdir(local):
+            raise FileNotFoundError(argumento)
+        self.atual = virtual
+        self.responder(f'250 Directory changed to {virtual}')
+
+    def ftp_CDUP(self, argumento):
+        self.ftp_CWD('..')
+
+    def ftp_MKD(self, argumento):
+        virtual, local = self.servidor.caminho_local(argumento, self.atual)
+        os.mkdir(local)
+        self.responder(f'257 "{virtual}" created')
+
+    def ftp_RMD(self, argumento):
+        os.rmdir(self.servidor.caminho_local(argumento, self.atual)[1])
+        self.responder('250 Directory removed')
+
+    def ftp_DELE(self, argumento):
+        os.remove(self.servidor.caminho_local(argumento, self.atual)[1])
+        self.responder('250 File deleted')
+
+    def ftp_RNFR(self, argumento):
+        local = self.servidor.caminho_local(argumento, self.atual)[1]
+        if not os.path.exists(local):
+            raise FileNotFoundError(argumento)
+        self.renomear_de = local
+        self.responder('350 Ready for RNTO')
+
+    def ftp_RNTO(self, argumento):
+        if self.renomear_de is None:
+            self.responder('503 RNFR required first')
+            return
+        os.replace(self.renomear_de, self.servidor.caminho_local(argumento, self.atual)[1])
+        self.renomear_de = None
+        self.responder('250 Rename successful')
+
+    def ftp_SIZE(self, argumento):
+        local = self.servidor.caminho_local(argumento, self.atual)[1]
+        if not os.path.isfile(local):
+            raise FileNotFoundError(argumento)
+        self.responder(f'213 {os.path.getsize(local)}')
+
+    def ftp_MDTM(self, argumento):
+        local = self.servidor.caminho_local(argumento, self.atual)[1]
+        if not os.path.isfile(local):
+            raise FileNotFoundError(argumento)
+        momento = datetime.fromtimestamp(os.path.getmtime(local), timezone.utc)
+        self.responder(f'213 {momento:%Y%m%d%H%M%S}')
+
+    def ftp_REST(self, argumento):
+        self.rest = int(argumento)
+        self.responder(f'350 Restarting at {self.rest}')
+
+    def _abrir_passivo(self):
+        if self.passivo is not None:
+            self.passivo.close()
+        self.passivo = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.passivo.bind((self.servidor.host, 0))
+        self.passivo.listen(1)
+        self.passivo.settimeout(30)
+        return self.passivo.getsockname()[1]
+
+    def ftp_PASV(self, argumento):
+        porta = self._abrir_passivo()
+        ip = self.servidor.host.replace('.', ',')
+        self.responder(f'227 Entering Passive Mode ({ip},{porta >> 8},{porta & 0xff})')
+
+    def ftp_EPSV(self, argumento):
+        self.responder(f'229 Entering Extended Passive Mode (|||{self._abrir_passivo()}|)')
+
+    def _conexao_dados(self):
+        """Aceita a conexão de dados do PASV/EPSV anterior"""
+        if self.passivo is None:
+            self.responder('425 Use PASV or EPSV first')
+            return None
+        try:
+            dados, _ = self.passivo.accept()
+        except socket.timeout:
+            self.responder('425 Data connection timed out')
+            return None
+        finally:
+            self.passivo.close()
+            self.passivo = None
+        return CanalCondicionado(dados, self.servidor, atrasar=False, ao_derrubar=lambda: self.canal.derrubar(contar=False))
+
+    def ftp_STOR(self, argumento):
+        local = self.servidor.caminho_local(argumento, self.atual)[1]
+        if not os.path.isdir(os.path.dirname(local)):
+            raise FileNotFoundError(argumento)
+        offset, self.rest = self.rest, 0
+        self.responder('150 Ok to send data')
+        dados = self._conexao_dados()
+        if dados is None:
+            return
+        try:
+            with open(local, 'r+b' if offset and os.path.exists(local) else 'wb') as arquivo:
+                if offset:
+                    arquivo.seek(offset)
+                    arquivo.truncate()
+                while True:
+                    bloco = dados.recv(TAMANHO_BLOCO)
+                    if not bloco:
+                        break
+                    arquivo.write(bloco)
+        finally:
+            dados.close()
+        self.servidor._somar('arquivos_recebidos')
+        self.responder('226 Transfer complete')
+
+    def ftp_RETR(self, argumento):
+        local = self.servidor.caminho_local(argumento, self.atual)[1]
+        if not os.path.isfile(local):
+            raise FileNotFoundError(argumento)
+        offset, self.rest = self.rest, 0
+        self.responder('150 Opening data connection')
+        dados = self._conexao_dados()
+        if dados is None:
+            return
+        try:
+            with open(local, 'rb') as arquivo:
+                arquivo.seek(offset)
+                for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO), b''):
+                    dados.sendall(bloco)
+        finally:
+            dados.close()
+        self.responder('226 Transfer complete')
+
+    def _listar(self, argumento, formatar):
+        local = self.servidor.caminho_local(argumento if argumento and not argumento.startswith('-') else '', self.atual)[1]
+        if not os.path.isdir(local):
+            raise FileNotFoundError(argumento)
+        self.responder('150 Here comes the directory listing')
+        dados = self._conexao_dados()
+        if dados is None:
+            return
+        try:
+            linhas = [formatar(nome, os.stat(os.path.join(local, nome))) for nome in sorted(os.listdir(local))]
+            dados.sendall(''.join(linha + '\r\n' for linha in linhas).encode('utf-8'))
+        finally:
+            dados.close()
+        self.responder('226 Directory send OK')
+
+    def ftp_NLST(self, argumento):
+        self._listar(argumento, lambda nome, st: nome)
+
+    def ftp_LIST(self, argumento):
+        def formatar(nome, st):
+            tipo = 'd' if (st.st_mode & 0o170000) == 0o040000 else '-'
+            momento = datetime.fromtimestamp(st.st_mtime)
+            return f'{tipo}rw-r--r-- 1 ftp ftp {st.st_size:>12} {momento:%b %d %H:%M} {nome}'
+        self._listar(argumento, formatar)
+
+    def ftp_MLSD(self, argumento):
+        def formatar(nome, st):
+            tipo = 'dir' if (st.st_mode & 0o170000) == 0o040000 else 'file'
+            momento = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+            return f'type={tipo};size={st.st_size};modify={momento:%Y%m%d%H%M%S}; {nome}'
+        self._listar(argumento, formatar)
+
+
+class _ServidorTCP(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ServidorFTPLocal(_ServidorLocal):
+    """Servidor FTP local (passivo) sobre um diretório temporário"""
+
+    def iniciar(self):
+        self._tcp = _ServidorTCP((self.host, 0), _SessaoFTP)
+        self._tcp.local = self
+        self.porta = self._tcp.server_address[1]
+        self._thread = threading.Thread(target=self._tcp.serve_forever, name='ftp-local', daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._tcp.shutdown()
+        self._tcp.server_close()
+        self._remover_raiz()
+
+    def config(self):
+        """
+        Config no formato de FTP_CONFIGS (upload_via_ftp_config) e de
+        FTP_CONFIG (FTPUploaderOrientacoes: 'password' e 'upload_dir')
+        """
+        return {'host': self.host, 'port': self.porta, 'user': self.usuario, 'pass': self.senha,
+                'password': self.senha, 'upload_dir': 'public_html/images/products/', 'timeout': 30,
+                'priority': 1}
+
+
+# -------------------------------------------------------------------- SFTP
+
+if PARAMIKO_AVAILABLE:
+
+    class _HandleLocal(paramiko.SFTPHandle):
+        """Arquivo aberto pelo cliente SFTP"""
+
+        def __init__(self, servidor, flags=0):
+            super().__init__(flags)
+            self.servidor = servidor
+
+        def close(self):
+            if getattr(self, 'writefile', None) is not None:
+                self.servidor._somar('arquivos_recebidos')
+            super().close()
+
+        def stat(self):
+            try:
+                return paramiko.SFTPAttributes.from_stat(os.fstat((self.readfile or self.writefile).fileno()))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+    class _SFTPLocal(paramiko.SFTPServerInterface):
+        """Sistema de arquivos do SFTP: caminhos virtuais dentro da raiz"""
+
+        def __init__(self, interface, *args, servidor=None, **kwargs):
+            super().__init__(interface, *args, **kwargs)
+            self.servidor = servidor
+
+        def _local(self, caminho):
+            return self.servidor.caminho_local(caminho)[1]
+
+        def _erro(self, e):
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        def canonicalize(self, caminho):
+            return self.servidor.caminho_local(caminho)[0]
+
+        def list_folder(self, caminho):
+            try:
+                local = self._local(caminho)
+                itens = []
+                for nome in os.listdir(local):
+                    atributos = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local, nome)))
+                    atributos.filename = nome
+                    itens.append(atributos)
+                return itens
+            except OSError as e:
+                return self._erro(e)
+
+        def stat(self, caminho):
+            try:
+                return paramiko.SFTPAttributes.from_stat(os.stat(self._local(caminho)))
+            except OSError as e:
+                return self._erro(e)
+
+        lstat = stat
+
+        def open(self, caminho, flags, attr):
+            local = self._local(caminho)
+            try:
+                modo_os = flags | getattr(os, 'O_BINARY', 0)
+                descritor = os.open(local, modo_os, 0o644)
+            except OSError as e:
+                return self._erro(e)
+            if flags & os.O_WRONLY:
+                modo = 'ab' if flags & os.O_APPEND else 'wb'
+            elif flags & os.O_RDWR:
+                modo = 'a+b' if flags & os.O_APPEND else 'r+b'
+            else:
+                modo = 'rb'
+            arquivo = os.fdopen(descritor, modo)
+            handle = _HandleLocal(self.servidor, flags)
+            if 'r' in modo or '+' in modo:
+                handle.readfile = arquivo
+            if 'r' not in modo or '+' in modo:
+                handle.writefile = arquivo
+            return handle
+
+        def remove(self, caminho):
+            try:
+                os.remove(self._local(caminho))
+            except OSError as e:
+                return self._erro(e)
+            return paramiko.SFTP_OK
+
+        def rename(self, antigo, novo):
+            try:
+                os.replace(self._local(antigo), self._local(novo))
+            except OSError as e:
+                return self._erro(e)
+            return paramiko.SFTP_OK
+
+        posix_rename = rename
+
+        def mkdir(self, caminho, attr):
+            try:
+                os.mkdir(self._local(caminho))
+            except OSError as e:
+                return self._erro(e)
+            return paramiko.SFTP_OK
+
+        def rmdir(self, caminho):
+            try:
+                os.rmdir(self._local(caminho))
+            except OSError as e:
+                return self._erro(e)
+            return paramiko.SFTP_OK
+
+        def chattr(self, caminho, attr):
+            return paramiko.SFTP_OK
+
+    class _InterfaceSSH(paramiko.ServerInterface):
+        """Autenticação por senha, subsistema SFTP e (opcional) exec para o modo tar"""
+
+        def __init__(self, servidor):
+            self.servidor = servidor
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_auth_password(self, username, password):
+            if username == self.servidor.usuario and password == self.servidor.senha:
+                return paramiko.AUTH_SUCCESSFUL
+            return paramiko.AUTH_FAILED
+
+        def check_channel_request(self, kind, chanid):
+            if kind == 'session':
+                return paramiko.OPEN_SUCCEEDED
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_exec_request(self, channel, command):
+            if not self.servidor.exec_comandos:
+                return False
+            threading.Thread(target=self.servidor._executar_comando, args=(channel, command),
+                             name='sftp-local-exec', daemon=True).start()
+            return True
+
+
+_chave_host = None
+_chave_host_lock = threading.Lock()
+
+
+def chave_host():
+    """Chave RSA do servidor SFTP local (gerada uma vez por processo)"""
+    global _chave_host
+    with _chave_host_lock:
+        if _chave_host is None:
+            _chave_host = paramiko.RSAKey.generate(2048)
+        return _chave_host
+
+
+class ServidorSFTPLocal(_ServidorLocal):
+    """Servidor SSH/SFTP local (paramiko) sobre um diretório temporário"""
+
+    def __init__(self, raiz=None, usuario='teste', senha='teste', condicoes=None, exec_comandos=False):
+        """
+        Args:
+            exec_comandos: aceita canais exec (necessário para o modo tar de
+                SessaoSFTP); os comandos rodam num shell local com a raiz como
+                diretório atual, então só ligue em máquina de teste
+        """
+        if not PARAMIKO_AVAILABLE:
+            raise RuntimeError("paramiko não disponível")
+        super().__init__(raiz, usuario, senha, condicoes)
+        self.exec_comandos = exec_comandos
+        self._transportes = set()
+        self._rodando = False
+
+    def iniciar(self):
+        self._escuta = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._escuta.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._escuta.bind((self.host, 0))
+        self._escuta.listen(64)
+        self.porta = self._escuta.getsockname()[1]
+        self._rodando = True
+        chave_host()
+        self._thread = threading.Thread(target=self._aceitar, name='sftp-local', daemon=True)
+        self._thread.start()
+        return self
+
+    def _aceitar(self):
+        while self._rodando:
+            try:
+                sock, _ = self._escuta.accept()
+            except OSError:
+                return
+            if not self._admitir():
+                # Como o MaxStartups do sshd: derruba antes do banner
+                sock.close()
+                continue
+            threading.Thread(target=self._atender, args=(sock,), name='sftp-local-sessao', daemon=True).start()
+
+    def _atender(self, sock):
+        transporte = paramiko.Transport(CanalCondicionado(sock, self, queda_como_eof=True))
+        try:
+            transporte.add_server_key(chave_host())
+            transporte.set_subsystem_handler('sftp', paramiko.SFTPServer, _SFTPLocal, servidor=self)
+            with self._lock:
+                self._transportes.add(transporte)
+            transporte.start_server(server=_InterfaceSSH(self))
+            transporte.join()
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._transportes.discard(transporte)
+            transporte.close()
+            self._liberar()
+
+    def _executar_comando(self, canal, comando):
+        """Roda o comando do canal exec com stdin/stdout/stderr ligados ao canal"""
+        processo = subprocess.Popen(['sh', '-c', comando.decode('utf-8', 'replace')], cwd=self.raiz,
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def copiar_entrada():
+            try:
+                while True:
+                    dados = canal.recv(TAMANHO_BLOCO)
+                    if not dados:
+                        break
+                    processo.stdin.write(dados)
+            except (OSError, EOFError):
+                pass
+            finally:
+                try:
+                    processo.stdin.close()
+                except OSError:
+                    pass
+
+        def copiar_saida(origem, enviar):
+            for bloco in iter(lambda: origem.read1(TAMANHO_BLOCO), b''):
+                enviar(bloco)
+
+        threads = [threading.Thread(target=copiar_entrada, daemon=True),
+                   threading.Thread(target=copiar_saida, args=(processo.stdout, canal.sendall), daemon=True),
+                   threading.Thread(target=copiar_saida, args=(processo.stderr, canal.sendall_stderr), daemon=True)]
+        for thread in threads:
+            thread.start()
+        codigo = processo.wait()
+        for thread in threads[1:]:
+            thread.join()
+        try:
+            canal.send_exit_status(codigo)
+        finally:
+            canal.close()
+
+    def parar(self):
+        self._rodando = False
+        self._escuta.close()
+        with self._lock:
+            transportes = list(self._transportes)
+        for transporte in transportes:
+            transporte.close()
+        self._remover_raiz()
+
+    def config(self):
+        """
+        Config no formato de SSH_CONFIGS (upload_via_ssh_config); para o
+        SSHImageExtractor: SSHImageExtractor(c['host'], c['port'], c['user'], c['pass'])
+        """
+        return {'host': self.host, 'port': self.porta, 'user': self.usuario, 'pass': self.senha,
+                'key': None, 'priority': 1}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidores FTP/SFTP locais com condições de rede simuladas')
+    parser.add_argument('--raiz', help='diretório servido (padrão: temporário, apagado ao sair)')
+    parser.add_argument('--usuario', default='teste')
+    parser.add_argument('--senha', default='teste')
+    parser.add_argument('--latencia', type=float, default=0.0, help='segundos por resposta')
+    parser.add_argument('--banda', type=int, help='bytes/s por conexão')
+    parser.add_argument('--banda-total', type=int, help='bytes/s somando as conexões')
+    parser.add_argument('--max-conexoes', type=int, help='conexões simultâneas')
+    parser.add_argument('--queda', type=float, default=0.0, help='probabilidade de queda por comando/bloco')
+    parser.add_argument('--semente', type=int)
+    parser.add_argument('--sem-sftp', action='store_true', help='sobe só o FTP')
+    parser.add_argument('--exec', dest='exec_comandos', action='store_true', help='aceita canais exec (modo tar)')
+    args = parser.parse_args()
+
+    condicoes = CondicoesRede(args.latencia, args.banda, args.banda_total, args.max_conexoes, args.queda, args.semente)
+    servidores = [ServidorFTPLocal(args.raiz, args.usuario, args.senha, condicoes).iniciar()]
+    print(f"📡 FTP local:  {servidores[0].host}:{servidores[0].porta}  (raiz {servidores[0].raiz})")
+    if not args.sem_sftp:
+        if PARAMIKO_AVAILABLE:
+            sftp = ServidorSFTPLocal(args.raiz or servidores[0].raiz, args.usuario, args.senha, condicoes,
+                                     exec_comandos=args.exec_comandos).iniciar()
+            servidores.append(sftp)
+            print(f"🔐 SFTP local: {sftp.host}:{sftp.porta}")
+        else:
+            print("⚠️ paramiko não disponível, SFTP não iniciado")
+    print(f"👤 Usuário: {args.usuario} / {args.senha}  ·  Ctrl+C para parar")
+    try:
+        while True:
+            time.sleep(5)
+            for servidor in servidores:
+                print(f"   {type(servidor).__name__}: {servidor.estatisticas}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for servidor in reversed(servidores):
+            servidor.parar()
+
+
+if __name__ == "__main__":
+    main()
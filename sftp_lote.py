@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Envio em lote via SFTP sobre uma única sessão SSH
+Um transporte autenticado (uma troca de chaves) por lote, vários canais SFTP
+simultâneos sobre ele e putfo direto da memória com escrita em pipeline;
+a árvore de diretórios remota é criada uma vez por sessão. No modo 'tar' o
+lote inteiro vai como um único fluxo tar para um `tar -x` remoto.
+"""
+
+import io
+import os
+import posixpath
+import queue
+import shlex
+import stat
+import tarfile
+import threading
+import time
+from contextlib import contextmanager
+
+import paramiko
+
+from metricas import registrar_transferencia
+from resiliencia import com_retentativas
+from upload_paralelo import enviar_em_paralelo
+
+# Canais SFTP simultâneos por sessão (SFTP_CANAIS, padrão 4)
+CANAIS_PADRAO = int(os.getenv('SFTP_CANAIS', '4'))
+# Modo de upload SSH: 'sftp' (canais em paralelo) ou 'tar' (um fluxo por lote)
+MODO_UPLOAD_PADRAO = os.getenv('SSH_MODO_UPLOAD', 'sftp').lower()
+
+
+def comando_tar(diretorio, nomes):
+    """
+    Comando remoto que extrai o tar do stdin em `diretorio` e informa o resultado
+
+    Saída: os nomes extraídos (tar -v), uma linha "@@status <código>" e uma
+    linha "@@stat <tamanho> <nome>" por arquivo presente depois da extração.
+    """
+    destino = shlex.quote(diretorio)
+    lista = ' '.join(shlex.quote(nome) for nome in nomes)
+    return (f"mkdir -p {destino} && tar -xvf - -C {destino}; echo \"@@status $?\"; "
+            f"cd {destino} && stat -c '@@stat %s %n' -- {lista} 2>/dev/null; true")
+
+
+def interpretar_saida_tar(saida):
+    """(nomes extraídos, código de saída do tar, {nome: tamanho remoto})"""
+    extraidos = set()
+    status = None
+    tamanhos = {}
+    for linha in saida.splitlines():
+        if linha.startswith('@@status '):
+            status = int(linha.split()[1])
+        elif linha.startswith('@@stat '):
+            _, tamanho, nome = linha.split(' ', 2)
+            tamanhos[nome] = int(tamanho)
+        elif linha:
+            extraidos.add(linha.strip().removeprefix('./'))
+    return extraidos, status, tamanhos
+
+
+class SessaoSFTP:
+    """Transporte SSH autenticado com um pool de canais SFTP"""
+
+    def __init__(self, host, port, user, password=None, key_filename=None,
+                 canais=None, timeout=30, log=None, disjuntor=None):
+        """
+        Args:
+            key_filename: chave privada; usada se existir, senão autentica com senha
+            canais: canais SFTP abertos no mesmo transporte (uploads simultâneos)
+            log: função que recebe cada linha de log (ex.: debug_info.append)
+            disjuntor: Disjuntor do backend, alimentado pelos envios de enviar_lote
+        """
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.key_filename = key_filename
+        self.canais = max(1, canais or CANAIS_PADRAO)
+        self.timeout = timeout
+        self.log = log or (lambda mensagem: None)
+        self.disjuntor = disjuntor
+        self._ssh = None
+        self._livres = queue.LifoQueue()
+        self._abertos = []
+        self._lock = threading.Lock()
+        self._diretorios = set()
+        self._diretorios_lock = threading.Lock()
+        self._reconexao_lock = threading.Lock()
+
+    @property
+    def ativa(self):
+        return (self._ssh is not None and self._ssh.get_transport() is not None
+                and self._ssh.get_transport().is_active())
+
+    def conectar(self):
+        """Abre o transporte (chave primeiro, se existir; senão senha)"""
+        if self.ativa:
+            return self
+        self.fechar()
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        if self.key_filename and os.path.exists(self.key_filename):
+            self.log(f"🔑 Autenticando com chave: {self.key_filename}")
+            ssh.connect(self.host, self.port, self.user, key_filename=self.key_filename, timeout=self.timeout)
+        else:
+            ssh.connect(self.host, self.port, self.user, self.password, timeout=self.timeout)
+        ssh.get_transport().set_keepalive(30)
+        self._ssh = ssh
+        self.log(f"✅ Sessão SSH aberta: {self.host}:{self.port} ({self.canais} canais SFTP)")
+        return self
+
+    @contextmanager
+    def canal(self):
+        """
+        Empresta um canal SFTP do transporte (abre até `canais` sob demanda)
+
+        Um canal que levantou erro é fechado e não volta ao pool; a vaga é
+        reaberta pelo próximo que pedir um canal.
+        """
+        sftp = None
+        while sftp is None:
+            livres = self._livres
+            try:
+                sftp = livres.get_nowait()
+                break
+            except queue.Empty:
+                pass
+            with self._lock:
+                if self._ssh is None:
+                    raise paramiko.SSHException("Sessão SSH fechada")
+                if len(self._abertos) < self.canais:
+                    sftp = self._ssh.open_sftp()
+                    self._abertos.append(sftp)
+            if sftp is None:
+                try:
+                    sftp = livres.get(timeout=1)
+                except queue.Empty:
+                    pass
+        try:
+            yield sftp
+        except BaseException:
+            with self._lock:
+                if sftp in self._abertos:
+                    self._abertos.remove(sftp)
+            try:
+                sftp.close()
+            except Exception:
+                pass
+            raise
+        with self._lock:
+            devolver = sftp in self._abertos
+        if devolver:
+            self._livres.put(sftp)
+
+    def garantir_diretorio(self, caminho):
+        """Cria os níveis que faltarem de `caminho` (uma vez por sessão)"""
+        caminho = posixpath.normpath(caminho)
+        with self._diretorios_lock:
+            if caminho in self._diretorios:
+                return
+            with self.canal() as sftp:
+                atual = '/' if caminho.startswith('/') else ''
+                for parte in [p for p in caminho.split('/') if p]:
+                    atual = posixpath.join(atual, parte) if atual else parte
+                    if atual in self._diretorios:
+                        continue
+                    try:
+                        if not stat.S_ISDIR(sftp.stat(atual).st_mode):
+                            raise IOError(f"{atual} existe e não é diretório")
+                    except FileNotFoundError:
+                        sftp.mkdir(atual)
+                        self.log(f"📁 Diretório {atual} criado")
+                    self._diretorios.add(atual)
+
+    def enviar(self, dados, caminho_remoto):
+        """putfo de bytes em memória; confirma o tamanho remoto ao final"""
+        self.garantir_diretorio(posixpath.dirname(caminho_remoto) or '.')
+        with self.canal() as sftp:
+            sftp.putfo(io.BytesIO(dados), caminho_remoto, file_size=len(dados), confirm=True)
+        return True
+
+    def _reconectar_se_caiu(self, tentativa, erro):
+        """Antes de uma nova tentativa: reabre o transporte se ele caiu"""
+        self.log(f"🔁 SFTP: {erro} - nova tentativa ({tentativa + 1})")
+        with self._reconexao_lock:
+            if not self.ativa:
+                self.log("🔌 Transporte SSH caiu, reconectando")
+                try:
+                    self.conectar()
+                except Exception as e:
+                    # A próxima tentativa falha com "Sessão SSH fechada" e entra no backoff
+                    self.log(f"❌ Reconexão SSH falhou: {e}")
+
+    @property
+    def backend(self):
+        """Nome do backend nas métricas (o do disjuntor, se houver)"""
+        return self.disjuntor.nome if self.disjuntor is not None else 'sftp'
+
+    def enviar_resiliente(self, dados, caminho_remoto):
+        """enviar() com backoff nos erros transitórios e reconexão se o transporte cair"""
+        inicio = time.perf_counter()
+        try:
+            resultado = com_retentativas(
+                lambda: self.enviar(dados, caminho_remoto),
+                disjuntor=self.disjuntor,
+                ao_falhar=self._reconectar_se_caiu
+            )
+        except Exception as e:
+            registrar_transferencia(self.backend, time.perf_counter() - inicio, erro=e)
+            raise
+        registrar_transferencia(self.backend, time.perf_counter() - inicio, len(dados))
+        return resultado
+
+    def enviar_lote(self, arquivos):
+        """
+        Envia vários arquivos em paralelo pelos canais da sessão
+
+        Args:
+            arquivos: lista de dicts com 'ref', 'dados' (bytes) e 'caminho' remoto
+
+        Returns:
+            dict de enviar_em_paralelo (uploads_successful, uploads_failed, errors, ...)
+        """
+        self.conectar()
+        for diretorio in sorted({posixpath.dirname(a['caminho']) for a in arquivos}):
+            if diretorio:
+                self.garantir_diretorio(diretorio)
+        return enviar_em_paralelo(
+            arquivos,
+            lambda arquivo: self.enviar_resiliente(arquivo['dados'], arquivo['caminho']),
+            max_conexoes=self.canais
+        )
+
+    def enviar_tar(self, arquivos, diretorio, reenviar_falhas=True):
+        """
+        Envia o lote como um único fluxo tar para `tar -x -C diretorio` remoto
+
+        O tar é gerado em memória e escrito direto no stdin do canal exec;
+        o resultado de cada arquivo vem da saída do tar remoto e de um stat
+        final (tamanho conferido). Falhas podem ser reenviadas pelos canais
+        SFTP da mesma sessão.
+
+        Args:
+            arquivos: lista de dicts com 'ref', 'dados' e 'caminho' (só o basename
+                de 'caminho' é usado, como nome no tar)
+            diretorio: diretório remoto relativo ao home do shell; o reenvio SFTP
+                das falhas grava em diretorio/nome, junto dos extraídos
+
+        Returns:
+            dict no formato de enviar_em_paralelo, com 'method': 'tar'
+        """
+        self.conectar()
+        inicio = time.perf_counter()
+        nomes = [posixpath.basename(a['caminho']) for a in arquivos]
+        validos = [n and n not in ('.', '..') for n in nomes]
+
+        canal = self._ssh.get_transport().open_session(timeout=self.timeout)
+        canal.exec_command(comando_tar(diretorio, [n for n, ok in zip(nomes, validos) if ok]))
+        # stdout e stderr lidos em paralelo desde já: se um deles encher a janela
+        # do canal o tar remoto para, e com ele a escrita do fluxo e a leitura do outro
+        saidas = {}
+        leitores = [
+            threading.Thread(target=lambda nome=nome, arquivo=arquivo: saidas.__setitem__(nome, arquivo.read()),
+                             daemon=True)
+            for nome, arquivo in (('stdout', canal.makefile('rb')), ('stderr', canal.makefile_stderr('rb')))
+        ]
+        for leitor in leitores:
+            leitor.start()
+        stdin = canal.makefile('wb')
+        with tarfile.open(fileobj=stdin, mode='w|', format=tarfile.GNU_FORMAT) as tar:
+            agora = time.time()
+            for arquivo, nome, ok in zip(arquivos, nomes, validos):
+                if not ok:
+                    continue
+                info = tarfile.TarInfo(nome)
+                info.size = len(arquivo['dados'])
+                info.mtime = agora
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(arquivo['dados']))
+        stdin.flush()
+        canal.shutdown_write()
+        for leitor in leitores:
+            leitor.join()
+        saida = saidas.get('stdout', b'').decode('utf-8', 'replace')
+        erros_remotos = saidas.get('stderr', b'').decode('utf-8', 'replace').strip()
+        canal.recv_exit_status()
+        canal.close()
+
+        extraidos, status, tamanhos = interpretar_saida_tar(saida)
+        segundos = time.perf_counter() - inicio
+
+        timings = []
+        errors = []
+        falhas = []
+        for arquivo, nome, ok in zip(arquivos, nomes, validos):
+            sucesso = ok and nome in extraidos and tamanhos.get(nome) == len(arquivo['dados'])
+            timings.append({'ref': arquivo['ref'], 'seconds': round(segundos, 4), 'success': sucesso})
+            if sucesso:
+                # Tempo do fluxo dividido entre os arquivos (um único envio para o lote todo)
+                registrar_transferencia('tar', segundos / len(arquivos), len(arquivo['dados']))
+            else:
+                falhas.append(arquivo)
+        self.log(f"📦 tar remoto: {len(arquivos) - len(falhas)}/{len(arquivos)} arquivo(s) confirmados "
+                 f"em {segundos:.2f}s (status {status})")
+        if erros_remotos:
+            self.log(f"⚠️ tar remoto: {erros_remotos.splitlines()[-1]}")
+
+        reenviados = 0
+        if falhas and reenviar_falhas:
+            self.log(f"🔁 Reenviando {len(falhas)} arquivo(s) via SFTP")
+            # Mesmo destino do tar, não o 'caminho' original (que pode ser absoluto)
+            reenvio = self.enviar_lote([
+                dict(arquivo, caminho=posixpath.join(diretorio, posixpath.basename(arquivo['caminho'])))
+                for arquivo in falhas
+            ])
+            por_ref = {t['ref']: t for t in reenvio['upload_timings'] if t}
+            for timing in timings:
+                if not timing['success'] and timing['ref'] in por_ref:
+                    timing['success'] = por_ref[timing['ref']]['success']
+            errors.extend(reenvio['errors'])
+            reenviados = len(falhas)
+        else:
+            for arquivo in falhas:
+                errors.append(f"Falha no upload (tar) da imagem para REF: {arquivo['ref']}")
+                registrar_transferencia('tar', segundos / len(arquivos), erro='nao_confirmado')
+
+        sucessos = sum(1 for t in timings if t['success'])
+        return {
+            'uploads_successful': sucessos,
+            'uploads_failed': len(arquivos) - sucessos,
+            'errors': errors,
+            'upload_timings': timings,
+            'upload_elapsed': round(time.perf_counter() - inicio, 4),
+            'upload_connections': 1,
+            'tar_status': status,
+            'resent_via_sftp': reenviados,
+            'method': 'tar'
+        }
+
+    def fechar(self):
+        with self._lock:
+            for sftp in self._abertos:
+                try:
+                    sftp.close()
+                except Exception:
+                    pass
+            self._abertos = []
+            self._livres = queue.LifoQueue()
+            self._diretorios = set()
+            if self._ssh is not None:
+                try:
+                    self._ssh.close()
+                except Exception:
+                    pass
+                self._ssh = None
+
+    def __enter__(self):
+        return self.conectar()
+
+    def __exit__(self, *exc):
+        self.fechar()
+        return False
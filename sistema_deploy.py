@@ -9,11 +9,15 @@ import os
 import json
 import tempfile
 import webbrowser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import threading
 import time
 
+from multipart_streaming import ler_arquivo_multipart, ErroMultipart, ArquivoMuitoGrande
+from servidor_concorrente import ServidorHTTPConcorrente, admissao_upload
+from metricas import responder_metricas, TEMPO_MULTIPART, JOBS_EM_ANDAMENTO
+
 # Importações opcionais com fallback
 try:
     from upload_ftp_corrigido import FTPImageExtractorCorrigido
@@ -47,13 +51,17 @@ class DeployUploadHandler(BaseHTTPRequestHandler):
             self.serve_config()
         elif self.path == '/health':
             self.serve_health()
+        elif self.path == '/metrics':
+            responder_metricas(self)
         else:
             self.send_error(404)
     
     def do_POST(self):
         """Processa uploads"""
         if self.path == '/upload':
-            self.handle_upload()
+            with admissao_upload(self) as admitido:
+                if admitido:
+                    self.handle_upload()
         else:
             self.send_error(404)
     
@@ -632,38 +640,16 @@ class DeployUploadHandler(BaseHTTPRequestHandler):
                 self.wfile.write(json.dumps(error_response).encode())
                 return
             
-            # Lê o arquivo enviado
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
-            # Parse do FormData
-            boundary = self.headers['Content-Type'].split('boundary=')[1]
-            parts = post_data.split(f'--{boundary}'.encode())
-            
-            file_data = None
-            filename = None
-            
-            for part in parts:
-                if b'Content-Disposition: form-data' in part:
-                    if b'filename=' in part:
-                        # Extrai nome do arquivo
-                        filename_start = part.find(b'filename="') + 11
-                        filename_end = part.find(b'"', filename_start)
-                        filename = part[filename_start:filename_end].decode()
-                        
-                        # Extrai dados do arquivo
-                        file_start = part.find(b'\r\n\r\n') + 4
-                        file_data = part[file_start:-2]  # Remove \r\n no final
-                        break
-            
-            if not file_data or not filename:
-                self.send_error(400, 'Arquivo não encontrado')
+            # Lê o multipart em blocos; o arquivo vai para um buffer spooled
+            try:
+                with TEMPO_MULTIPART.medir():
+                    recebido = ler_arquivo_multipart(self.rfile, self.headers)
+            except ArquivoMuitoGrande as e:
+                self.send_error(413, str(e))
+                return
+            except ErroMultipart as e:
+                self.send_error(400, str(e))
                 return
-            
-            # Salva arquivo temporariamente
-            temp_path = os.path.join(tempfile.gettempdir(), filename)
-            with open(temp_path, 'wb') as f:
-                f.write(file_data)
             
             # Processa com o sistema FTP corrigido
             extractor = FTPImageExtractorCorrigido(
@@ -672,7 +658,8 @@ class DeployUploadHandler(BaseHTTPRequestHandler):
                 "]X9CC>t~ihWhdzNq"
             )
             
-            stats = extractor.process_excel_file(temp_path, start_row=4, photo_column='H')
+            with recebido, JOBS_EM_ANDAMENTO.em_andamento():
+                stats = extractor.process_excel_file(recebido.arquivo, start_row=4, photo_column='H')
             
             # Prepara resposta
             response_data = {
@@ -694,9 +681,6 @@ class DeployUploadHandler(BaseHTTPRequestHandler):
                     }
                 ]
             
-            # Remove arquivo temporário
-            os.remove(temp_path)
-            
             # Envia resposta
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
@@ -733,7 +717,7 @@ def start_deploy_server():
     print(f"   • PIL: {'✅' if PIL_AVAILABLE else '❌'}")
     print("=" * 50)
     
-    server = HTTPServer(('0.0.0.0', port), DeployUploadHandler)
+    server = ServidorHTTPConcorrente(('0.0.0.0', port), DeployUploadHandler)
     
     try:
         server.serve_forever()
@@ -17,6 +17,9 @@ import socket
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+from imagem_memoria import extrair_bytes_imagem, buffer_imagem
+from rastreamento import Rastro, rastro_pedido
+
 # Imports condicionais
 try:
     import openpyxl
@@ -34,6 +37,7 @@ except ImportError:
 
 try:
     import ftplib
+    from pool_ftp import obter_pool
     FTP_AVAILABLE = True
 except ImportError:
     FTP_AVAILABLE = False
@@ -208,6 +212,9 @@ HTML_TEMPLATE = """
             const formData = new FormData();
             formData.append('excel_file', selectedFile);
             formData.append('method', method);
+            if (new URLSearchParams(window.location.search).has('debug')) {
+                formData.append('debug', '1');
+            }
             
             document.getElementById('uploadBtn').disabled = true;
             document.getElementById('resetBtn').disabled = true;
@@ -391,147 +398,127 @@ def create_app():
     
     @app.route('/upload', methods=['POST'])
     def upload():
-        """Upload de arquivo Excel"""
-        debug_info = []
+        """Upload de arquivo Excel (debug=1 inclui o rastro na resposta)"""
+        rastro = Rastro('upload', logger=logger)
+        incluir_rastro = rastro_pedido(request.values.get('debug'))
+        
+        def responder(dados):
+            # Árvore de tempos e últimos eventos só quando pedido
+            if incluir_rastro:
+                dados['debug_info'] = rastro.exportar()
+            return jsonify(dados)
         
         try:
             method = request.form.get('method', 'ssh')
-            logger.info(f"=== INÍCIO DO UPLOAD {method.upper()} ===")
-            debug_info.append(f"=== INÍCIO DO UPLOAD {method.upper()} ===")
+            rastro.info("=== INÍCIO DO UPLOAD %s ===", method.upper())
             
             if not OPENPYXL_AVAILABLE:
                 error_msg = 'openpyxl não disponível'
-                logger.error(error_msg)
-                debug_info.append(f"❌ {error_msg}")
-                return jsonify({
-                    'error': error_msg,
-                    'debug_info': '\n'.join(debug_info)
-                })
+                rastro.erro("❌ %s", error_msg)
+                return responder({'error': error_msg})
             
             if 'excel_file' not in request.files:
                 error_msg = 'Arquivo não encontrado'
-                logger.error(error_msg)
-                debug_info.append(f"❌ {error_msg}")
-                return jsonify({
-                    'error': error_msg,
-                    'debug_info': '\n'.join(debug_info)
-                })
+                rastro.erro("❌ %s", error_msg)
+                return responder({'error': error_msg})
             
             file = request.files['excel_file']
-            logger.info(f"📁 Arquivo recebido: {file.filename}")
-            debug_info.append(f"📁 Arquivo recebido: {file.filename}")
+            rastro.info("📁 Arquivo recebido: %s", file.filename)
             
             if file.filename == '':
                 error_msg = 'Nenhum arquivo selecionado'
-                logger.error(error_msg)
-                debug_info.append(f"❌ {error_msg}")
-                return jsonify({
-                    'error': error_msg,
-                    'debug_info': '\n'.join(debug_info)
-                })
+                rastro.erro("❌ %s", error_msg)
+                return responder({'error': error_msg})
             
             # Salva arquivo temporariamente
             temp_path = os.path.join('/tmp', file.filename)
             file.save(temp_path)
-            logger.info(f"💾 Arquivo salvo em: {temp_path}")
-            debug_info.append(f"💾 Arquivo salvo em: {temp_path}")
+            rastro.info("💾 Arquivo salvo em: %s", temp_path)
             
             # Processamento
-            stats = process_excel(temp_path, method, debug_info)
+            stats = process_excel(temp_path, method, rastro)
             
             # Remove arquivo temporário
             os.remove(temp_path)
             
-            # Adiciona debug info
-            stats['debug_info'] = '\n'.join(debug_info)
             stats['method'] = method
-            return jsonify(stats)
+            return responder(stats)
             
         except Exception as e:
             error_msg = str(e)
-            logger.error(f"❌ Erro geral: {error_msg}")
-            debug_info.append(f"❌ Erro geral: {error_msg}")
-            
-            return jsonify({
-                'error': error_msg,
-                'debug_info': '\n'.join(debug_info)
-            })
+            rastro.erro("❌ Erro geral: %s", error_msg)
+            return responder({'error': error_msg})
     
     return app
 
-def process_excel(file_path, method, debug_info):
-    """Processamento do Excel"""
+def process_excel(file_path, method, rastro):
+    """Processamento do Excel (eventos e tempos de cada fase vão para `rastro`)"""
     try:
-        logger.info(f"📊 Carregando arquivo: {file_path}")
-        debug_info.append(f"📊 Carregando arquivo: {file_path}")
+        rastro.info("📊 Carregando arquivo: %s", file_path)
         
-        workbook = openpyxl.load_workbook(file_path)
+        with rastro.span('carregar_planilha'):
+            workbook = openpyxl.load_workbook(file_path)
         worksheet = workbook.active
-        logger.info(f"📋 Planilha: {worksheet.title}")
-        debug_info.append(f"📋 Planilha: {worksheet.title}")
-        
-        # Processa REFs
-        refs = []
-        for row in range(4, worksheet.max_row + 1):
-            cell_value = worksheet[f'A{row}'].value
-            if cell_value and str(cell_value).strip() and str(cell_value).upper() not in ['TOTAL', 'SUBTOTAL', '']:
-                refs.append(str(cell_value).strip())
-        
-        logger.info(f"📊 REFs encontradas: {len(refs)}")
-        debug_info.append(f"📊 REFs encontradas: {len(refs)}")
-        
-        # Processa imagens
-        images = []
-        total_images = len(worksheet._images)
-        logger.info(f"🖼️ Total de imagens: {total_images}")
-        debug_info.append(f"🖼️ Total de imagens: {total_images}")
-        
-        for i, image in enumerate(worksheet._images):
-            logger.info(f"🖼️ Analisando imagem {i+1}/{total_images}")
-            debug_info.append(f"🖼️ Analisando imagem {i+1}/{total_images}")
-            
-            if hasattr(image, 'anchor') and image.anchor:
-                anchor = image.anchor
-                if hasattr(anchor, '_from') and anchor._from:
-                    col_idx = anchor._from.col
-                    row_idx = anchor._from.row + 1
-                    col_letter = openpyxl.utils.get_column_letter(col_idx + 1)
-                    
-                    logger.info(f"📍 Posição: {col_letter}{row_idx}")
-                    debug_info.append(f"📍 Posição: {col_letter}{row_idx}")
-                    
-                    if col_letter == 'H' and row_idx >= 4:
-                        ref_cell = worksheet[f'A{row_idx}']
-                        if ref_cell.value:
-                            ref_value = str(ref_cell.value).strip()
-                            if ref_value and ref_value.upper() not in ['TOTAL', 'SUBTOTAL', '']:
-                                logger.info(f"✅ Imagem válida: REF {ref_value}")
-                                debug_info.append(f"✅ Imagem válida: REF {ref_value}")
-                                images.append({'image': image, 'ref': ref_value})
-        
-        logger.info(f"📊 Imagens válidas: {len(images)}")
-        debug_info.append(f"📊 Imagens válidas: {len(images)}")
+        rastro.info("📋 Planilha: %s", worksheet.title)
+        
+        with rastro.span('ancoras'):
+            # Processa REFs
+            refs = []
+            for row in range(4, worksheet.max_row + 1):
+                cell_value = worksheet[f'A{row}'].value
+                if cell_value and str(cell_value).strip() and str(cell_value).upper() not in ['TOTAL', 'SUBTOTAL', '']:
+                    refs.append(str(cell_value).strip())
+            
+            rastro.info("📊 REFs encontradas: %d", len(refs))
+            
+            # Processa imagens
+            images = []
+            total_images = len(worksheet._images)
+            rastro.info("🖼️ Total de imagens: %d", total_images)
+            
+            for i, image in enumerate(worksheet._images):
+                rastro.debug("🖼️ Analisando imagem %d/%d", i + 1, total_images)
+                
+                if hasattr(image, 'anchor') and image.anchor:
+                    anchor = image.anchor
+                    if hasattr(anchor, '_from') and anchor._from:
+                        col_idx = anchor._from.col
+                        row_idx = anchor._from.row + 1
+                        col_letter = openpyxl.utils.get_column_letter(col_idx + 1)
+                        
+                        rastro.debug("📍 Posição: %s%d", col_letter, row_idx)
+                        
+                        if col_letter == 'H' and row_idx >= 4:
+                            ref_cell = worksheet[f'A{row_idx}']
+                            if ref_cell.value:
+                                ref_value = str(ref_cell.value).strip()
+                                if ref_value and ref_value.upper() not in ['TOTAL', 'SUBTOTAL', '']:
+                                    rastro.debug("✅ Imagem válida: REF %s", ref_value)
+                                    images.append({'image': image, 'ref': ref_value})
+        
+        rastro.info("📊 Imagens válidas: %d", len(images))
         
         # Upload
         uploads_successful = 0
         uploads_failed = 0
         
-        if images:
-            if method == 'ssh':
-                uploads_successful, uploads_failed = upload_via_ssh(images, debug_info)
-            elif method == 'ftp':
-                uploads_successful, uploads_failed = upload_via_ftp(images, debug_info)
-            else:
-                error_msg = f"Método {method} não suportado"
-                debug_info.append(f"❌ {error_msg}")
-                return {
-                    'success': False,
-                    'error': error_msg,
-                    'total_refs': len(refs),
-                    'images_found': len(images),
-                    'uploads_successful': 0,
-                    'uploads_failed': len(images)
-                }
+        if images and method in ('ssh', 'ftp'):
+            with rastro.span(f'upload_{method}'):
+                if method == 'ssh':
+                    uploads_successful, uploads_failed = upload_via_ssh(images, rastro)
+                else:
+                    uploads_successful, uploads_failed = upload_via_ftp(images, rastro)
+        elif images:
+            error_msg = f"Método {method} não suportado"
+            rastro.erro("❌ %s", error_msg)
+            return {
+                'success': False,
+                'error': error_msg,
+                'total_refs': len(refs),
+                'images_found': len(images),
+                'uploads_successful': 0,
+                'uploads_failed': len(images)
+            }
         
         return {
             'success': True,
@@ -544,8 +531,7 @@ def process_excel(file_path, method, debug_info):
         
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"❌ Erro no processamento: {error_msg}")
-        debug_info.append(f"❌ Erro no processamento: {error_msg}")
+        rastro.erro("❌ Erro no processamento: %s", error_msg)
         
         return {
             'success': False,
@@ -556,175 +542,101 @@ def process_excel(file_path, method, debug_info):
             'uploads_failed': 1
         }
 
-def upload_via_ssh(images, debug_info):
+def upload_via_ssh(images, rastro):
     """Upload via SSH"""
     uploads_successful = 0
     uploads_failed = 0
     
     try:
-        debug_info.append(f"🔌 Conectando ao SSH: {SSH_HOST}:{SSH_PORT}")
+        rastro.info("🔌 Conectando ao SSH: %s:%s", SSH_HOST, SSH_PORT)
         ssh = paramiko.SSHClient()
         ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         ssh.connect(SSH_HOST, SSH_PORT, SSH_USER, SSH_PASS, timeout=30)
         sftp = ssh.open_sftp()
-        debug_info.append("✅ Conectado ao SSH")
+        rastro.info("✅ Conectado ao SSH")
         
         # Cria diretórios
         try:
             sftp.mkdir('/public_html')
-            debug_info.append("📁 Diretório /public_html criado")
+            rastro.info("📁 Diretório /public_html criado")
         except:
-            debug_info.append("📁 Diretório /public_html já existe")
+            rastro.debug("📁 Diretório /public_html já existe")
         
         try:
             sftp.mkdir('/public_html/images')
-            debug_info.append("📁 Diretório /public_html/images criado")
+            rastro.info("📁 Diretório /public_html/images criado")
         except:
-            debug_info.append("📁 Diretório /public_html/images já existe")
+            rastro.debug("📁 Diretório /public_html/images já existe")
         
         try:
             sftp.mkdir('/public_html/images/products')
-            debug_info.append("📁 Diretório /public_html/images/products criado")
+            rastro.info("📁 Diretório /public_html/images/products criado")
         except:
-            debug_info.append("📁 Diretório /public_html/images/products já existe")
+            rastro.debug("📁 Diretório /public_html/images/products já existe")
         
         for image_data in images:
             try:
-                temp_image_path = save_image_to_temp(image_data['image'], image_data['ref'], debug_info)
+                image_bytes = extrair_imagem(image_data['image'], image_data['ref'], rastro)
                 remote_path = f'/public_html/images/products/{image_data["ref"]}.jpg'
-                debug_info.append(f"⬆️ Upload SSH: {remote_path}")
-                sftp.put(temp_image_path, remote_path)
-                os.remove(temp_image_path)
+                rastro.debug("⬆️ Upload SSH: %s", remote_path)
+                with rastro.span('enviar_ssh'):
+                    sftp.putfo(buffer_imagem(image_bytes), remote_path)
                 uploads_successful += 1
-                debug_info.append(f"✅ Upload SSH: {image_data['ref']}")
+                rastro.debug("✅ Upload SSH: %s", image_data['ref'])
             except Exception as e:
                 uploads_failed += 1
-                debug_info.append(f"❌ Erro SSH: {image_data['ref']} - {e}")
+                rastro.erro("❌ Erro SSH: %s - %s", image_data['ref'], e)
         
         sftp.close()
         ssh.close()
         
     except Exception as e:
-        debug_info.append(f"❌ Erro SSH geral: {e}")
+        rastro.erro("❌ Erro SSH geral: %s", e)
         uploads_failed = len(images)
     
     return uploads_successful, uploads_failed
 
-def upload_via_ftp(images, debug_info):
+def upload_via_ftp(images, rastro):
     """Upload via FTP"""
     uploads_successful = 0
     uploads_failed = 0
     
     try:
-        debug_info.append(f"🔌 Conectando ao FTP: {FTP_HOST}:{FTP_PORT}")
-        ftp = ftplib.FTP()
-        ftp.connect(FTP_HOST, FTP_PORT, timeout=30)
-        ftp.login(FTP_USER, FTP_PASS)
-        debug_info.append("✅ Conectado ao FTP")
-        
-        # Cria diretórios
-        try:
-            ftp.cwd('public_html')
-            debug_info.append("📁 Diretório public_html encontrado")
-        except:
-            ftp.mkd('public_html')
-            ftp.cwd('public_html')
-            debug_info.append("📁 Diretório public_html criado")
-        
-        try:
-            ftp.cwd('images')
-            debug_info.append("📁 Diretório images encontrado")
-        except:
-            ftp.mkd('images')
-            ftp.cwd('images')
-            debug_info.append("📁 Diretório images criado")
-        
-        try:
-            ftp.cwd('products')
-            debug_info.append("📁 Diretório products encontrado")
-        except:
-            ftp.mkd('products')
-            ftp.cwd('products')
-            debug_info.append("📁 Diretório products criado")
+        rastro.info("🔌 Conectando ao FTP: %s:%s", FTP_HOST, FTP_PORT)
+        pool = obter_pool(FTP_HOST, FTP_USER, FTP_PASS, 'public_html/images/products', port=FTP_PORT, timeout=30)
+        with pool.conexao() as ftp:
+            rastro.info("✅ Conectado ao FTP - diretório: %s", ftp.pwd())
         
         for image_data in images:
             try:
-                temp_image_path = save_image_to_temp(image_data['image'], image_data['ref'], debug_info)
-                debug_info.append(f"⬆️ Upload FTP: {image_data['ref']}.jpg")
-                with open(temp_image_path, 'rb') as file:
-                    ftp.storbinary(f'STOR {image_data["ref"]}.jpg', file)
-                os.remove(temp_image_path)
+                image_bytes = extrair_imagem(image_data['image'], image_data['ref'], rastro)
+                rastro.debug("⬆️ Upload FTP: %s.jpg", image_data['ref'])
+                def enviar(ftp):
+                    ftp.storbinary(f'STOR {image_data["ref"]}.jpg', buffer_imagem(image_bytes))
+                with rastro.span('enviar_ftp'):
+                    pool.executar(enviar)
                 uploads_successful += 1
-                debug_info.append(f"✅ Upload FTP: {image_data['ref']}")
+                rastro.debug("✅ Upload FTP: %s", image_data['ref'])
             except Exception as e:
                 uploads_failed += 1
-                debug_info.append(f"❌ Erro FTP: {image_data['ref']} - {e}")
-        
-        ftp.quit()
+                rastro.erro("❌ Erro FTP: %s - %s", image_data['ref'], e)
         
     except Exception as e:
-        debug_info.append(f"❌ Erro FTP geral: {e}")
+        rastro.erro("❌ Erro FTP geral: %s", e)
         uploads_failed = len(images)
     
     return uploads_successful, uploads_failed
 
-def save_image_to_temp(image, ref_value, debug_info):
-    """Salva imagem temporariamente"""
+def extrair_imagem(image, ref_value, rastro):
+    """Extrai os bytes da imagem em memória (sem arquivo temporário)"""
     try:
-        safe_ref = "".join(c for c in ref_value if c.isalnum() or c in ('-', '_')).rstrip()
-        if not safe_ref:
-            safe_ref = f"image_{int(time.time())}"
-        
-        temp_path = os.path.join('/tmp', f"{safe_ref}.jpg")
-        debug_info.append(f"💾 Salvando imagem em: {temp_path}")
-        
-        # Tenta extrair dados da imagem
-        image_data = None
-        
-        if hasattr(image, '_data') and callable(image._data):
-            try:
-                image_data = image._data()
-                debug_info.append("📊 Dados extraídos via _data()")
-            except Exception as e:
-                debug_info.append(f"❌ Erro _data(): {e}")
-                pass
-        
-        if not image_data and hasattr(image, 'ref'):
-            try:
-                image_data = image.ref.read()
-                debug_info.append("📊 Dados extraídos via ref.read()")
-            except Exception as e:
-                debug_info.append(f"❌ Erro ref.read(): {e}")
-                pass
-        
-        if not image_data and hasattr(image, 'data'):
-            try:
-                image_data = image.data
-                debug_info.append("📊 Dados extraídos via data")
-            except Exception as e:
-                debug_info.append(f"❌ Erro data: {e}")
-                pass
-        
-        if not image_data:
-            try:
-                image.save(temp_path)
-                debug_info.append("📊 Imagem salva via save()")
-                return temp_path
-            except Exception as e:
-                debug_info.append(f"❌ Erro save(): {e}")
-                pass
-        
-        if image_data:
-            with open(temp_path, 'wb') as f:
-                f.write(image_data)
-            debug_info.append("📊 Imagem salva via dados extraídos")
-            return temp_path
-        
-        raise Exception("Não foi possível extrair dados da imagem")
+        with rastro.span('extrair_imagem'):
+            image_bytes = extrair_bytes_imagem(image)
+        rastro.debug("📊 Imagem %s em memória: %d bytes", ref_value, len(image_bytes))
+        return image_bytes
         
     except Exception as e:
-        logger.error(f"❌ Erro ao salvar imagem: {e}")
-        debug_info.append(f"❌ Erro ao salvar imagem: {e}")
+        rastro.erro("❌ Erro ao extrair imagem: %s", e)
         raise
 
 # Para PythonAnywhere
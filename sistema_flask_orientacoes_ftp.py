@@ -4,6 +4,7 @@
 Sistema que segue exatamente as configurações FTP já estabelecidas no projeto
 """
 
+import io
 import os
 import sys
 import tempfile
@@ -13,6 +14,9 @@ from flask import Flask, request, jsonify
 from werkzeug.utils import secure_filename
 from datetime import datetime
 
+from listagem_remota import ListagemRemota
+from pool_ftp import entrar_diretorio
+
 # Importa o detector integrado
 try:
     from detector_integrado import DetectorImagensIntegrado
@@ -66,6 +70,7 @@ class FTPUploaderOrientacoes:
     def __init__(self, config):
         self.config = config
         self.connection = None
+        self.listagem = ListagemRemota()
     
     def conectar(self):
         """Conecta ao servidor FTP seguindo orientações iniciais"""
@@ -75,9 +80,16 @@ class FTPUploaderOrientacoes:
             self.connection.connect(self.config['host'], self.config['port'])
             self.connection.login(self.config['user'], self.config['password'])
             
-            # Criar diretórios seguindo estrutura inicial
+            # Criar diretórios seguindo estrutura inicial (a sessão fica em products)
             self._criar_diretorios()
             
+            # Uma listagem por lote; atualizada a cada upload
+            try:
+                total = self.listagem.carregar(self.connection)
+                logger.info(f"📋 {total} arquivos no diretório remoto ({self.listagem.metodo})")
+            except Exception as e:
+                logger.warning(f"⚠️ Não foi possível listar o diretório remoto: {e}")
+            
             logger.info("✅ Conectado ao FTP com sucesso!")
             return True
         except Exception as e:
@@ -85,36 +97,8 @@ class FTPUploaderOrientacoes:
             return False
     
     def _criar_diretorios(self):
-        """Cria diretórios seguindo estrutura inicial do projeto"""
-        try:
-            # Criar public_html se não existir
-            try:
-                self.connection.mkd('public_html')
-                logger.debug("Diretório 'public_html' criado")
-            except:
-                logger.debug("Diretório 'public_html' já existe")
-            
-            # Criar images dentro de public_html
-            try:
-                self.connection.cwd('public_html')
-                self.connection.mkd('images')
-                logger.debug("Diretório 'images' criado")
-            except:
-                logger.debug("Diretório 'images' já existe")
-            
-            # Criar products dentro de images
-            try:
-                self.connection.cwd('images')
-                self.connection.mkd('products')
-                logger.debug("Diretório 'products' criado")
-            except:
-                logger.debug("Diretório 'products' já existe")
-            
-            # Volta para raiz
-            self.connection.cwd('/')
-            
-        except Exception as e:
-            logger.warning(f"Erro ao criar diretórios: {e}")
+        """Cria diretórios seguindo estrutura inicial do projeto e entra em products"""
+        entrar_diretorio(self.connection, '/' + self.config['upload_dir'].strip('/'))
     
     def desconectar(self):
         """Desconecta do servidor FTP"""
@@ -134,43 +118,22 @@ class FTPUploaderOrientacoes:
             
             logger.info(f"📤 Upload: {filename}")
             
-            # Criar arquivo temporário
-            temp_path = f"/tmp/{filename}"
-            with open(temp_path, 'wb') as f:
-                f.write(image_data)
-            
-            # Garantir que estamos no diretório correto
-            try:
-                self.connection.cwd('/')
-                logger.debug("Voltou para diretório raiz")
-            except Exception as e:
-                logger.warning(f"Erro ao voltar para raiz: {e}")
+            substituindo = self.listagem.contem(filename)
             
-            # Caminho completo seguindo estrutura inicial
+            # A sessão já está em public_html/images/products desde conectar()
             remote_path = f"public_html/images/products/{filename}"
             
             logger.debug(f"Fazendo upload para: {remote_path}")
             
-            # Fazer upload para FTP
-            with open(temp_path, 'rb') as f:
-                self.connection.storbinary(f'STOR {remote_path}', f)
+            # Fazer upload para FTP direto da memória
+            self.connection.storbinary(f'STOR {filename}', io.BytesIO(image_data))
             
-            # Verificar se o arquivo foi criado
-            try:
-                self.connection.cwd('public_html/images/products')
-                files_after = self.connection.nlst()
-                if filename in files_after:
-                    logger.info(f"   ✅ Upload confirmado: {filename} encontrado no servidor")
-                else:
-                    logger.warning(f"   ⚠️ Upload não confirmado: {filename} não encontrado no servidor")
-                
-                # Volta para raiz
-                self.connection.cwd('/')
-            except Exception as e:
-                logger.warning(f"Erro ao verificar upload: {e}")
-            
-            # Remover arquivo temporário
-            os.remove(temp_path)
+            # Confirmar só o arquivo enviado (SIZE), sem listar o diretório
+            if self.listagem.verificar_envio(self.connection, filename, len(image_data)):
+                acao = "substituído" if substituindo else "criado"
+                logger.info(f"   ✅ Upload confirmado: {filename} {acao} no servidor")
+            else:
+                logger.warning(f"   ⚠️ Upload não confirmado: {filename} ausente ou com tamanho diferente no servidor")
             
             logger.info(f"   ✅ Upload bem-sucedido: {remote_path}")
             logger.info(f"   🌐 Disponível em: {URLS_CONFIG['images_base']}{filename}")
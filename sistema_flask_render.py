@@ -11,6 +11,11 @@ import tempfile
 import traceback
 import time
 
+from imagem_memoria import extrair_bytes_imagem, buffer_imagem
+from fila_jobs import FilaJobs, FilaCheia
+from metricas import (exportar_metricas, registrar_transferencia, CONTENT_TYPE as CONTENT_TYPE_METRICAS,
+                      TEMPO_WORKBOOK, JOBS_EM_ANDAMENTO)
+
 # Imports condicionais para evitar erros de deploy
 try:
     import openpyxl
@@ -21,6 +26,7 @@ except ImportError:
 
 try:
     import ftplib
+    from pool_ftp import obter_pool
     FTP_AVAILABLE = True
 except ImportError:
     FTP_AVAILABLE = False
@@ -561,6 +567,7 @@ HTML_TEMPLATE = """
                 clearTimeout(timeoutId);
                 return response.json();
             })
+            .then(data => data.job_id ? waitForJob(data.job_id) : data)
             .then(data => {
                 clearInterval(progressInterval);
                 clearInterval(timerInterval);
@@ -603,6 +610,29 @@ HTML_TEMPLATE = """
             });
         }
         
+        function waitForJob(jobId) {
+            // O processamento roda em segundo plano; consulta o job até terminar
+            return new Promise((resolve, reject) => {
+                const poll = () => {
+                    fetch(`/jobs/${jobId}`)
+                    .then(response => response.json())
+                    .then(job => {
+                        if (job.status === 'done') {
+                            resolve(job.result);
+                        } else if (job.status === 'failed') {
+                            resolve({ error: job.error || 'Falha no processamento' });
+                        } else if (job.status === 'queued' || job.status === 'running') {
+                            setTimeout(poll, 1000);
+                        } else {
+                            resolve({ error: job.error || 'Job não encontrado' });
+                        }
+                    })
+                    .catch(reject);
+                };
+                poll();
+            });
+        }
+        
         function showResults(data) {
             const resultsDiv = document.getElementById('results');
             resultsDiv.style.display = 'block';
@@ -769,30 +799,23 @@ def create_flask_app():
                     'uploads_failed': 1
                 })
             
-            # Salva arquivo temporariamente
-            temp_path = os.path.join(tempfile.gettempdir(), file.filename)
-            file.save(temp_path)
-            
-            # Processamento completo
-            stats = process_excel_flask(temp_path)
-            
-            # Verifica se o arquivo tem imagens
-            if stats['images_found'] == 0:
-                error_response = {
-                    'error': f'Arquivo {file.filename} não contém imagens na coluna H. Use um arquivo que tenha imagens inseridas.',
-                    'total_refs': stats['total_refs'],
-                    'images_found': stats['images_found'],
+            # Enfileira o processamento completo e responde na hora
+            try:
+                job = fila_jobs.enviar(file, file.filename)
+            except FilaCheia as e:
+                return jsonify({
+                    'error': str(e),
+                    'total_refs': 0,
+                    'images_found': 0,
                     'uploads_successful': 0,
-                    'uploads_failed': stats['total_refs'],
-                    'suggestion': 'Arquivos recomendados: tartaruga.xlsx ou carrinho.xlsx'
-                }
-                os.remove(temp_path)
-                return jsonify(error_response)
-            
-            # Remove arquivo temporário
-            os.remove(temp_path)
+                    'uploads_failed': 0
+                }), 503, {'Retry-After': '30'}
             
-            return jsonify(stats)
+            return jsonify({
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f'/jobs/{job.id}'
+            }), 202, {'Location': f'/jobs/{job.id}'}
             
         except Exception as e:
             return jsonify({
@@ -803,12 +826,50 @@ def create_flask_app():
                 'uploads_failed': 1
             })
     
+    @app.route('/metrics')
+    def metrics():
+        """Métricas no formato do Prometheus"""
+        return exportar_metricas(), 200, {'Content-Type': CONTENT_TYPE_METRICAS}
+    
+    @app.route('/jobs/<job_id>')
+    def job_status(job_id):
+        """Status de um job de upload; result traz as stats no formato do /upload"""
+        job = fila_jobs.obter(job_id)
+        if job is None:
+            return jsonify({'job_id': job_id, 'status': 'unknown', 'error': 'Job não encontrado'}), 404
+        dados = job.para_dict()
+        dados['queue_position'] = fila_jobs.posicao(job)
+        return jsonify(dados)
+    
     return app
 
+def processar_job(job):
+    """Processa um job da fila e devolve as stats como o /upload síncrono devolvia"""
+    # Processamento completo
+    with JOBS_EM_ANDAMENTO.em_andamento():
+        stats = process_excel_flask(job.caminho)
+    
+    # Verifica se o arquivo tem imagens
+    if stats['images_found'] == 0:
+        return {
+            'error': f'Arquivo {job.filename} não contém imagens na coluna H. Use um arquivo que tenha imagens inseridas.',
+            'total_refs': stats['total_refs'],
+            'images_found': stats['images_found'],
+            'uploads_successful': 0,
+            'uploads_failed': stats['total_refs'],
+            'suggestion': 'Arquivos recomendados: tartaruga.xlsx ou carrinho.xlsx'
+        }
+    
+    return stats
+
+# Jobs processados em segundo plano (threads sobem no primeiro upload)
+fila_jobs = FilaJobs(processar_job)
+
 def process_excel_flask(file_path):
     """Processamento completo do Excel para Flask"""
     try:
-        workbook = openpyxl.load_workbook(file_path)
+        with TEMPO_WORKBOOK.medir(leitor='openpyxl'):
+            workbook = openpyxl.load_workbook(file_path)
         worksheet = workbook.active
         
         # Processa REFs
@@ -897,43 +958,23 @@ def extract_images_from_worksheet(worksheet, start_row=4, photo_column='H'):
     return images
 
 def upload_image_to_ftp(image, ref_value):
-    """Faz upload da imagem para FTP"""
+    """Faz upload da imagem para FTP direto da memória"""
     try:
-        # Salva imagem temporariamente
-        temp_image_path = save_image_to_temp(image, ref_value)
-        
-        # Conecta ao FTP
-        ftp = ftplib.FTP()
-        ftp.connect(FTP_HOST, 21, timeout=300)
-        ftp.login(FTP_USER, FTP_PASS)
+        # Bytes da imagem direto do xlsx, sem arquivo temporário
+        image_bytes = extrair_bytes_imagem(image)
         
-        # Cria diretórios se necessário
-        try:
-            ftp.cwd('public_html')
-        except:
-            ftp.mkd('public_html')
-            ftp.cwd('public_html')
-        
-        try:
-            ftp.cwd('images')
-        except:
-            ftp.mkd('images')
-            ftp.cwd('images')
+        # Upload usando sessão do pool (já autenticada e em FTP_DIR)
+        def enviar(ftp):
+            ftp.storbinary(f'STOR {ref_value}.jpg', buffer_imagem(image_bytes))
         
+        pool = obter_pool(FTP_HOST, FTP_USER, FTP_PASS, FTP_DIR, timeout=300)
+        inicio = time.perf_counter()
         try:
-            ftp.cwd('products')
-        except:
-            ftp.mkd('products')
-            ftp.cwd('products')
-        
-        # Upload do arquivo
-        with open(temp_image_path, 'rb') as file:
-            ftp.storbinary(f'STOR {ref_value}.jpg', file)
-        
-        ftp.quit()
-        
-        # Remove arquivo temporário
-        os.remove(temp_image_path)
+            pool.executar(enviar)
+        except Exception as e:
+            registrar_transferencia('ftp', time.perf_counter() - inicio, erro=e)
+            raise
+        registrar_transferencia('ftp', time.perf_counter() - inicio, len(image_bytes))
         
         return True
         
@@ -941,60 +982,6 @@ def upload_image_to_ftp(image, ref_value):
         print(f"Erro no upload FTP: {e}")
         return False
 
-def save_image_to_temp(image, ref_value):
-    """Salva imagem temporariamente"""
-    try:
-        # Sanitiza nome do arquivo
-        safe_ref = "".join(c for c in ref_value if c.isalnum() or c in ('-', '_')).rstrip()
-        if not safe_ref:
-            safe_ref = f"image_{int(time.time())}"
-        
-        temp_path = os.path.join(tempfile.gettempdir(), f"{safe_ref}.jpg")
-        
-        # Tenta diferentes métodos para extrair dados da imagem
-        image_data = None
-        
-        # Método 1: _data() (mais comum)
-        if hasattr(image, '_data') and callable(image._data):
-            try:
-                image_data = image._data()
-            except:
-                pass
-        
-        # Método 2: ref (BytesIO)
-        if not image_data and hasattr(image, 'ref'):
-            try:
-                image_data = image.ref.read()
-            except:
-                pass
-        
-        # Método 3: data
-        if not image_data and hasattr(image, 'data'):
-            try:
-                image_data = image.data
-            except:
-                pass
-        
-        # Método 4: image.save() como último recurso
-        if not image_data:
-            try:
-                image.save(temp_path)
-                return temp_path
-            except:
-                pass
-        
-        # Salva dados extraídos
-        if image_data:
-            with open(temp_path, 'wb') as f:
-                f.write(image_data)
-            return temp_path
-        
-        raise Exception("Não foi possível extrair dados da imagem")
-        
-    except Exception as e:
-        print(f"Erro ao salvar imagem: {e}")
-        raise
-
 def start_flask_server():
     """Inicia o servidor Flask"""
     port = int(os.getenv('PORT', 8080))
@@ -17,6 +17,18 @@ import socket
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+from imagem_memoria import extrair_bytes_imagem, buffer_imagem
+from manifesto_uploads import obter_manifesto, hash_conteudo, destino_ftp, metadados_remotos
+from listagem_remota import ListagemRemota
+from saude_backends import RegistroSaude
+from fila_jobs import FilaJobs, FilaCheia
+from derivadas_imagem import derivadas_ativas, enviar_derivadas
+from checkpoints_lotes import obter_checkpoints, hash_arquivo, stor_retomavel, ENVIANDO, ENVIADA, FALHOU
+from resiliencia import com_retentativas, obter_disjuntor, erro_transitorio, resumo_disjuntores
+from rastreamento import Rastro, rastro_pedido
+from metricas import (exportar_metricas, registrar_transferencia, CONTENT_TYPE as CONTENT_TYPE_METRICAS,
+                      TEMPO_MULTIPART, TEMPO_WORKBOOK, TEMPO_ANCORAS, JOBS_EM_ANDAMENTO)
+
 # Imports condicionais
 try:
     import openpyxl
@@ -27,6 +39,7 @@ except ImportError:
 
 try:
     import ftplib
+    from pool_ftp import obter_pool
     FTP_AVAILABLE = True
 except ImportError:
     FTP_AVAILABLE = False
@@ -34,6 +47,7 @@ except ImportError:
 
 try:
     import paramiko
+    from sftp_lote import SessaoSFTP, MODO_UPLOAD_PADRAO
     SSH_AVAILABLE = True
 except ImportError:
     SSH_AVAILABLE = False
@@ -59,6 +73,15 @@ SSH_CONFIGS = [
     {"host": "46.202.90.62", "port": 22, "user": "u715606397", "key": "/home/moribrasil/.ssh/id_ed25519", "pass": "]X9CC>t~ihWhdzNq"},
 ]
 
+# Servidor alternativo (ex.: servidores_locais nos testes de carga): FTP_HOST/FTP_PORT/
+# FTP_USER/FTP_PASSWORD e SSH_HOST/SSH_PORT/SSH_USER/SSH_PASSWORD/SSH_KEY substituem as listas
+if os.getenv('FTP_HOST'):
+    FTP_CONFIGS = [{"host": os.getenv('FTP_HOST'), "port": int(os.getenv('FTP_PORT', '21')),
+                    "user": os.getenv('FTP_USER', ''), "pass": os.getenv('FTP_PASSWORD', ''), "priority": 1}]
+if os.getenv('SSH_HOST'):
+    SSH_CONFIGS = [{"host": os.getenv('SSH_HOST'), "port": int(os.getenv('SSH_PORT', '22')),
+                    "user": os.getenv('SSH_USER', ''), "key": os.getenv('SSH_KEY', ''), "pass": os.getenv('SSH_PASSWORD', '')}]
+
 # HTML Template
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -233,6 +256,9 @@ HTML_TEMPLATE = """
             const formData = new FormData();
             formData.append('excel_file', selectedFile);
             formData.append('method', method);
+            if (new URLSearchParams(window.location.search).has('debug')) {
+                formData.append('debug', '1');
+            }
             
             document.getElementById('uploadBtn').disabled = true;
             document.getElementById('resetBtn').disabled = true;
@@ -244,6 +270,13 @@ HTML_TEMPLATE = """
                 body: formData
             })
             .then(response => response.json())
+            .then(data => {
+                if (!data.job_id) {
+                    return data;
+                }
+                updateProgress(30, 2);
+                return waitForJob(data.job_id);
+            })
             .then(data => {
                 updateProgress(100, 5);
                 showResults(data);
@@ -255,6 +288,32 @@ HTML_TEMPLATE = """
             });
         }
         
+        function waitForJob(jobId) {
+            // O processamento roda em segundo plano; consulta o job até terminar
+            return new Promise((resolve, reject) => {
+                const poll = () => {
+                    fetch(`/jobs/${jobId}`)
+                    .then(response => response.json())
+                    .then(job => {
+                        if (job.status === 'done') {
+                            resolve(job.result);
+                        } else if (job.status === 'failed') {
+                            resolve({ error: job.error || 'Falha no processamento' });
+                        } else if (job.status === 'running') {
+                            updateProgress(60, 3);
+                            setTimeout(poll, 1000);
+                        } else if (job.status === 'queued') {
+                            setTimeout(poll, 1000);
+                        } else {
+                            resolve({ error: job.error || 'Job não encontrado' });
+                        }
+                    })
+                    .catch(reject);
+                };
+                poll();
+            });
+        }
+        
         function showResults(data) {
             const resultsDiv = document.getElementById('results');
             const endTime = Date.now();
@@ -375,6 +434,13 @@ def test_ssh_connections():
     
     return None, ["❌ Nenhuma configuração SSH funcionou"]
 
+# Saúde dos backends sondada em segundo plano; uploads e /health leem o cache
+registro_saude = RegistroSaude(
+    {'ftp': test_ftp_connections, 'ssh': test_ssh_connections},
+    intervalo=int(os.getenv('HEALTH_INTERVALO', '60')),
+    ttl=int(os.getenv('HEALTH_TTL', '180'))
+)
+
 def create_app():
     """Cria aplicação Flask para PythonAnywhere"""
     app = Flask(__name__)
@@ -383,9 +449,9 @@ def create_app():
     def index():
         python_version = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
         
-        # Testa conectividade - FTP primeiro
-        ftp_config, ftp_debug = test_ftp_connections()
-        ssh_config, ssh_debug = test_ssh_connections()
+        # Conectividade do cache do registro - FTP primeiro
+        ftp_config, ftp_debug = registro_saude.config('ftp')
+        ssh_config, ssh_debug = registro_saude.config('ssh')
         
         ftp_status = "✅ Conectado" if ftp_config else "❌ Sem conexão"
         ssh_status = "✅ Conectado" if ssh_config else "❌ Sem conexão"
@@ -411,8 +477,10 @@ def create_app():
     def health():
         """Health check para PythonAnywhere"""
         try:
-            ftp_config, ftp_debug = test_ftp_connections()
-            ssh_config, ssh_debug = test_ssh_connections()
+            # Só lê o cache; nunca abre conexões durante o health check
+            backends = registro_saude.resumo()
+            ftp_config, ftp_debug = backends['ftp']['config'], backends['ftp']['debug']
+            ssh_config, ssh_debug = backends['ssh']['config'], backends['ssh']['debug']
             
             health_data = {
                 "status": "ok",
@@ -426,6 +494,9 @@ def create_app():
                 "ssh_config": ssh_config,
                 "ftp_debug": ftp_debug,
                 "ssh_debug": ssh_debug,
+                "ftp_checked_age": backends['ftp']['idade'],
+                "ssh_checked_age": backends['ssh']['idade'],
+                "circuit_breakers": resumo_disjuntores(),
                 "dependencies": {
                     "ftp": FTP_AVAILABLE,
                     "ssh": SSH_AVAILABLE,
@@ -452,149 +523,163 @@ def create_app():
     
     @app.route('/upload', methods=['POST'])
     def upload():
-        """Upload de arquivo Excel"""
-        debug_info = []
-        
+        """Upload de arquivo Excel (debug=1 devolve o rastro do job no resultado)"""
         try:
             method = request.form.get('method', 'auto')
             logger.info(f"=== INÍCIO DO UPLOAD {method.upper()} ===")
-            debug_info.append(f"=== INÍCIO DO UPLOAD {method.upper()} ===")
             
             if not OPENPYXL_AVAILABLE:
                 error_msg = 'openpyxl não disponível'
                 logger.error(error_msg)
-                debug_info.append(f"❌ {error_msg}")
-                return jsonify({
-                    'error': error_msg,
-                    'debug_info': '\n'.join(debug_info)
-                })
+                return jsonify({'error': error_msg})
+            
+            # O primeiro acesso a request.files lê e separa o corpo multipart
+            with TEMPO_MULTIPART.medir():
+                arquivos = request.files
             
-            if 'excel_file' not in request.files:
+            if 'excel_file' not in arquivos:
                 error_msg = 'Arquivo não encontrado'
                 logger.error(error_msg)
-                debug_info.append(f"❌ {error_msg}")
-                return jsonify({
-                    'error': error_msg,
-                    'debug_info': '\n'.join(debug_info)
-                })
+                return jsonify({'error': error_msg})
             
-            file = request.files['excel_file']
+            file = arquivos['excel_file']
             logger.info(f"📁 Arquivo recebido: {file.filename}")
-            debug_info.append(f"📁 Arquivo recebido: {file.filename}")
             
             if file.filename == '':
                 error_msg = 'Nenhum arquivo selecionado'
                 logger.error(error_msg)
-                debug_info.append(f"❌ {error_msg}")
-                return jsonify({
-                    'error': error_msg,
-                    'debug_info': '\n'.join(debug_info)
-                })
+                return jsonify({'error': error_msg})
             
-            # Salva arquivo temporariamente
-            temp_path = os.path.join('/tmp', file.filename)
-            file.save(temp_path)
-            logger.info(f"💾 Arquivo salvo em: {temp_path}")
-            debug_info.append(f"💾 Arquivo salvo em: {temp_path}")
-            
-            # Processamento
-            stats = process_excel(temp_path, method, debug_info)
-            
-            # Remove arquivo temporário
-            os.remove(temp_path)
+            # Enfileira o processamento e responde na hora
+            try:
+                job = fila_jobs.enviar(file, file.filename, method=method,
+                                       debug=rastro_pedido(request.values.get('debug')))
+            except FilaCheia as e:
+                logger.warning(f"⚠️ {e}")
+                return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
             
-            # Adiciona debug info
-            stats['debug_info'] = '\n'.join(debug_info)
-            stats['method'] = method
-            return jsonify(stats)
+            logger.info(f"📥 Job {job.id} enfileirado ({file.filename})")
+            return jsonify({
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f'/jobs/{job.id}',
+                'method': method
+            }), 202, {'Location': f'/jobs/{job.id}'}
             
         except Exception as e:
             error_msg = str(e)
             logger.error(f"❌ Erro geral: {error_msg}")
-            debug_info.append(f"❌ Erro geral: {error_msg}")
-            
-            return jsonify({
-                'error': error_msg,
-                'debug_info': '\n'.join(debug_info)
-            })
+            return jsonify({'error': error_msg})
+    
+    @app.route('/metrics')
+    def metrics():
+        """Métricas no formato do Prometheus"""
+        return exportar_metricas(), 200, {'Content-Type': CONTENT_TYPE_METRICAS}
+    
+    @app.route('/jobs/<job_id>')
+    def job_status(job_id):
+        """Status de um job de upload; result traz as stats no formato do /upload"""
+        job = fila_jobs.obter(job_id)
+        if job is None:
+            return jsonify({'job_id': job_id, 'status': 'unknown', 'error': 'Job não encontrado'}), 404
+        dados = job.para_dict()
+        dados['queue_position'] = fila_jobs.posicao(job)
+        return jsonify(dados)
     
     return app
 
-def process_excel(file_path, method, debug_info):
-    """Processamento do Excel"""
+def processar_job(job):
+    """Processa um job da fila e devolve as stats como o /upload síncrono devolvia"""
+    method = job.parametros.get('method', 'auto')
+    rastro = Rastro('job', logger=logger)
+    rastro.info("=== INÍCIO DO UPLOAD %s (job %s) ===", method.upper(), job.id)
+    rastro.info("📁 Arquivo recebido: %s", job.filename)
+    
+    with JOBS_EM_ANDAMENTO.em_andamento():
+        stats = process_excel(job.caminho, method, rastro, job_id=job.id)
+    
+    # Árvore de tempos e últimos eventos só quando o upload pediu (debug=1)
+    if job.parametros.get('debug'):
+        stats['debug_info'] = rastro.exportar()
+    stats['method'] = method
+    return stats
+
+# Jobs processados em segundo plano (threads sobem no primeiro upload)
+fila_jobs = FilaJobs(processar_job)
+
+def process_excel(file_path, method, rastro, job_id=None):
+    """Processamento do Excel (eventos e tempos de cada fase vão para `rastro`)"""
     try:
-        logger.info(f"📊 Carregando arquivo: {file_path}")
-        debug_info.append(f"📊 Carregando arquivo: {file_path}")
+        rastro.info("📊 Carregando arquivo: %s", file_path)
         
-        workbook = openpyxl.load_workbook(file_path)
+        # Identifica o lote para o checkpoint (mesma planilha = mesmo lote)
+        lote = {'workbook_hash': hash_arquivo(file_path), 'job_id': job_id}
+        
+        with TEMPO_WORKBOOK.medir(leitor='openpyxl'), rastro.span('carregar_planilha'):
+            workbook = openpyxl.load_workbook(file_path)
         worksheet = workbook.active
-        logger.info(f"📋 Planilha: {worksheet.title}")
-        debug_info.append(f"📋 Planilha: {worksheet.title}")
-        
-        # Processa REFs
-        refs = []
-        for row in range(4, worksheet.max_row + 1):
-            cell_value = worksheet[f'A{row}'].value
-            if cell_value and str(cell_value).strip() and str(cell_value).upper() not in ['TOTAL', 'SUBTOTAL', '']:
-                refs.append(str(cell_value).strip())
-        
-        logger.info(f"📊 REFs encontradas: {len(refs)}")
-        debug_info.append(f"📊 REFs encontradas: {len(refs)}")
-        
-        # Processa imagens
-        images = []
-        total_images = len(worksheet._images)
-        logger.info(f"🖼️ Total de imagens: {total_images}")
-        debug_info.append(f"🖼️ Total de imagens: {total_images}")
-        
-        for i, image in enumerate(worksheet._images):
-            logger.info(f"🖼️ Analisando imagem {i+1}/{total_images}")
-            debug_info.append(f"🖼️ Analisando imagem {i+1}/{total_images}")
-            
-            if hasattr(image, 'anchor') and image.anchor:
-                anchor = image.anchor
-                if hasattr(anchor, '_from') and anchor._from:
-                    col_idx = anchor._from.col
-                    row_idx = anchor._from.row + 1
-                    col_letter = openpyxl.utils.get_column_letter(col_idx + 1)
-                    
-                    logger.info(f"📍 Posição: {col_letter}{row_idx}")
-                    debug_info.append(f"📍 Posição: {col_letter}{row_idx}")
-                    
-                    if col_letter == 'H' and row_idx >= 4:
-                        ref_cell = worksheet[f'A{row_idx}']
-                        if ref_cell.value:
-                            ref_value = str(ref_cell.value).strip()
-                            if ref_value and ref_value.upper() not in ['TOTAL', 'SUBTOTAL', '']:
-                                logger.info(f"✅ Imagem válida: REF {ref_value}")
-                                debug_info.append(f"✅ Imagem válida: REF {ref_value}")
-                                images.append({'image': image, 'ref': ref_value})
-        
-        logger.info(f"📊 Imagens válidas: {len(images)}")
-        debug_info.append(f"📊 Imagens válidas: {len(images)}")
+        rastro.info("📋 Planilha: %s", worksheet.title)
+        
+        # Processa REFs (o casamento REF/âncora conta como detecção de âncoras)
+        with TEMPO_ANCORAS.medir(), rastro.span('ancoras'):
+            refs = []
+            for row in range(4, worksheet.max_row + 1):
+                cell_value = worksheet[f'A{row}'].value
+                if cell_value and str(cell_value).strip() and str(cell_value).upper() not in ['TOTAL', 'SUBTOTAL', '']:
+                    refs.append(str(cell_value).strip())
+            
+            rastro.info("📊 REFs encontradas: %d", len(refs))
+            
+            # Processa imagens
+            images = []
+            total_images = len(worksheet._images)
+            rastro.info("🖼️ Total de imagens: %d", total_images)
+            
+            for i, image in enumerate(worksheet._images):
+                rastro.debug("🖼️ Analisando imagem %d/%d", i + 1, total_images)
+                
+                if hasattr(image, 'anchor') and image.anchor:
+                    anchor = image.anchor
+                    if hasattr(anchor, '_from') and anchor._from:
+                        col_idx = anchor._from.col
+                        row_idx = anchor._from.row + 1
+                        col_letter = openpyxl.utils.get_column_letter(col_idx + 1)
+                        
+                        rastro.debug("📍 Posição: %s%d", col_letter, row_idx)
+                        
+                        if col_letter == 'H' and row_idx >= 4:
+                            ref_cell = worksheet[f'A{row_idx}']
+                            if ref_cell.value:
+                                ref_value = str(ref_cell.value).strip()
+                                if ref_value and ref_value.upper() not in ['TOTAL', 'SUBTOTAL', '']:
+                                    rastro.debug("✅ Imagem válida: REF %s", ref_value)
+                                    images.append({'image': image, 'ref': ref_value})
+        
+        rastro.info("📊 Imagens válidas: %d", len(images))
         
         # Upload
         uploads_successful = 0
         uploads_failed = 0
         
-        if images:
-            if method == 'auto':
-                uploads_successful, uploads_failed = upload_auto(images, debug_info)
-            elif method == 'ftp':
-                uploads_successful, uploads_failed = upload_via_ftp(images, debug_info)
-            elif method == 'ssh':
-                uploads_successful, uploads_failed = upload_via_ssh(images, debug_info)
-            else:
-                error_msg = f"Método {method} não suportado"
-                debug_info.append(f"❌ {error_msg}")
-                return {
-                    'success': False,
-                    'error': error_msg,
-                    'total_refs': len(refs),
-                    'images_found': len(images),
-                    'uploads_successful': 0,
-                    'uploads_failed': len(images)
-                }
+        if images and method in ('auto', 'ftp', 'ssh'):
+            with rastro.span(f'upload_{method}'):
+                if method == 'auto':
+                    uploads_successful, uploads_failed = upload_auto(images, rastro, lote)
+                elif method == 'ftp':
+                    uploads_successful, uploads_failed = upload_via_ftp(images, rastro, lote)
+                else:
+                    uploads_successful, uploads_failed = upload_via_ssh(images, rastro)
+        elif images:
+            error_msg = f"Método {method} não suportado"
+            rastro.erro("❌ %s", error_msg)
+            return {
+                'success': False,
+                'error': error_msg,
+                'total_refs': len(refs),
+                'images_found': len(images),
+                'uploads_successful': 0,
+                'uploads_failed': len(images)
+            }
         
         return {
             'success': True,
@@ -607,8 +692,7 @@ def process_excel(file_path, method, debug_info):
         
     except Exception as e:
         error_msg = str(e)
-        logger.error(f"❌ Erro no processamento: {error_msg}")
-        debug_info.append(f"❌ Erro no processamento: {error_msg}")
+        rastro.erro("❌ Erro no processamento: %s", error_msg)
         
         return {
             'success': False,
@@ -619,227 +703,280 @@ def process_excel(file_path, method, debug_info):
             'uploads_failed': 1
         }
 
-def upload_auto(images, debug_info):
+def upload_auto(images, rastro, lote=None):
     """Upload automático - FTP primeiro, SSH como fallback"""
-    debug_info.append("🔄 Modo automático: testando FTP primeiro")
+    rastro.info("🔄 Modo automático: testando FTP primeiro")
     
-    # Tenta FTP primeiro
-    ftp_config, ftp_debug = test_ftp_connections()
-    if ftp_config:
-        debug_info.extend(ftp_debug)
-        debug_info.append(f"✅ FTP funcionando, usando: {ftp_config['host']}:{ftp_config['port']}")
-        return upload_via_ftp_config(images, ftp_config, debug_info)
+    # Circuito do FTP aberto: caiu há pouco, vai direto para SSH sem pagar o timeout
+    disjuntor_ftp = obter_disjuntor('ftp')
+    if not disjuntor_ftp.permite():
+        rastro.aviso("⚡ FTP com circuito aberto (%s), nova tentativa em %.0fs",
+                     disjuntor_ftp.ultimo_erro, disjuntor_ftp.reabre_em())
+    else:
+        # Tenta FTP primeiro
+        ftp_config, ftp_debug = registro_saude.config('ftp')
+        if ftp_config:
+            rastro.linhas(ftp_debug)
+            rastro.info("✅ FTP funcionando, usando: %s:%s", ftp_config['host'], ftp_config['port'])
+            falhas = []
+            uploads_successful, uploads_failed = verificar_resultado(
+                'ftp', upload_via_ftp_config(images, ftp_config, rastro, lote, falhas=falhas)
+            )
+            if not falhas or disjuntor_ftp.permite():
+                return uploads_successful, uploads_failed
+            
+            # O circuito abriu no meio do lote: o que faltou segue pelo SSH
+            ssh_config, ssh_debug = registro_saude.config('ssh')
+            if not ssh_config:
+                return uploads_successful, uploads_failed
+            rastro.aviso("⚡ Circuito do FTP abriu: %d imagem(ns) seguem via SSH", len(falhas))
+            ssh_ok, ssh_falhas = verificar_resultado('ssh', upload_via_ssh_config(falhas, ssh_config, rastro))
+            return uploads_successful + ssh_ok, uploads_failed - ssh_ok
     
     # Se FTP falhar, tenta SSH
-    debug_info.append("⚠️ FTP falhou, tentando SSH")
-    ssh_config, ssh_debug = test_ssh_connections()
+    rastro.aviso("⚠️ FTP falhou, tentando SSH")
+    ssh_config, ssh_debug = registro_saude.config('ssh')
     if ssh_config:
-        debug_info.extend(ssh_debug)
-        debug_info.append(f"✅ SSH funcionando, usando: {ssh_config['host']}:{ssh_config['port']}")
-        return upload_via_ssh_config(images, ssh_config, debug_info)
+        rastro.linhas(ssh_debug)
+        rastro.info("✅ SSH funcionando, usando: %s:%s", ssh_config['host'], ssh_config['port'])
+        return verificar_resultado('ssh', upload_via_ssh_config(images, ssh_config, rastro))
     
     # Se ambos falharem
-    debug_info.append("❌ FTP e SSH falharam")
+    rastro.erro("❌ FTP e SSH falharam")
     return 0, len(images)
 
-def upload_via_ftp(images, debug_info):
+def upload_via_ftp(images, rastro, lote=None):
     """Upload via FTP"""
-    ftp_config, ftp_debug = test_ftp_connections()
+    ftp_config, ftp_debug = registro_saude.config('ftp')
+    rastro.linhas(ftp_debug)
     if not ftp_config:
-        debug_info.extend(ftp_debug)
         return 0, len(images)
     
-    debug_info.extend(ftp_debug)
-    return upload_via_ftp_config(images, ftp_config, debug_info)
+    return verificar_resultado('ftp', upload_via_ftp_config(images, ftp_config, rastro, lote))
 
-def upload_via_ssh(images, debug_info):
+def upload_via_ssh(images, rastro):
     """Upload via SSH"""
-    ssh_config, ssh_debug = test_ssh_connections()
+    ssh_config, ssh_debug = registro_saude.config('ssh')
+    rastro.linhas(ssh_debug)
     if not ssh_config:
-        debug_info.extend(ssh_debug)
         return 0, len(images)
     
-    debug_info.extend(ssh_debug)
-    return upload_via_ssh_config(images, ssh_config, debug_info)
+    return verificar_resultado('ssh', upload_via_ssh_config(images, ssh_config, rastro))
+
+def verificar_resultado(backend, resultado):
+    """Invalida o cache do backend se todos os uploads com a config em cache falharam"""
+    uploads_successful, uploads_failed = resultado
+    if uploads_successful == 0 and uploads_failed > 0:
+        registro_saude.invalidar(backend)
+    return resultado
 
-def upload_via_ftp_config(images, config, debug_info):
-    """Upload via FTP com configuração específica"""
+def upload_via_ftp_config(images, config, rastro, lote=None, falhas=None):
+    """
+    Upload via FTP com configuração específica
+    
+    lote: {'workbook_hash', 'job_id'} ativa o checkpoint do lote; um novo envio
+    da mesma planilha continua da primeira imagem não concluída
+    falhas: lista que recebe os itens de `images` não enviados
+    
+    Erros transitórios (421, EOF, timeout) são repetidos por imagem com backoff
+    em uma sessão nova; falhas seguidas abrem o circuito do backend 'ftp' e as
+    imagens restantes falham na hora.
+    """
     uploads_successful = 0
     uploads_failed = 0
+    checkpoint = None
+    enviadas = set()
+    disjuntor = obter_disjuntor('ftp')
+    
+    def nova_tentativa(descricao):
+        return lambda tentativa, erro: rastro.aviso(
+            "🔁 %s: %s - reconectando (tentativa %d)", descricao, erro, tentativa + 1
+        )
     
     try:
-        debug_info.append(f"🔌 Conectando ao FTP: {config['host']}:{config['port']}")
-        ftp = ftplib.FTP()
-        ftp.connect(config['host'], config['port'], timeout=30)
-        ftp.login(config['user'], config['pass'])
-        debug_info.append("✅ Conectado ao FTP")
-        
-        # Cria diretórios
+        rastro.info("🔌 Conectando ao FTP: %s:%s", config['host'], config['port'])
+        pool = obter_pool(config['host'], config['user'], config['pass'], 'public_html/images/products', port=config['port'], timeout=30)
+        def diretorio_atual():
+            with pool.conexao() as ftp:
+                return ftp.pwd()
+        diretorio = com_retentativas(diretorio_atual, disjuntor=disjuntor, ao_falhar=nova_tentativa('Conexão FTP'))
+        rastro.info("✅ Conectado ao FTP - diretório: %s", diretorio)
+        
+        # Manifesto local: REFs com o mesmo conteúdo já enviado não são reenviadas
+        manifesto = obter_manifesto()
+        destino = destino_ftp(config['host'], config['user'], 'public_html/images/products', config['port'])
+        inalteradas = 0
+        retomadas = 0
+        originais = []
+        
+        # Uma listagem do diretório por lote: o manifesto só vale se o arquivo
+        # continua no servidor com o tamanho registrado
+        listagem = ListagemRemota()
         try:
-            ftp.cwd('public_html')
-            debug_info.append("📁 Diretório public_html encontrado")
-        except:
-            ftp.mkd('public_html')
-            ftp.cwd('public_html')
-            debug_info.append("📁 Diretório public_html criado")
-        
-        try:
-            ftp.cwd('images')
-            debug_info.append("📁 Diretório images encontrado")
-        except:
-            ftp.mkd('images')
-            ftp.cwd('images')
-            debug_info.append("📁 Diretório images criado")
+            with pool.conexao() as ftp:
+                listagem.carregar(ftp)
+        except Exception as e:
+            rastro.aviso("⚠️ Listagem remota indisponível, manifesto sem conferência de tamanho: %s", e)
         
-        try:
-            ftp.cwd('products')
-            debug_info.append("📁 Diretório products encontrado")
-        except:
-            ftp.mkd('products')
-            ftp.cwd('products')
-            debug_info.append("📁 Diretório products criado")
+        # Checkpoint do lote: estado por REF persistido a cada imagem
+        if lote:
+            checkpoint = obter_checkpoints().abrir_lote(lote['workbook_hash'], destino, lote.get('job_id'))
+            if checkpoint.retomado:
+                rastro.info("♻️ Retomando lote %s: %d imagem(ns) já enviada(s)", checkpoint.id[:8], checkpoint.concluidas())
         
         for image_data in images:
+            ref = image_data['ref']
             try:
-                temp_image_path = save_image_to_temp(image_data['image'], image_data['ref'], debug_info)
-                debug_info.append(f"⬆️ Upload FTP: {image_data['ref']}.jpg")
-                with open(temp_image_path, 'rb') as file:
-                    ftp.storbinary(f'STOR {image_data["ref"]}.jpg', file)
-                os.remove(temp_image_path)
+                image_bytes = extrair_imagem(image_data['image'], ref, rastro)
+                conteudo_hash = hash_conteudo(image_bytes)
+                # Enviada pelo lote, mas só conta se o arquivo continua no servidor
+                if (checkpoint and checkpoint.concluida(ref)
+                        and listagem.presente(f'{ref}.jpg', len(image_bytes))):
+                    uploads_successful += 1
+                    enviadas.add(ref)
+                    originais.append((ref, image_bytes, conteudo_hash))
+                    retomadas += 1
+                    continue
+                if manifesto.inalterada(destino, ref, conteudo_hash, listagem):
+                    uploads_successful += 1
+                    enviadas.add(ref)
+                    originais.append((ref, image_bytes, conteudo_hash))
+                    inalteradas += 1
+                    rastro.debug("⏭️ Inalterada, upload ignorado: %s.jpg", ref)
+                    if checkpoint:
+                        checkpoint.marcar(ref, ENVIADA, len(image_bytes))
+                    continue
+                
+                # Interrompida numa execução anterior: retoma com REST do que já chegou
+                retomar = bool(checkpoint and checkpoint.interrompida(ref))
+                if checkpoint:
+                    checkpoint.marcar(ref, ENVIANDO, len(image_bytes))
+                rastro.debug("⬆️ Upload FTP: %s.jpg", ref)
+                tentativas = []
+                def enviar(ftp):
+                    # Nova tentativa do pool após queda: continua o .part desta execução
+                    tentativas.append(ftp)
+                    offset = stor_retomavel(ftp, f'{ref}.jpg', image_bytes, retomar=retomar or len(tentativas) > 1,
+                                            parcial=checkpoint.parcial(f'{ref}.jpg') if checkpoint else None)
+                    return offset, metadados_remotos(ftp, f'{ref}.jpg')
+                # Cada tentativa pega uma sessão nova do pool (a quebrada é descartada)
+                inicio = time.perf_counter()
+                try:
+                    with rastro.span('enviar_ftp'):
+                        offset, (tamanho, mtime) = com_retentativas(
+                            lambda: pool.executar(enviar, tentativas=1),
+                            disjuntor=disjuntor, ao_falhar=nova_tentativa(f'{ref}.jpg')
+                        )
+                except Exception as e:
+                    registrar_transferencia('ftp', time.perf_counter() - inicio, erro=e)
+                    raise
+                registrar_transferencia('ftp', time.perf_counter() - inicio, len(image_bytes))
+                if offset:
+                    rastro.info("♻️ %s.jpg retomado a partir do byte %d", ref, offset)
+                if tamanho in (None, len(image_bytes)):
+                    manifesto.registrar(destino, ref, conteudo_hash, tamanho, mtime)
+                if checkpoint:
+                    checkpoint.marcar(ref, ENVIADA, len(image_bytes))
                 uploads_successful += 1
-                debug_info.append(f"✅ Upload FTP: {image_data['ref']}")
+                enviadas.add(ref)
+                originais.append((ref, image_bytes, conteudo_hash))
+                rastro.debug("✅ Upload FTP: %s", ref)
             except Exception as e:
                 uploads_failed += 1
-                debug_info.append(f"❌ Erro FTP: {image_data['ref']} - {e}")
-        
-        ftp.quit()
+                rastro.erro("❌ Erro FTP: %s - %s", ref, e)
+                if checkpoint and not checkpoint.interrompida(ref):
+                    checkpoint.marcar(ref, FALHOU, erro=str(e))
+        
+        if inalteradas:
+            rastro.info("⏭️ %d imagem(ns) inalterada(s) não reenviada(s)", inalteradas)
+        if retomadas:
+            rastro.info("♻️ %d imagem(ns) já enviada(s) antes da interrupção", retomadas)
+        if checkpoint and uploads_failed == 0:
+            checkpoint.concluir()
+        
+        # Miniaturas/WebP opcionais (DERIVADAS_TAMANHOS, DERIVADAS_WEBP), só das REFs
+        # cujo original está no servidor (falhas e o que segue via SSH ficam de fora)
+        if derivadas_ativas():
+            with rastro.span('derivadas'):
+                derivadas = enviar_derivadas(pool, manifesto, destino, originais, log=rastro.info)
+            rastro.info("🖼️ Derivadas: %d REF(s) geradas, %d arquivo(s) enviados, %d falha(s)",
+                        derivadas['refs_geradas'], derivadas['arquivos_enviados'], derivadas['falhas'])
         
     except Exception as e:
-        debug_info.append(f"❌ Erro FTP geral: {e}")
-        uploads_failed = len(images)
+        rastro.erro("❌ Erro FTP geral: %s", e)
+        # O que já foi enviado continua contado (e registrado no checkpoint)
+        uploads_failed = len(images) - uploads_successful
+    finally:
+        if checkpoint:
+            checkpoint.liberar()
     
+    if falhas is not None:
+        falhas.extend(image_data for image_data in images if image_data['ref'] not in enviadas)
     return uploads_successful, uploads_failed
 
-def upload_via_ssh_config(images, config, debug_info):
-    """Upload via SSH com configuração específica"""
+def upload_via_ssh_config(images, config, rastro):
+    """Upload via SSH com configuração específica (uma sessão, vários canais SFTP)"""
     uploads_successful = 0
     uploads_failed = 0
+    disjuntor = obter_disjuntor('ssh')
+    if not disjuntor.permite():
+        rastro.aviso("⚡ SSH com circuito aberto (%s), nova tentativa em %.0fs",
+                     disjuntor.ultimo_erro, disjuntor.reabre_em())
+        return 0, len(images)
     
     try:
-        debug_info.append(f"🔌 Conectando ao SSH: {config['host']}:{config['port']}")
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
-        # Tenta com chave primeiro
-        if os.path.exists(config['key']):
-            debug_info.append(f"🔑 Autenticando com chave: {config['key']}")
-            ssh.connect(config['host'], config['port'], config['user'], key_filename=config['key'], timeout=30)
-            debug_info.append("✅ Conectado com chave SSH")
-        else:
-            debug_info.append(f"⚠️ Chave não encontrada, usando senha")
-            ssh.connect(config['host'], config['port'], config['user'], config['pass'], timeout=30)
-            debug_info.append("✅ Conectado com senha")
-        
-        sftp = ssh.open_sftp()
-        
-        # Cria diretórios
-        try:
-            sftp.mkdir('/public_html')
-            debug_info.append("📁 Diretório /public_html criado")
-        except:
-            debug_info.append("📁 Diretório /public_html já existe")
-        
-        try:
-            sftp.mkdir('/public_html/images')
-            debug_info.append("📁 Diretório /public_html/images criado")
-        except:
-            debug_info.append("📁 Diretório /public_html/images já existe")
-        
-        try:
-            sftp.mkdir('/public_html/images/products')
-            debug_info.append("📁 Diretório /public_html/images/products criado")
-        except:
-            debug_info.append("📁 Diretório /public_html/images/products já existe")
-        
-        for image_data in images:
-            try:
-                temp_image_path = save_image_to_temp(image_data['image'], image_data['ref'], debug_info)
-                remote_path = f'/public_html/images/products/{image_data["ref"]}.jpg'
-                debug_info.append(f"⬆️ Upload SSH: {remote_path}")
-                sftp.put(temp_image_path, remote_path)
-                os.remove(temp_image_path)
-                uploads_successful += 1
-                debug_info.append(f"✅ Upload SSH: {image_data['ref']}")
-            except Exception as e:
-                uploads_failed += 1
-                debug_info.append(f"❌ Erro SSH: {image_data['ref']} - {e}")
-        
-        sftp.close()
-        ssh.close()
+        rastro.info("🔌 Conectando ao SSH: %s:%s", config['host'], config['port'])
+        with SessaoSFTP(config['host'], config['port'], config['user'], config['pass'],
+                        key_filename=config['key'], timeout=30, log=rastro.info,
+                        disjuntor=disjuntor) as sessao:
+            arquivos = []
+            for image_data in images:
+                try:
+                    image_bytes = extrair_imagem(image_data['image'], image_data['ref'], rastro)
+                    arquivos.append({
+                        'ref': image_data['ref'],
+                        'dados': image_bytes,
+                        'caminho': f'/public_html/images/products/{image_data["ref"]}.jpg'
+                    })
+                except Exception as e:
+                    uploads_failed += 1
+                    rastro.erro("❌ Erro SSH: %s - %s", image_data['ref'], e)
+            
+            with rastro.span('enviar_ssh'):
+                if MODO_UPLOAD_PADRAO == 'tar':
+                    # Lote inteiro em um fluxo tar para `tar -x` remoto (falhas reenviadas via SFTP)
+                    rastro.info("⬆️ Upload SSH: %d imagem(ns) em um fluxo tar", len(arquivos))
+                    resultado = sessao.enviar_tar(arquivos, 'public_html/images/products')
+                else:
+                    # Diretórios criados uma vez; putfo em paralelo pelos canais da sessão
+                    rastro.info("⬆️ Upload SSH: %d imagem(ns) em até %d canais SFTP", len(arquivos), sessao.canais)
+                    resultado = sessao.enviar_lote(arquivos)
+            uploads_successful += resultado['uploads_successful']
+            uploads_failed += resultado['uploads_failed']
+            for timing in resultado['upload_timings']:
+                if timing and timing['success']:
+                    rastro.debug("✅ Upload SSH: %s (%ss)", timing['ref'], timing['seconds'])
+            for erro in resultado['errors']:
+                rastro.erro("❌ Erro SSH: %s", erro)
         
     except Exception as e:
-        debug_info.append(f"❌ Erro SSH geral: {e}")
+        rastro.erro("❌ Erro SSH geral: %s", e)
+        if erro_transitorio(e):
+            disjuntor.registrar_falha(e)
         uploads_failed = len(images)
     
     return uploads_successful, uploads_failed
 
-def save_image_to_temp(image, ref_value, debug_info):
-    """Salva imagem temporariamente"""
+def extrair_imagem(image, ref_value, rastro):
+    """Extrai os bytes da imagem em memória (sem arquivo temporário)"""
     try:
-        safe_ref = "".join(c for c in ref_value if c.isalnum() or c in ('-', '_')).rstrip()
-        if not safe_ref:
-            safe_ref = f"image_{int(time.time())}"
-        
-        temp_path = os.path.join('/tmp', f"{safe_ref}.jpg")
-        debug_info.append(f"💾 Salvando imagem em: {temp_path}")
-        
-        # Tenta extrair dados da imagem
-        image_data = None
-        
-        if hasattr(image, '_data') and callable(image._data):
-            try:
-                image_data = image._data()
-                debug_info.append("📊 Dados extraídos via _data()")
-            except Exception as e:
-                debug_info.append(f"❌ Erro _data(): {e}")
-                pass
-        
-        if not image_data and hasattr(image, 'ref'):
-            try:
-                image_data = image.ref.read()
-                debug_info.append("📊 Dados extraídos via ref.read()")
-            except Exception as e:
-                debug_info.append(f"❌ Erro ref.read(): {e}")
-                pass
-        
-        if not image_data and hasattr(image, 'data'):
-            try:
-                image_data = image.data
-                debug_info.append("📊 Dados extraídos via data")
-            except Exception as e:
-                debug_info.append(f"❌ Erro data: {e}")
-                pass
-        
-        if not image_data:
-            try:
-                image.save(temp_path)
-                debug_info.append("📊 Imagem salva via save()")
-                return temp_path
-            except Exception as e:
-                debug_info.append(f"❌ Erro save(): {e}")
-                pass
-        
-        if image_data:
-            with open(temp_path, 'wb') as f:
-                f.write(image_data)
-            debug_info.append("📊 Imagem salva via dados extraídos")
-            return temp_path
-        
-        raise Exception("Não foi possível extrair dados da imagem")
+        with rastro.span('extrair_imagem'):
+            image_bytes = extrair_bytes_imagem(image)
+        rastro.debug("📊 Imagem %s em memória: %d bytes", ref_value, len(image_bytes))
+        return image_bytes
         
     except Exception as e:
-        logger.error(f"❌ Erro ao salvar imagem: {e}")
-        debug_info.append(f"❌ Erro ao salvar imagem: {e}")
+        rastro.erro("❌ Erro ao extrair imagem: %s", e)
         raise
 
 # Para PythonAnywhere
@@ -9,11 +9,14 @@ import os
 import json
 import tempfile
 import webbrowser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import threading
 import time
 
+from servidor_concorrente import ServidorHTTPConcorrente, admissao_upload
+from metricas import responder_metricas
+
 # Importações básicas (sem PIL)
 try:
     import openpyxl
@@ -40,13 +43,17 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
             self.serve_config()
         elif self.path == '/health':
             self.serve_health()
+        elif self.path == '/metrics':
+            responder_metricas(self)
         else:
             self.send_error(404)
     
     def do_POST(self):
         """Processa uploads"""
         if self.path == '/upload':
-            self.handle_upload()
+            with admissao_upload(self) as admitido:
+                if admitido:
+                    self.handle_upload()
         else:
             self.send_error(404)
     
@@ -908,7 +915,7 @@ def start_render_server():
     print(f"   • PIL: ❌ (não usado nesta versão)")
     print("=" * 50)
     
-    server = HTTPServer(('0.0.0.0', port), RenderUploadHandler)
+    server = ServidorHTTPConcorrente(('0.0.0.0', port), RenderUploadHandler)
     
     try:
         server.serve_forever()
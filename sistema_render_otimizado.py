@@ -9,10 +9,19 @@ import sys
 import json
 import tempfile
 import traceback
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import time
 
+from imagem_memoria import extrair_bytes_imagem, buffer_imagem
+from leitor_xlsx_zip import mapear_imagens_xlsx
+from multipart_streaming import ler_arquivo_multipart, ErroMultipart
+from upload_paralelo import enviar_em_paralelo, MAX_CONEXOES_PADRAO
+from progresso_eventos import RegistroProgresso, transmitir
+from servidor_concorrente import ServidorHTTPConcorrente, admissao_upload, admissao_stream
+from metricas import (responder_metricas, registrar_transferencia, TEMPO_MULTIPART, TEMPO_WORKBOOK,
+                      TEMPO_ANCORAS, JOBS_EM_ANDAMENTO)
+
 # Imports condicionais para evitar erros de deploy
 try:
     import openpyxl
@@ -23,16 +32,26 @@ except ImportError:
 
 try:
     import ftplib
+    from pool_ftp import obter_pool
     FTP_AVAILABLE = True
 except ImportError:
     FTP_AVAILABLE = False
     print("⚠️ ftplib não disponível")
 
-# Configurações FTP
-FTP_HOST = "46.202.90.62"
-FTP_USER = "u715606397.ideolog.ia.br"
-FTP_PASS = "]X9CC>t~ihWhdzNq"
+# Configurações FTP (FTP_HOST, FTP_PORT, FTP_USER e FTP_PASSWORD sobrescrevem)
+FTP_HOST = os.getenv('FTP_HOST', "46.202.90.62")
+FTP_PORT = int(os.getenv('FTP_PORT', '21'))
+FTP_USER = os.getenv('FTP_USER', "u715606397.ideolog.ia.br")
+FTP_PASS = os.getenv('FTP_PASSWORD', "]X9CC>t~ihWhdzNq")
 FTP_DIR = "public_html/images/products"
+FTP_MAX_CONEXOES = MAX_CONEXOES_PADRAO  # Sessões FTP simultâneas no upload
+
+# Canais de progresso por upload (/upload?progress=<id> publica, /progress/<id> transmite)
+registro_progresso = RegistroProgresso()
+
+def tamanho_imagem(image):
+    """Tamanho em bytes quando a imagem já está em memória (None para objetos do openpyxl)"""
+    return len(image) if isinstance(image, (bytes, bytearray)) else None
 
 class RenderUploadHandler(BaseHTTPRequestHandler):
     """Handler otimizado para Render"""
@@ -43,19 +62,26 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
     
     def do_GET(self):
         """Serve páginas"""
-        if self.path == '/':
+        path = urlparse(self.path).path
+        if path == '/':
             self.serve_frontend()
-        elif self.path == '/health':
+        elif path == '/health':
             self.serve_health()
-        elif self.path == '/config':
+        elif path == '/config':
             self.serve_config()
+        elif path == '/metrics':
+            responder_metricas(self)
+        elif path.startswith('/progress/'):
+            self.serve_progress(path[len('/progress/'):])
         else:
             self.send_error(404)
     
     def do_POST(self):
         """Processa uploads"""
-        if self.path == '/upload':
-            self.handle_upload()
+        if urlparse(self.path).path == '/upload':
+            with admissao_upload(self) as admitido:
+                if admitido:
+                    self.handle_upload()
         else:
             self.send_error(404)
     
@@ -88,6 +114,34 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(health).encode())
     
+    def serve_progress(self, progress_id):
+        """Server-Sent Events com o progresso de um upload (por REF)"""
+        if not progress_id or len(progress_id) > 64:
+            self.send_error(404)
+            return
+        with admissao_stream(self) as admitido:
+            if admitido:
+                self.transmitir_progresso(progress_id)
+    
+    def transmitir_progresso(self, progress_id):
+        # Só ids criados por um /upload?progress=<id> (que pode chegar logo depois)
+        canal = registro_progresso.aguardar(progress_id)
+        if canal is None:
+            self.send_error(404)
+            return
+        try:
+            ultimo_id = int(self.headers.get('Last-Event-ID', 0))
+        except ValueError:
+            ultimo_id = 0
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        transmitir(self.wfile, canal, ultimo_id=ultimo_id)
+        self.close_connection = True
+    
     def serve_config(self):
         """Configurações do sistema"""
         config = {
@@ -581,18 +635,34 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
             document.getElementById('progressContainer').style.display = 'block';
             document.getElementById('results').style.display = 'none';
             
-            // Barra de progresso avançada
-            let progress = 0;
-            let currentStep = 0;
+            // Progresso real: eventos do servidor via /progress/<id>
             let startTime = Date.now();
+            const progressId = Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+            const stepIds = ['step1', 'step2', 'step3', 'step4', 'step5'];
             
-            const steps = [
-                { text: 'Enviando arquivo...', progress: 20, stepId: 'step1' },
-                { text: 'Analisando planilha...', progress: 40, stepId: 'step2' },
-                { text: 'Extraindo imagens...', progress: 60, stepId: 'step3' },
-                { text: 'Fazendo upload FTP...', progress: 80, stepId: 'step4' },
-                { text: 'Finalizando...', progress: 100, stepId: 'step5' }
-            ];
+            function setStep(index, text) {
+                stepIds.forEach((stepId, i) => {
+                    const stepElement = document.getElementById(stepId);
+                    if (i < index) {
+                        stepElement.classList.remove('active');
+                        stepElement.classList.add('completed');
+                    } else if (i === index) {
+                        stepElement.classList.add('active');
+                    }
+                });
+                document.getElementById('progressText').textContent = text;
+                document.getElementById('progressStatus').textContent = text;
+            }
+            
+            function setProgress(percent) {
+                document.getElementById('progressFill').style.width = percent + '%';
+            }
+            
+            function formatBytes(bytes) {
+                if (bytes >= 1048576) return (bytes / 1048576).toFixed(1) + ' MB';
+                if (bytes >= 1024) return (bytes / 1024).toFixed(0) + ' KB';
+                return bytes + ' B';
+            }
             
             // Cronômetro
             const timerInterval = setInterval(() => {
@@ -602,41 +672,40 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
                 document.getElementById('progressTime').textContent = `${minutes}:${seconds}`;
             }, 1000);
             
-            // Progresso dos passos
-            const progressInterval = setInterval(() => {
-                if (currentStep < steps.length) {
-                    const step = steps[currentStep];
-                    
-                    // Atualiza barra de progresso
-                    progress = step.progress;
-                    document.getElementById('progressFill').style.width = progress + '%';
-                    document.getElementById('progressText').textContent = step.text;
-                    
-                    // Atualiza passo atual
-                    const stepElement = document.getElementById(step.stepId);
-                    stepElement.classList.add('active');
-                    
-                    // Marca passos anteriores como completos
-                    for (let i = 0; i < currentStep; i++) {
-                        const prevStep = document.getElementById(steps[i].stepId);
-                        prevStep.classList.remove('active');
-                        prevStep.classList.add('completed');
-                    }
-                    
-                    // Atualiza status
-                    document.getElementById('progressStatus').textContent = step.text;
-                    
-                    currentStep++;
-                } else {
-                    clearInterval(progressInterval);
-                }
-            }, 400);
+            setStep(0, 'Enviando arquivo...');
+            setProgress(5);
+            
+            let bytesSent = 0;
+            const events = new EventSource('/progress/' + progressId);
+            events.addEventListener('received', e => {
+                const ev = JSON.parse(e.data);
+                setStep(1, `Analisando planilha (${formatBytes(ev.bytes || 0)})...`);
+                setProgress(15);
+            });
+            events.addEventListener('extracted', e => {
+                const ev = JSON.parse(e.data);
+                setStep(2, `${ev.images_found} imagem(ns) encontrada(s) em ${ev.total_refs} REF(s)`);
+                setProgress(25);
+            });
+            function onTransfer(e) {
+                const ev = JSON.parse(e.data);
+                if (ev.type === 'uploaded') bytesSent += ev.bytes || 0;
+                const label = ev.type === 'uploaded' ? `✅ ${ev.ref}` : `❌ ${ev.ref}: ${ev.error}`;
+                setStep(3, `Upload FTP ${ev.done}/${ev.total} · ${formatBytes(bytesSent)} · ${ev.elapsed.toFixed(1)}s — ${label}`);
+                setProgress(25 + Math.round(70 * ev.done / ev.total));
+            }
+            events.addEventListener('uploaded', onTransfer);
+            events.addEventListener('failed', onTransfer);
+            events.addEventListener('done', () => {
+                setStep(4, 'Finalizando...');
+                events.close();
+            });
             
             // Upload com timeout aumentado
             const controller = new AbortController();
             const timeoutId = setTimeout(() => controller.abort(), 120000); // 2 minutos
             
-            fetch('/upload', {
+            fetch('/upload?progress=' + progressId, {
                 method: 'POST',
                 body: formData,
                 signal: controller.signal
@@ -646,12 +715,12 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
                 return response.json();
             })
             .then(data => {
-                clearInterval(progressInterval);
+                events.close();
                 clearInterval(timerInterval);
                 
                 // Marca todos os passos como completos
-                steps.forEach(step => {
-                    const stepElement = document.getElementById(step.stepId);
+                stepIds.forEach(stepId => {
+                    const stepElement = document.getElementById(stepId);
                     stepElement.classList.remove('active');
                     stepElement.classList.add('completed');
                 });
@@ -674,7 +743,7 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
                 }, 1500);
             })
             .catch(error => {
-                clearInterval(progressInterval);
+                events.close();
                 clearInterval(timerInterval);
                 clearTimeout(timeoutId);
                 
@@ -798,6 +867,9 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
     
     def handle_upload(self):
         """Processa uploads de arquivos Excel - versão otimizada para Render"""
+        # Canal de progresso opcional (o frontend já está ouvindo /progress/<id>)
+        progress_id = parse_qs(urlparse(self.path).query).get('progress', [None])[0]
+        progresso = registro_progresso.obter(progress_id) if progress_id and len(progress_id) <= 64 else None
         try:
             # Headers CORS
             self.send_response(200)
@@ -818,26 +890,13 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
                 self.wfile.write(json.dumps(error_response).encode())
                 return
             
-            # Lê o arquivo enviado
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
-            # Parse multipart form data
-            boundary = None
-            content_type = self.headers.get('Content-Type', '')
-            
-            if 'multipart/form-data' in content_type:
-                boundary = content_type.split('boundary=')[1]
-            else:
-                # Tenta extrair boundary dos dados
-                for line in post_data.split(b'\r\n'):
-                    if b'Content-Type: multipart/form-data' in line:
-                        boundary = line.split(b'boundary=')[1].decode()
-                        break
-            
-            if not boundary:
+            # Lê o multipart em blocos; o arquivo vai para um buffer spooled
+            try:
+                with TEMPO_MULTIPART.medir():
+                    recebido = ler_arquivo_multipart(self.rfile, self.headers)
+            except ErroMultipart as e:
                 error_response = {
-                    'error': 'Formato de dados inválido - boundary não encontrado',
+                    'error': str(e),
                     'total_refs': 0,
                     'images_found': 0,
                     'uploads_successful': 0,
@@ -847,50 +906,21 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
                 self.wfile.write(json.dumps(error_response).encode())
                 return
             
-            # Extrai arquivo
-            parts = post_data.split(f'--{boundary}'.encode())
-            file_data = None
-            filename = None
-            
-            for part in parts:
-                if b'Content-Disposition: form-data' in part and b'filename=' in part:
-                    try:
-                        # Extrai nome do arquivo
-                        filename_line = part.split(b'\r\n')[0].decode('utf-8', errors='ignore')
-                        if 'filename="' in filename_line:
-                            filename = filename_line.split('filename="')[1].split('"')[0]
-                        elif "filename='" in filename_line:
-                            filename = filename_line.split("filename='")[1].split("'")[0]
-                        
-                        # Extrai dados do arquivo
-                        file_start = part.find(b'\r\n\r\n') + 4
-                        file_data = part[file_start:-2]  # Remove \r\n no final
-                        
-                        if filename and file_data:
-                            break
-                    except Exception as e:
-                        print(f"Erro ao processar part: {e}")
-                        continue
+            filename = recebido.filename
             
-            if not file_data or not filename:
-                error_response = {
-                    'error': 'Arquivo não encontrado',
-                    'total_refs': 0,
-                    'images_found': 0,
-                    'uploads_successful': 0,
-                    'uploads_failed': 1
-                }
-                self.end_headers()
-                self.wfile.write(json.dumps(error_response).encode())
-                return
+            if progresso:
+                progresso.publicar('received', filename=filename, bytes=recebido.tamanho)
             
-            # Salva arquivo temporariamente
-            temp_path = os.path.join(tempfile.gettempdir(), filename)
-            with open(temp_path, 'wb') as f:
-                f.write(file_data)
+            # Processamento completo direto do buffer
+            with recebido, JOBS_EM_ANDAMENTO.em_andamento():
+                stats = self.process_excel_render(recebido.arquivo, progresso)
             
-            # Processamento completo
-            stats = self.process_excel_render(temp_path)
+            if progresso:
+                progresso.encerrar(success=stats.get('success', False),
+                                   images_found=stats['images_found'],
+                                   uploads_successful=stats['uploads_successful'],
+                                   uploads_failed=stats['uploads_failed'],
+                                   error=stats.get('error'))
             
             # Verifica se o arquivo tem imagens
             if stats['images_found'] == 0:
@@ -904,12 +934,8 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
                 }
                 self.end_headers()
                 self.wfile.write(json.dumps(error_response).encode())
-                os.remove(temp_path)
                 return
             
-            # Remove arquivo temporário
-            os.remove(temp_path)
-            
             # Envia resposta
             self.end_headers()
             self.wfile.write(json.dumps(stats).encode())
@@ -927,42 +953,68 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             self.wfile.write(json.dumps(error_response).encode())
+        finally:
+            # Saídas antecipadas e erros também encerram o stream SSE
+            if progresso and not progresso.encerrado:
+                progresso.encerrar(success=False)
     
-    def process_excel_render(self, file_path):
-        """Processamento completo do Excel para Render"""
+    def process_excel_render(self, file_path, progresso=None):
+        """Processamento completo do Excel para Render (caminho ou objeto file-like)"""
         try:
-            workbook = openpyxl.load_workbook(file_path)
-            worksheet = workbook.active
-            
-            # Processa REFs
-            refs = self.get_ref_column_data(worksheet, start_row=4)
-            
-            # Processa imagens
-            images = self.extract_images_from_worksheet(worksheet, start_row=4, photo_column='H')
-            
-            # Faz upload das imagens
-            uploads_successful = 0
-            uploads_failed = 0
-            errors = []
+            try:
+                # Lê só workbook, drawing, rels e a coluna REF direto do zip
+                refs, encontradas, _ = mapear_imagens_xlsx(file_path, coluna_foto='H', coluna_ref='A', linha_inicial=4)
+                images = [{'image': img['bytes'], 'ref': img['ref'], 'row': img['row'], 'col': 'H'} for img in encontradas]
+            except Exception as e:
+                print(f"⚠️ Leitura direta do xlsx falhou ({e}), usando openpyxl")
+                if hasattr(file_path, 'seek'):
+                    file_path.seek(0)
+                with TEMPO_WORKBOOK.medir(leitor='openpyxl'):
+                    workbook = openpyxl.load_workbook(file_path)
+                worksheet = workbook.active
+                
+                with TEMPO_ANCORAS.medir():
+                    # Processa REFs
+                    refs = self.get_ref_column_data(worksheet, start_row=4)
+                    
+                    # Processa imagens
+                    images = self.extract_images_from_worksheet(worksheet, start_row=4, photo_column='H')
             
-            for image_data in images:
-                try:
-                    if self.upload_image_to_ftp(image_data['image'], image_data['ref']):
-                        uploads_successful += 1
+            ao_concluir = None
+            if progresso:
+                progresso.publicar('extracted', total_refs=len(refs), images_found=len(images))
+                for image_data in images:
+                    progresso.publicar('found', ref=image_data['ref'], row=image_data['row'],
+                                       bytes=tamanho_imagem(image_data['image']))
+                
+                concluidos = [0]
+                def ao_concluir(image_data, ok, segundos, erro):
+                    concluidos[0] += 1
+                    if ok:
+                        progresso.publicar('uploaded', ref=image_data['ref'], bytes=tamanho_imagem(image_data['image']),
+                                           seconds=round(segundos, 3), done=concluidos[0], total=len(images))
                     else:
-                        uploads_failed += 1
-                        errors.append(f"Falha no upload da imagem para REF: {image_data['ref']}")
-                except Exception as e:
-                    uploads_failed += 1
-                    errors.append(f"Erro no upload da imagem para REF {image_data['ref']}: {str(e)}")
+                        progresso.publicar('failed', ref=image_data['ref'], error=erro,
+                                           seconds=round(segundos, 3), done=concluidos[0], total=len(images))
+            
+            # Faz upload das imagens em paralelo (FTP_MAX_CONEXOES sessões)
+            resultado = enviar_em_paralelo(
+                images,
+                lambda image_data: self.upload_image_to_ftp(image_data['image'], image_data['ref']),
+                max_conexoes=FTP_MAX_CONEXOES,
+                ao_concluir=ao_concluir
+            )
             
             return {
                 'success': True,
                 'total_refs': len(refs),
                 'images_found': len(images),
-                'uploads_successful': uploads_successful,
-                'uploads_failed': uploads_failed,
-                'errors': errors,
+                'uploads_successful': resultado['uploads_successful'],
+                'uploads_failed': resultado['uploads_failed'],
+                'errors': resultado['errors'],
+                'upload_timings': resultado['upload_timings'],
+                'upload_elapsed': resultado['upload_elapsed'],
+                'upload_connections': resultado['upload_connections'],
                 'message': 'Processamento Render concluído com detecção de imagens'
             }
             
@@ -1020,103 +1072,28 @@ class RenderUploadHandler(BaseHTTPRequestHandler):
         return images
     
     def upload_image_to_ftp(self, image, ref_value):
-        """Faz upload da imagem para FTP"""
+        """Faz upload da imagem para FTP direto da memória"""
+        inicio = None
         try:
-            # Salva imagem temporariamente
-            temp_image_path = self.save_image_to_temp(image, ref_value)
-            
-            # Conecta ao FTP
-            ftp = ftplib.FTP()
-            ftp.connect(FTP_HOST, 21, timeout=300)
-            ftp.login(FTP_USER, FTP_PASS)
+            # Bytes da imagem direto do xlsx, sem arquivo temporário
+            image_bytes = extrair_bytes_imagem(image)
             
-            # Cria diretórios se necessário
-            try:
-                ftp.cwd('public_html')
-            except:
-                ftp.mkd('public_html')
-                ftp.cwd('public_html')
-            
-            try:
-                ftp.cwd('images')
-            except:
-                ftp.mkd('images')
-                ftp.cwd('images')
-            
-            try:
-                ftp.cwd('products')
-            except:
-                ftp.mkd('products')
-                ftp.cwd('products')
+            # Upload usando sessão do pool (já autenticada e em FTP_DIR)
+            def enviar(ftp):
+                ftp.storbinary(f'STOR {ref_value}.jpg', buffer_imagem(image_bytes))
             
-            # Upload do arquivo
-            with open(temp_image_path, 'rb') as file:
-                ftp.storbinary(f'STOR {ref_value}.jpg', file)
-            
-            ftp.quit()
-            
-            # Remove arquivo temporário
-            os.remove(temp_image_path)
+            inicio = time.perf_counter()
+            pool = obter_pool(FTP_HOST, FTP_USER, FTP_PASS, FTP_DIR, port=FTP_PORT, max_conexoes=FTP_MAX_CONEXOES, timeout=300)
+            pool.executar(enviar)
+            registrar_transferencia('ftp', time.perf_counter() - inicio, len(image_bytes))
             
             return True
             
         except Exception as e:
             print(f"Erro no upload FTP: {e}")
+            if inicio is not None:
+                registrar_transferencia('ftp', time.perf_counter() - inicio, erro=e)
             return False
-    
-    def save_image_to_temp(self, image, ref_value):
-        """Salva imagem temporariamente"""
-        try:
-            # Sanitiza nome do arquivo
-            safe_ref = "".join(c for c in ref_value if c.isalnum() or c in ('-', '_')).rstrip()
-            if not safe_ref:
-                safe_ref = f"image_{int(time.time())}"
-            
-            temp_path = os.path.join(tempfile.gettempdir(), f"{safe_ref}.jpg")
-            
-            # Tenta diferentes métodos para extrair dados da imagem
-            image_data = None
-            
-            # Método 1: _data() (mais comum)
-            if hasattr(image, '_data') and callable(image._data):
-                try:
-                    image_data = image._data()
-                except:
-                    pass
-            
-            # Método 2: ref (BytesIO)
-            if not image_data and hasattr(image, 'ref'):
-                try:
-                    image_data = image.ref.read()
-                except:
-                    pass
-            
-            # Método 3: data
-            if not image_data and hasattr(image, 'data'):
-                try:
-                    image_data = image.data
-                except:
-                    pass
-            
-            # Método 4: image.save() como último recurso
-            if not image_data:
-                try:
-                    image.save(temp_path)
-                    return temp_path
-                except:
-                    pass
-            
-            # Salva dados extraídos
-            if image_data:
-                with open(temp_path, 'wb') as f:
-                    f.write(image_data)
-                return temp_path
-            
-            raise Exception("Não foi possível extrair dados da imagem")
-            
-        except Exception as e:
-            print(f"Erro ao salvar imagem: {e}")
-            raise
 
 def start_render_server():
     """Inicia o servidor Render otimizado"""
@@ -1136,7 +1113,8 @@ def start_render_server():
     print("=" * 50)
     
     try:
-        server = HTTPServer(('0.0.0.0', port), RenderUploadHandler)
+        # Pool de threads: /health e /progress/<id> são servidos durante o /upload
+        server = ServidorHTTPConcorrente(('0.0.0.0', port), RenderUploadHandler)
         print(f"✅ Servidor iniciado na porta {port}")
         print("🔄 Aguardando conexões...")
         server.serve_forever()
@@ -17,6 +17,9 @@ import socket
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+from imagem_memoria import extrair_bytes_imagem, buffer_imagem
+from resiliencia import com_retentativas, obter_disjuntor
+
 # Imports condicionais
 try:
     import openpyxl
@@ -487,51 +490,62 @@ def upload_image_to_sftp(image, ref_value, config, debug_info):
         logger.info(f"🚀 Upload SFTP: {ref_value}")
         debug_info.append(f"🚀 Upload SFTP: {ref_value}")
         
-        # Salva imagem temporariamente
-        temp_image_path = save_image_to_temp(image, ref_value, debug_info)
+        # Bytes da imagem em memória
+        image_bytes = extrair_imagem(image, ref_value, debug_info)
         
-        # Conecta ao SFTP
-        debug_info.append(f"🔌 Conectando ao SFTP: {config['host']}:{config['port']}")
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(
-            config['host'], 
-            config['port'], 
-            config['user'], 
-            config['pass'],
-            timeout=30
+        # Cada tentativa abre uma conexão nova; erros transitórios (EOF, reset,
+        # timeout) são repetidos com backoff e alimentam o circuito do backend
+        def enviar():
+            debug_info.append(f"🔌 Conectando ao SFTP: {config['host']}:{config['port']}")
+            ssh = paramiko.SSHClient()
+            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                ssh.connect(
+                    config['host'], 
+                    config['port'], 
+                    config['user'], 
+                    config['pass'],
+                    timeout=30
+                )
+                sftp = ssh.open_sftp()
+                debug_info.append("✅ Conectado ao SFTP")
+                
+                # Cria diretórios
+                try:
+                    sftp.mkdir('/public_html')
+                    debug_info.append("📁 Diretório /public_html criado")
+                except:
+                    debug_info.append("📁 Diretório /public_html já existe")
+                
+                try:
+                    sftp.mkdir('/public_html/images')
+                    debug_info.append("📁 Diretório /public_html/images criado")
+                except:
+                    debug_info.append("📁 Diretório /public_html/images já existe")
+                
+                try:
+                    sftp.mkdir('/public_html/images/products')
+                    debug_info.append("📁 Diretório /public_html/images/products criado")
+                except:
+                    debug_info.append("📁 Diretório /public_html/images/products já existe")
+                
+                # Upload
+                remote_path = f'/public_html/images/products/{ref_value}.jpg'
+                debug_info.append(f"⬆️ Fazendo upload: {remote_path}")
+                sftp.putfo(buffer_imagem(image_bytes), remote_path)
+                
+                sftp.close()
+            finally:
+                ssh.close()
+        
+        com_retentativas(
+            enviar,
+            disjuntor=obter_disjuntor('sftp'),
+            ao_falhar=lambda tentativa, erro: debug_info.append(
+                f"🔁 SFTP {ref_value}: {erro} - reconectando (tentativa {tentativa + 1})"
+            )
         )
-        sftp = ssh.open_sftp()
-        debug_info.append("✅ Conectado ao SFTP")
-        
-        # Cria diretórios
-        try:
-            sftp.mkdir('/public_html')
-            debug_info.append("📁 Diretório /public_html criado")
-        except:
-            debug_info.append("📁 Diretório /public_html já existe")
-        
-        try:
-            sftp.mkdir('/public_html/images')
-            debug_info.append("📁 Diretório /public_html/images criado")
-        except:
-            debug_info.append("📁 Diretório /public_html/images já existe")
-        
-        try:
-            sftp.mkdir('/public_html/images/products')
-            debug_info.append("📁 Diretório /public_html/images/products criado")
-        except:
-            debug_info.append("📁 Diretório /public_html/images/products já existe")
-        
-        # Upload
-        remote_path = f'/public_html/images/products/{ref_value}.jpg'
-        debug_info.append(f"⬆️ Fazendo upload: {remote_path}")
-        sftp.put(temp_image_path, remote_path)
-        
-        sftp.close()
-        ssh.close()
-        os.remove(temp_image_path)
-        debug_info.append("✅ Upload concluído e arquivo temporário removido")
+        debug_info.append("✅ Upload concluído")
         
         return True
         
@@ -540,63 +554,16 @@ def upload_image_to_sftp(image, ref_value, config, debug_info):
         debug_info.append(f"❌ Erro SFTP: {e}")
         return False
 
-def save_image_to_temp(image, ref_value, debug_info):
-    """Salva imagem temporariamente"""
+def extrair_imagem(image, ref_value, debug_info):
+    """Extrai os bytes da imagem em memória (sem arquivo temporário)"""
     try:
-        safe_ref = "".join(c for c in ref_value if c.isalnum() or c in ('-', '_')).rstrip()
-        if not safe_ref:
-            safe_ref = f"image_{int(time.time())}"
-        
-        temp_path = os.path.join('/tmp', f"{safe_ref}.jpg")
-        debug_info.append(f"💾 Salvando imagem em: {temp_path}")
-        
-        # Tenta extrair dados da imagem
-        image_data = None
-        
-        if hasattr(image, '_data') and callable(image._data):
-            try:
-                image_data = image._data()
-                debug_info.append("📊 Dados extraídos via _data()")
-            except Exception as e:
-                debug_info.append(f"❌ Erro _data(): {e}")
-                pass
-        
-        if not image_data and hasattr(image, 'ref'):
-            try:
-                image_data = image.ref.read()
-                debug_info.append("📊 Dados extraídos via ref.read()")
-            except Exception as e:
-                debug_info.append(f"❌ Erro ref.read(): {e}")
-                pass
-        
-        if not image_data and hasattr(image, 'data'):
-            try:
-                image_data = image.data
-                debug_info.append("📊 Dados extraídos via data")
-            except Exception as e:
-                debug_info.append(f"❌ Erro data: {e}")
-                pass
-        
-        if not image_data:
-            try:
-                image.save(temp_path)
-                debug_info.append("📊 Imagem salva via save()")
-                return temp_path
-            except Exception as e:
-                debug_info.append(f"❌ Erro save(): {e}")
-                pass
-        
-        if image_data:
-            with open(temp_path, 'wb') as f:
-                f.write(image_data)
-            debug_info.append("📊 Imagem salva via dados extraídos")
-            return temp_path
-        
-        raise Exception("Não foi possível extrair dados da imagem")
+        image_bytes = extrair_bytes_imagem(image)
+        debug_info.append(f"📊 Imagem {ref_value} em memória: {len(image_bytes)} bytes")
+        return image_bytes
         
     except Exception as e:
-        logger.error(f"❌ Erro ao salvar imagem: {e}")
-        debug_info.append(f"❌ Erro ao salvar imagem: {e}")
+        logger.error(f"❌ Erro ao extrair imagem: {e}")
+        debug_info.append(f"❌ Erro ao extrair imagem: {e}")
         raise
 
 # Para PythonAnywhere
@@ -5,15 +5,27 @@ Sistema de Upload de Imagens Excel - Versão Simplificada para Deploy
 Versão que funciona sem PIL para evitar problemas de compilação
 """
 
+import io
 import os
 import json
 import tempfile
 import webbrowser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import threading
 import time
 
+from indice_desenhos import IndiceDesenhos
+from leitor_xlsx_zip import mapear_imagens_xlsx
+from multipart_streaming import ler_arquivo_multipart, ErroMultipart, ArquivoMuitoGrande
+from manifesto_uploads import obter_manifesto, hash_conteudo, destino_ftp, metadados_remotos
+from listagem_remota import ListagemRemota
+from servidor_concorrente import ServidorHTTPConcorrente, admissao_upload
+from transcodificacao import obter_transcodificador
+from derivadas_imagem import derivadas_ativas, enviar_derivadas
+from metricas import (responder_metricas, registrar_transferencia, TEMPO_MULTIPART, TEMPO_WORKBOOK,
+                      TEMPO_ANCORAS, JOBS_EM_ANDAMENTO)
+
 # Importações básicas (sem PIL)
 try:
     import openpyxl
@@ -24,6 +36,7 @@ except ImportError as e:
 
 try:
     import ftplib
+    from pool_ftp import obter_pool
     FTP_AVAILABLE = True
 except ImportError as e:
     print(f"⚠️  ftplib não disponível: {e}")
@@ -75,8 +88,8 @@ class SistemaExcelProcessor:
             print(f"❌ Erro ao extrair imagens internas: {e}")
             return []
 
-    def find_image_by_cell(self, worksheet, cell_addr):
-        """Encontra imagem por célula usando anchor - método robusto"""
+    def find_image_by_cell(self, worksheet, cell_addr, indice=None):
+        """Encontra imagem por célula usando anchor - método robusto (O(1) com IndiceDesenhos)"""
         try:
             # Normaliza endereço da célula (ex: "H23")
             cell_addr = cell_addr.upper()
@@ -86,8 +99,14 @@ class SistemaExcelProcessor:
             # Converte coluna para índice 0-based
             target_col_idx = openpyxl.utils.column_index_from_string(target_col_letter) - 1
             
-            # Itera imagens da planilha e checa o anchor
-            for img in getattr(worksheet, "_images", []):
+            # Com índice, considera só as imagens ancoradas na célula
+            if indice is not None:
+                candidatas = indice.imagens_em(target_row, target_col_idx + 1)
+            else:
+                candidatas = getattr(worksheet, "_images", [])
+            
+            # Itera imagens candidatas e checa o anchor
+            for img in candidatas:
                 anchor = img.anchor
                 try:
                     # Quando é TwoCellAnchor
@@ -156,62 +175,75 @@ class SistemaExcelProcessor:
             ftp_host = os.getenv('FTP_HOST', "46.202.90.62")
             ftp_user = os.getenv('FTP_USER', "u715606397.ideolog.ia.br")
             ftp_pass = os.getenv('FTP_PASSWORD', "27y8rYoDq=Q&aHk:")
+            ftp_port = int(os.getenv('FTP_PORT', '21'))
             ftp_path = "/images/products/"
             
             print(f"🔗 Conectando FTP: {ftp_host}")
             
-            # Conecta FTP
-            ftp = ftplib.FTP()
-            ftp.connect(ftp_host, 21)
-            ftp.login(ftp_user, ftp_pass)
-            ftp.cwd(ftp_path)
+            # Sessões persistentes do pool, já posicionadas em ftp_path
+            pool = obter_pool(ftp_host, ftp_user, ftp_pass, ftp_path, port=ftp_port)
+            with pool.conexao() as ftp:
+                ftp.voidcmd('NOOP')
             
             print(f"✅ Conectado FTP - diretório: {ftp_path}")
             
-            # Upload de cada imagem
+            # Manifesto local: REFs com o mesmo conteúdo já enviado não são reenviadas
+            manifesto = obter_manifesto()
+            destino = destino_ftp(ftp_host, ftp_user, ftp_path, ftp_port)
+            
+            # Uma listagem do diretório por lote: o manifesto só vale se o arquivo
+            # continua no servidor com o tamanho registrado
+            listagem = ListagemRemota()
+            try:
+                with pool.conexao() as ftp:
+                    listagem.carregar(ftp)
+            except Exception as e:
+                print(f"⚠️ Listagem remota indisponível, manifesto sem conferência de tamanho: {e}")
+            
+            # REFs com conteúdo inalterado saem antes da transcodificação
+            pendentes = []
+            originais = []
             for image_data in images:
+                conteudo_hash = hash_conteudo(image_data['bytes'])
+                if manifesto.inalterada(destino, image_data['ref'], conteudo_hash, listagem):
+                    originais.append((image_data['ref'], image_data['bytes'], conteudo_hash))
+                    print(f"⏭️ Inalterada, upload ignorado: {image_data['ref']}.jpg")
+                    upload_successful += 1
+                    continue
+                pendentes.append((image_data, conteudo_hash))
+            
+            # JPEG vai intacto; PNG/GIF/BMP são convertidos no pool de processos
+            # enquanto as imagens anteriores sobem
+            transcodificadas = obter_transcodificador().em_ordem(d['bytes'] for d, _ in pendentes)
+            
+            # Upload de cada imagem
+            for (image_data, conteudo_hash), transcodificada in zip(pendentes, transcodificadas):
                 try:
-                    # Cria arquivo temporário
-                    temp_image_path = f"/tmp/{image_data['ref']}.jpg"
-                    
-                    # Tenta usar PIL se disponível
-                    try:
-                        from PIL import Image
-                        import io
-                        # Abre a imagem dos bytes
-                        image_stream = io.BytesIO(image_data['bytes'])
-                        img = Image.open(image_stream)
-                    except ImportError:
-                        # Se PIL não estiver disponível, salva bytes diretamente
-                        with open(temp_image_path, 'wb') as f:
-                            f.write(image_data['bytes'])
-                        print(f"📤 Upload {image_data['ref']}: {len(image_data['bytes'])} bytes (sem conversão PIL)")
-                        # Faz upload direto
-                        with open(temp_image_path, 'rb') as file:
-                            ftp.storbinary(f'STOR {image_data["ref"]}.jpg', file)
-                        print(f"✅ Upload concluído: {image_data['ref']}.jpg")
-                        os.unlink(temp_image_path)
-                        upload_successful += 1
-                        continue
-                    
-                    # Continua com PIL se disponível
-                    
-                    # Detecta formato original
-                    original_format = img.format
+                    jpeg_bytes = transcodificada.dados
                     source_info = image_data.get('source', 'unknown')
                     filename_info = f" ({image_data.get('filename', '')})" if 'filename' in image_data else ""
-                    print(f"📤 Upload {image_data['ref']}: {len(image_data['bytes'])} bytes ({original_format}) → JPEG [{source_info}]{filename_info}")
-                    
-                    # Converte para RGB se necessário
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        img = img.convert('RGB')
-                    
-                    # Salva como JPEG com configurações otimizadas para compatibilidade
-                    img.save(temp_image_path, 'JPEG', quality=100, optimize=False, progressive=False, subsampling=0)
+                    if transcodificada.convertida:
+                        print(f"📤 Upload {image_data['ref']}: {len(image_data['bytes'])} bytes ({transcodificada.formato}) → JPEG {len(jpeg_bytes)} bytes [{source_info}]{filename_info}")
+                    elif transcodificada.erro:
+                        print(f"⚠️ Conversão falhou ({transcodificada.erro}), enviando bytes originais: {image_data['ref']}")
+                    else:
+                        print(f"📤 Upload {image_data['ref']}: {len(jpeg_bytes)} bytes ({transcodificada.formato or 'desconhecido'}, sem conversão) [{source_info}]{filename_info}")
                     
                     # Upload FTP
-                    with open(temp_image_path, 'rb') as file:
-                        ftp.storbinary(f'STOR {image_data["ref"]}.jpg', file)
+                    def enviar(ftp):
+                        ftp.storbinary(f'STOR {image_data["ref"]}.jpg', io.BytesIO(jpeg_bytes))
+                        return metadados_remotos(ftp, f'{image_data["ref"]}.jpg')
+                    inicio = time.perf_counter()
+                    try:
+                        tamanho, mtime = pool.executar(enviar)
+                    except Exception as e:
+                        registrar_transferencia('ftp', time.perf_counter() - inicio, erro=e)
+                        raise
+                    registrar_transferencia('ftp', time.perf_counter() - inicio, len(jpeg_bytes))
+                    if tamanho in (None, len(jpeg_bytes)):
+                        manifesto.registrar(destino, image_data['ref'], conteudo_hash, tamanho, mtime)
+                    # Derivadas só das REFs cujo original está no servidor
+                    originais.append((image_data['ref'], image_data['bytes'], conteudo_hash))
                     
                     print(f"✅ Upload concluído: {image_data['ref']}.jpg")
                     
@@ -230,17 +262,20 @@ class SistemaExcelProcessor:
                     except Exception as e:
                         print(f"⚠️ Validação pós-upload falhou: {e}")
                     
-                    # Remove arquivo temporário
-                    os.unlink(temp_image_path)
                     upload_successful += 1
                     
                 except Exception as e:
                     print(f"❌ Erro upload {image_data['ref']}: {e}")
                     upload_failed += 1
             
-            # Fecha FTP
-            ftp.quit()
-            print(f"🔌 FTP desconectado")
+            # Miniaturas/WebP opcionais (DERIVADAS_TAMANHOS, DERIVADAS_WEBP), só das REFs
+            # cujo original mudou desde a última geração
+            if derivadas_ativas():
+                derivadas = enviar_derivadas(pool, manifesto, destino, originais)
+                print(f"🖼️ Derivadas: {derivadas['refs_geradas']} REF(s) geradas, "
+                      f"{derivadas['arquivos_enviados']} arquivo(s) enviados, {derivadas['falhas']} falha(s)")
+            
+            print(f"🔌 Sessões FTP devolvidas ao pool")
             
         except Exception as e:
             print(f"❌ Erro FTP: {e}")
@@ -251,26 +286,33 @@ class SistemaExcelProcessor:
     def process_excel_simple(self, file_path):
         """Processamento do Excel com configurações corretas para Render"""
         try:
-            # Configuração correta para carregar imagens
-            workbook = openpyxl.load_workbook(file_path, data_only=True, read_only=False, keep_links=False)
-            worksheet = workbook.active
-            
-            print(f"📊 Planilha carregada: {worksheet.title}")
-            print(f"📏 Dimensões: {worksheet.max_row} linhas x {worksheet.max_column} colunas")
-            
-            # Extrai REFs da coluna A (linhas 4+)
-            refs = []
-            ref_count = 0
-            
-            for row in range(4, worksheet.max_row + 1):
-                cell_value = worksheet[f'A{row}'].value
-                if cell_value and str(cell_value).strip() and str(cell_value).strip().upper() not in ['TOTAL', 'SUBTOTAL']:
-                    ref_count += 1
-                    refs.append(str(cell_value).strip())
+            workbook = None
+            embedded = None
+            try:
+                # Leitura direta do zip: só workbook, drawing, rels e coluna REF
+                refs, embedded, total_images = mapear_imagens_xlsx(file_path, coluna_foto='H', coluna_ref='A', linha_inicial=4)
+            except Exception as e:
+                print(f"⚠️ Leitura direta do xlsx falhou ({e}), usando openpyxl")
+                if hasattr(file_path, 'seek'):
+                    file_path.seek(0)
+                
+                # Configuração correta para carregar imagens
+                with TEMPO_WORKBOOK.medir(leitor='openpyxl'):
+                    workbook = openpyxl.load_workbook(file_path, data_only=True, read_only=False, keep_links=False)
+                worksheet = workbook.active
+                
+                print(f"📊 Planilha carregada: {worksheet.title}")
+                print(f"📏 Dimensões: {worksheet.max_row} linhas x {worksheet.max_column} colunas")
+                
+                # Índice de uma passada: REFs da coluna A (linhas 4+) e âncoras das imagens
+                with TEMPO_ANCORAS.medir():
+                    indice = IndiceDesenhos.de_worksheet(worksheet, coluna_ref='A', linha_inicial=4)
+                refs = [ref for _, ref in indice.refs]
+                total_images = len(worksheet._images)
+            ref_count = len(refs)
             
             # Processa imagens usando método robusto por anchor
             images = []
-            total_images = len(worksheet._images)
             
             print(f"📊 Imagens embebidas encontradas: {total_images}")
             
@@ -301,22 +343,23 @@ class SistemaExcelProcessor:
             else:
                 # Método original: busca imagens embebidas
                 print(f"🔍 Buscando imagens embebidas...")
-                for ref_value in refs:
-                    # Encontra a linha da REF
-                    ref_row = None
-                    for row in range(4, worksheet.max_row + 1):
-                        cell_value = worksheet[f'A{row}'].value
-                        if cell_value and str(cell_value).strip() == ref_value:
-                            ref_row = row
-                            break
-                    
-                    if ref_row:
-                        # Busca imagem na célula H{ref_row}
-                        image_bytes = self.find_image_by_cell(worksheet, f'H{ref_row}')
-                        if image_bytes:
-                            images.append({'ref': ref_value, 'bytes': image_bytes, 'row': ref_row, 'source': 'embedded'})
+                if embedded is not None:
+                    # Já casadas pela leitura direta do zip
+                    for img in embedded:
+                        images.append({'ref': img['ref'], 'bytes': img['bytes'], 'row': img['row'], 'source': 'embedded'})
+                else:
+                    for ref_value in refs:
+                        # Linha da REF direto do índice
+                        ref_row = indice.linha_por_ref.get(ref_value)
+                        
+                        if ref_row:
+                            # Busca imagem na célula H{ref_row}
+                            image_bytes = self.find_image_by_cell(worksheet, f'H{ref_row}', indice)
+                            if image_bytes:
+                                images.append({'ref': ref_value, 'bytes': image_bytes, 'row': ref_row, 'source': 'embedded'})
             
-            workbook.close()
+            if workbook is not None:
+                workbook.close()
             
             # Upload real via FTP
             upload_successful = 0
@@ -359,6 +402,8 @@ class SimpleUploadHandler(BaseHTTPRequestHandler):
             self.serve_config()
         elif self.path == '/health':
             self.serve_health()
+        elif self.path == '/metrics':
+            responder_metricas(self)
         elif self.path == '/favicon.ico':
             # Retorna 204 No Content para favicon (evita erro 404)
             self.send_response(204)
@@ -369,7 +414,9 @@ class SimpleUploadHandler(BaseHTTPRequestHandler):
     def do_POST(self):
         """Processa uploads"""
         if self.path == '/upload':
-            self.handle_upload()
+            with admissao_upload(self) as admitido:
+                if admitido:
+                    self.handle_upload()
         else:
             self.send_error(404)
     
@@ -1040,51 +1087,24 @@ class SimpleUploadHandler(BaseHTTPRequestHandler):
                 self.wfile.write(json.dumps(error_response).encode())
                 return
             
-            # Lê o arquivo enviado
-            content_length = int(self.headers['Content-Length'])
-            print(f"📏 Content-Length: {content_length}")
-            
-            post_data = self.rfile.read(content_length)
-            print(f"📦 Dados recebidos: {len(post_data)} bytes")
-            
-            # Parse do FormData
-            print(f"📋 Content-Type: {self.headers['Content-Type']}")
-            boundary = self.headers['Content-Type'].split('boundary=')[1]
-            print(f"🔗 Boundary: {boundary}")
-            
-            parts = post_data.split(f'--{boundary}'.encode())
-            print(f"📄 Partes encontradas: {len(parts)}")
-            
-            file_data = None
-            filename = None
-            
-            for part in parts:
-                if b'Content-Disposition: form-data' in part:
-                    if b'filename=' in part:
-                        # Extrai nome do arquivo
-                        filename_start = part.find(b'filename="') + 11
-                        filename_end = part.find(b'"', filename_start)
-                        filename = part[filename_start:filename_end].decode()
-                        
-                        # Extrai dados do arquivo
-                        file_start = part.find(b'\r\n\r\n') + 4
-                        file_data = part[file_start:-2]  # Remove \r\n no final
-                        break
-            
-            if not file_data or not filename:
-                self.send_error(400, 'Arquivo não encontrado')
+            # Lê o multipart em blocos; o arquivo vai para um buffer spooled
+            print(f"📏 Content-Length: {self.headers.get('Content-Length')}")
+            try:
+                with TEMPO_MULTIPART.medir():
+                    recebido = ler_arquivo_multipart(self.rfile, self.headers)
+            except ArquivoMuitoGrande as e:
+                self.send_error(413, str(e))
+                return
+            except ErroMultipart as e:
+                self.send_error(400, str(e))
                 return
             
-            # Salva arquivo temporariamente com suffix .xlsx
-            from tempfile import NamedTemporaryFile
-            temp_file = NamedTemporaryFile(delete=False, suffix=".xlsx")
-            temp_file.write(file_data)
-            temp_file.flush()
-            temp_file.close()
-            temp_path = temp_file.name
+            filename = recebido.filename
+            print(f"📦 Arquivo recebido: {filename} ({recebido.tamanho} bytes)")
             
-            # Processamento simplificado (sem PIL)
-            stats = self.process_excel_simple(temp_path)
+            # Processamento simplificado direto do buffer (sem PIL)
+            with recebido, JOBS_EM_ANDAMENTO.em_andamento():
+                stats = self.process_excel_simple(recebido.arquivo)
             
             # Verifica se o arquivo tem imagens
             if stats['images_found'] == 0:
@@ -1100,15 +1120,8 @@ class SimpleUploadHandler(BaseHTTPRequestHandler):
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
                 self.wfile.write(json.dumps(error_response).encode())
-                os.remove(temp_path)
                 return
             
-            # Remove arquivo temporário
-            try:
-                os.remove(temp_path)
-            except:
-                pass
-            
             # Envia resposta com timeout maior para muitos uploads
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
@@ -1139,22 +1152,30 @@ class SimpleUploadHandler(BaseHTTPRequestHandler):
     def process_excel_simple(self, file_path):
         """Processamento do Excel com configurações corretas para Render"""
         try:
-            # Configuração correta para carregar imagens
-            workbook = openpyxl.load_workbook(file_path, data_only=True, read_only=False, keep_links=False)
-            worksheet = workbook.active
-            
-            # Conta REFs válidas
-            ref_count = 0
-            refs = []
-            for row in range(4, worksheet.max_row + 1):
-                cell_value = worksheet[f'A{row}'].value
-                if cell_value and str(cell_value).strip() and str(cell_value).strip().upper() not in ['TOTAL', 'SUBTOTAL']:
-                    ref_count += 1
-                    refs.append(str(cell_value).strip())
+            workbook = None
+            embedded = None
+            try:
+                # Leitura direta do zip: só workbook, drawing, rels e coluna REF
+                refs, embedded, total_images = mapear_imagens_xlsx(file_path, coluna_foto='H', coluna_ref='A', linha_inicial=4)
+            except Exception as e:
+                print(f"⚠️ Leitura direta do xlsx falhou ({e}), usando openpyxl")
+                if hasattr(file_path, 'seek'):
+                    file_path.seek(0)
+                
+                # Configuração correta para carregar imagens
+                with TEMPO_WORKBOOK.medir(leitor='openpyxl'):
+                    workbook = openpyxl.load_workbook(file_path, data_only=True, read_only=False, keep_links=False)
+                worksheet = workbook.active
+                
+                # Índice de uma passada: REFs válidas da coluna A e âncoras das imagens
+                with TEMPO_ANCORAS.medir():
+                    indice = IndiceDesenhos.de_worksheet(worksheet, coluna_ref='A', linha_inicial=4)
+                refs = [ref for _, ref in indice.refs]
+                total_images = len(worksheet._images)
+            ref_count = len(refs)
             
             # Processa imagens usando método robusto por anchor
             images = []
-            total_images = len(worksheet._images)
             
             print(f"📊 Imagens embebidas encontradas: {total_images}")
             
@@ -1185,22 +1206,23 @@ class SimpleUploadHandler(BaseHTTPRequestHandler):
             else:
                 # Método original: busca imagens embebidas
                 print(f"🔍 Buscando imagens embebidas...")
-                for ref_value in refs:
-                    # Encontra a linha da REF
-                    ref_row = None
-                    for row in range(4, worksheet.max_row + 1):
-                        cell_value = worksheet[f'A{row}'].value
-                        if cell_value and str(cell_value).strip() == ref_value:
-                            ref_row = row
-                            break
-                    
-                    if ref_row:
-                        # Busca imagem na célula H{ref_row}
-                        image_bytes = self.find_image_by_cell(worksheet, f'H{ref_row}')
-                        if image_bytes:
-                            images.append({'ref': ref_value, 'bytes': image_bytes, 'row': ref_row, 'source': 'embedded'})
+                if embedded is not None:
+                    # Já casadas pela leitura direta do zip
+                    for img in embedded:
+                        images.append({'ref': img['ref'], 'bytes': img['bytes'], 'row': img['row'], 'source': 'embedded'})
+                else:
+                    for ref_value in refs:
+                        # Linha da REF direto do índice
+                        ref_row = indice.linha_por_ref.get(ref_value)
+                        
+                        if ref_row:
+                            # Busca imagem na célula H{ref_row}
+                            image_bytes = self.find_image_by_cell(worksheet, f'H{ref_row}', indice)
+                            if image_bytes:
+                                images.append({'ref': ref_value, 'bytes': image_bytes, 'row': ref_row, 'source': 'embedded'})
             
-            workbook.close()
+            if workbook is not None:
+                workbook.close()
             
             # Upload real via FTP
             upload_successful = 0
@@ -1277,8 +1299,8 @@ class SimpleUploadHandler(BaseHTTPRequestHandler):
             print(f"❌ Erro ao extrair imagens internas: {e}")
             return []
 
-    def find_image_by_cell(self, worksheet, cell_addr):
-        """Encontra imagem por célula usando anchor - método robusto"""
+    def find_image_by_cell(self, worksheet, cell_addr, indice=None):
+        """Encontra imagem por célula usando anchor - método robusto (O(1) com IndiceDesenhos)"""
         try:
             # Normaliza endereço da célula (ex: "H23")
             cell_addr = cell_addr.upper()
@@ -1288,8 +1310,14 @@ class SimpleUploadHandler(BaseHTTPRequestHandler):
             # Converte coluna para índice 0-based
             target_col_idx = openpyxl.utils.column_index_from_string(target_col_letter) - 1
             
-            # Itera imagens da planilha e checa o anchor
-            for img in getattr(worksheet, "_images", []):
+            # Com índice, considera só as imagens ancoradas na célula
+            if indice is not None:
+                candidatas = indice.imagens_em(target_row, target_col_idx + 1)
+            else:
+                candidatas = getattr(worksheet, "_images", [])
+            
+            # Itera imagens candidatas e checa o anchor
+            for img in candidatas:
                 anchor = img.anchor
                 try:
                     # Quando é TwoCellAnchor
@@ -1355,211 +1383,112 @@ class SimpleUploadHandler(BaseHTTPRequestHandler):
             ftp_host = os.getenv('FTP_HOST', "46.202.90.62")
             ftp_user = os.getenv('FTP_USER', "u715606397.ideolog.ia.br")
             ftp_pass = os.getenv('FTP_PASSWORD', "27y8rYoDq=Q&aHk:")
+            ftp_port = int(os.getenv('FTP_PORT', '21'))
             
             print(f"🔗 Conectando FTP: {ftp_host}")
             print(f"👤 Usuário: {ftp_user}")
             
-            # Conecta com timeout maior para muitos uploads
-            timeout = 300 if len(images) > 30 else 60  # Timeout maior para muitos uploads
-            with ftplib.FTP(timeout=timeout) as ftp:
-                ftp.connect(ftp_host, 21)
+            # Sessões persistentes do pool, já autenticadas e em public_html/images/products
+            pool = obter_pool(ftp_host, ftp_user, ftp_pass, '/public_html/images/products', port=ftp_port, timeout=300)
+            with pool.conexao() as ftp:
                 print(f"✅ Conexão estabelecida")
-                
-                try:
-                    ftp.login(ftp_user, ftp_pass)
-                    print(f"✅ Login bem-sucedido")
-                except ftplib.error_perm as e:
-                    print(f"❌ Erro de autenticação FTP: {e}")
-                    print(f"💡 Verifique se as credenciais estão corretas:")
-                    print(f"   Host: {ftp_host}")
-                    print(f"   User: {ftp_user}")
-                    print(f"   Password: {'*' * len(ftp_pass)}")
-                    return 0, len(images)
-                except Exception as e:
-                    print(f"❌ Erro ao fazer login FTP: {e}")
-                    return 0, len(images)
-                
-                # Navega para o diretório raiz primeiro
+                print(f"📁 Diretório atual antes dos uploads: {ftp.pwd()}")
+            
+            # Manifesto local: REFs com o mesmo conteúdo já enviado não são reenviadas
+            manifesto = obter_manifesto()
+            destino = destino_ftp(ftp_host, ftp_user, '/public_html/images/products', ftp_port)
+            
+            # Uma listagem do diretório por lote: o manifesto só vale se o arquivo
+            # continua no servidor com o tamanho registrado
+            listagem = ListagemRemota()
+            try:
+                with pool.conexao() as ftp:
+                    listagem.carregar(ftp)
+            except Exception as e:
+                print(f"⚠️ Listagem remota indisponível, manifesto sem conferência de tamanho: {e}")
+            
+            # REFs com conteúdo inalterado saem antes da transcodificação
+            total_images = len(images)
+            pendentes = []
+            originais = []
+            for image_data in images:
+                conteudo_hash = hash_conteudo(image_data['bytes'])
+                if manifesto.inalterada(destino, image_data['ref'], conteudo_hash, listagem):
+                    originais.append((image_data['ref'], image_data['bytes'], conteudo_hash))
+                    print(f"⏭️ Inalterada, upload ignorado: {image_data['ref']}.jpg")
+                    upload_successful += 1
+                    continue
+                pendentes.append((image_data, conteudo_hash))
+            
+            # JPEG vai intacto; PNG/GIF/BMP são convertidos no pool de processos
+            # enquanto as imagens anteriores sobem
+            transcodificadas = obter_transcodificador().em_ordem(d['bytes'] for d, _ in pendentes)
+            
+            # Upload das imagens com progresso
+            for i, ((image_data, conteudo_hash), transcodificada) in enumerate(zip(pendentes, transcodificadas)):
                 try:
-                    ftp.cwd('/')
-                    print(f"📁 Diretório raiz: {ftp.pwd()}")
-                except Exception as e:
-                    print(f"⚠️ Aviso ao navegar para raiz: {e}")
-                
-                # Cria estrutura: public_html/images/products
-                directories = ['public_html', 'images', 'products']
-                current_path = []
-                
-                for dir_name in directories:
-                    try:
-                        # Tenta criar o diretório
-                        try:
-                            ftp.mkd(dir_name)
-                            print(f"📁 Diretório '{dir_name}' criado")
-                        except ftplib.error_perm as e:
-                            if '550' in str(e) or 'already exists' in str(e).lower():
-                                print(f"📁 Diretório '{dir_name}' já existe")
-                            else:
-                                raise
-                        
-                        # Navega para o diretório
-                        ftp.cwd(dir_name)
-                        current_path.append(dir_name)
-                        print(f"📁 Navegou para: {'/'.join(current_path)}")
-                        
-                    except Exception as e:
-                        print(f"❌ Erro ao criar/navegar para '{dir_name}': {e}")
-                        # Tenta navegar mesmo assim (pode já existir)
-                        try:
-                            ftp.cwd(dir_name)
-                            current_path.append(dir_name)
-                            print(f"📁 Navegou para: {'/'.join(current_path)}")
-                        except Exception as e2:
-                            print(f"❌ Erro ao navegar para '{dir_name}': {e2}")
-                            return 0, len(images)
-                
-                # Verifica se chegou no diretório correto
-                final_path = ftp.pwd()
-                print(f"📁 Diretório final FTP: {final_path}")
-                
-                # Garante que está no caminho correto
-                if 'products' not in final_path:
-                    print(f"⚠️ Aviso: Diretório atual não contém 'products'")
-                    print(f"   Tentando navegar diretamente...")
+                    file_bytes = transcodificada.dados
+                    source_info = image_data.get('source', 'unknown')
+                    filename_info = f" ({image_data.get('filename', '')})" if 'filename' in image_data else ""
+                    if transcodificada.convertida:
+                        print(f"📤 Upload {image_data['ref']}: {len(image_data['bytes'])} bytes ({transcodificada.formato}) → JPEG [{source_info}]{filename_info}")
+                    elif transcodificada.erro:
+                        print(f"❌ Erro na conversão PIL: {transcodificada.erro}")
+                        print(f"📤 Upload {image_data['ref']}: {len(image_data['bytes'])} bytes (fallback)")
+                    else:
+                        print(f"📤 Upload {image_data['ref']}: {len(image_data['bytes'])} bytes ({transcodificada.formato or 'desconhecido'}, sem conversão) [{source_info}]{filename_info}")
+                    print(f"🌐 URL: https://ideolog.ia.br/images/products/{image_data['ref']}.jpg")
+                    
+                    file_size = len(file_bytes)
+                    if file_size == 0:
+                        print(f"❌ Imagem vazia: {image_data['ref']}")
+                        upload_failed += 1
+                        continue
+                    
+                    # Upload via FTP direto da memória
+                    remote_filename = f"{image_data['ref']}.jpg"
+                    print(f"📤 Fazendo upload FTP:")
+                    print(f"   Arquivo: {remote_filename}")
+                    print(f"   Tamanho: {file_size} bytes")
+                    
+                    def enviar(ftp):
+                        ftp.storbinary(f'STOR {remote_filename}', io.BytesIO(file_bytes))
+                        return metadados_remotos(ftp, remote_filename)
+                    inicio = time.perf_counter()
                     try:
-                        ftp.cwd('/public_html/images/products')
-                        print(f"✅ Navegou diretamente para: {ftp.pwd()}")
+                        tamanho, mtime = pool.executar(enviar)
                     except Exception as e:
-                        print(f"❌ Erro ao navegar diretamente: {e}")
-                        return 0, len(images)
+                        registrar_transferencia('ftp', time.perf_counter() - inicio, erro=e)
+                        raise
+                    registrar_transferencia('ftp', time.perf_counter() - inicio, file_size)
+                    if tamanho in (None, file_size):
+                        manifesto.registrar(destino, image_data['ref'], conteudo_hash, tamanho, mtime)
+                    # Derivadas só das REFs cujo original está no servidor
+                    originais.append((image_data['ref'], image_data['bytes'], conteudo_hash))
+                    
+                    print(f"✅ Upload concluído: {remote_filename}")
+                    print(f"   URL: https://ideolog.ia.br/images/products/{remote_filename}")
+                    
+                    upload_successful += 1
+                    
+                    # Log de progresso para muitos uploads
+                    if total_images > 30 and (i + 1) % 10 == 0:
+                        print(f"📤 Upload progress: {i + 1}/{total_images} ({((i + 1) / total_images) * 100:.1f}%)")
+                    
+                except Exception as e:
+                    upload_failed += 1
+                    print(f"❌ Erro no upload {image_data.get('ref', 'unknown')}: {e}")
+                    import traceback
+                    traceback.print_exc()
             
-                # Verifica novamente o diretório antes de fazer uploads
-                current_dir = ftp.pwd()
-                print(f"📁 Diretório atual antes dos uploads: {current_dir}")
-                
-                # Garante que está em public_html/images/products
-                if not current_dir.endswith('products') and 'products' not in current_dir:
-                    print(f"⚠️ Diretório não está em products, tentando navegar...")
-                    try:
-                        # Tenta diferentes caminhos
-                        paths_to_try = [
-                            '/public_html/images/products',
-                            'public_html/images/products',
-                            './public_html/images/products'
-                        ]
-                        for path in paths_to_try:
-                            try:
-                                ftp.cwd(path)
-                                print(f"✅ Navegou para: {ftp.pwd()}")
-                                break
-                            except:
-                                continue
-                        else:
-                            print(f"❌ Não foi possível navegar para products")
-                            return 0, len(images)
-                    except Exception as e:
-                        print(f"❌ Erro ao navegar: {e}")
-                        return 0, len(images)
-                
-                # Upload das imagens com progresso
-                total_images = len(images)
-                for i, image_data in enumerate(images):
-                    try:
-                        # Converte e salva imagem como JPEG válido
-                        safe_ref = "".join(c for c in image_data['ref'] if c.isalnum() or c in ('-', '_')).rstrip()
-                        if not safe_ref:
-                            safe_ref = f"image_{int(time.time())}"
-                        
-                        temp_image_path = os.path.join(tempfile.gettempdir(), f"{safe_ref}.jpg")
-                        
-                        # Converte bytes para imagem válida usando PIL
-                        try:
-                            from PIL import Image
-                            import io
-                            
-                            # Abre a imagem dos bytes
-                            image_stream = io.BytesIO(image_data['bytes'])
-                            img = Image.open(image_stream)
-                            
-                            # Detecta formato original
-                            original_format = img.format
-                            source_info = image_data.get('source', 'unknown')
-                            filename_info = f" ({image_data.get('filename', '')})" if 'filename' in image_data else ""
-                            print(f"📤 Upload {image_data['ref']}: {len(image_data['bytes'])} bytes ({original_format}) → JPEG [{source_info}]{filename_info}")
-                            
-                            # Converte para RGB se necessário
-                            if img.mode in ('RGBA', 'LA', 'P'):
-                                img = img.convert('RGB')
-                            
-                            # Salva como JPEG com configurações máximas para contornar processamento do servidor
-                            img.save(temp_image_path, 'JPEG', quality=100, optimize=False, progressive=False, subsampling=0)
-                            
-                            print(f"🌐 URL: https://ideolog.ia.br/images/products/{image_data['ref']}.jpg")
-                            
-                        except ImportError:
-                            print(f"⚠️ PIL não disponível, usando bytes originais")
-                            # Fallback: salva bytes originais
-                            with open(temp_image_path, 'wb') as f:
-                                f.write(image_data['bytes'])
-                            print(f"📤 Upload {image_data['ref']}: {len(image_data['bytes'])} bytes (sem conversão)")
-                            print(f"🌐 URL: https://ideolog.ia.br/images/products/{image_data['ref']}.jpg")
-                        except Exception as e:
-                            print(f"❌ Erro na conversão PIL: {e}")
-                            # Fallback: salva bytes originais
-                            with open(temp_image_path, 'wb') as f:
-                                f.write(image_data['bytes'])
-                            print(f"📤 Upload {image_data['ref']}: {len(image_data['bytes'])} bytes (fallback)")
-                            print(f"🌐 URL: https://ideolog.ia.br/images/products/{image_data['ref']}.jpg")
-                        
-                        # Verifica se arquivo foi criado
-                        if not os.path.exists(temp_image_path):
-                            print(f"❌ Arquivo temporário não foi criado: {temp_image_path}")
-                            upload_failed += 1
-                            continue
-                        
-                        file_size = os.path.getsize(temp_image_path)
-                        if file_size == 0:
-                            print(f"❌ Arquivo temporário está vazio: {temp_image_path}")
-                            upload_failed += 1
-                            continue
-                        
-                        # Upload via FTP
-                        remote_filename = f"{image_data['ref']}.jpg"
-                        current_ftp_dir = ftp.pwd()
-                        full_path = f"{current_ftp_dir}/{remote_filename}"
-                        print(f"📤 Fazendo upload FTP:")
-                        print(f"   Arquivo: {remote_filename}")
-                        print(f"   Tamanho: {file_size} bytes")
-                        print(f"   Caminho completo: {full_path}")
-                        
-                        with open(temp_image_path, 'rb') as file:
-                            ftp.storbinary(f'STOR {remote_filename}', file)
-                        
-                        # Verifica se arquivo foi salvo
-                        final_dir = ftp.pwd()
-                        print(f"✅ Upload concluído: {remote_filename}")
-                        print(f"   Salvo em: {final_dir}/{remote_filename}")
-                        print(f"   URL: https://ideolog.ia.br/images/products/{remote_filename}")
-                        
-                        # Remove arquivo temporário
-                        try:
-                            os.remove(temp_image_path)
-                        except:
-                            pass
-                        
-                        upload_successful += 1
-                        
-                        # Log de progresso para muitos uploads
-                        if total_images > 30 and (i + 1) % 10 == 0:
-                            print(f"📤 Upload progress: {i + 1}/{total_images} ({((i + 1) / total_images) * 100:.1f}%)")
-                        
-                    except Exception as e:
-                        upload_failed += 1
-                        print(f"❌ Erro no upload {image_data.get('ref', 'unknown')}: {e}")
-                        import traceback
-                        traceback.print_exc()
-                
-                print(f"🔌 FTP desconectado")
+            # Miniaturas/WebP opcionais (DERIVADAS_TAMANHOS, DERIVADAS_WEBP), só das REFs
+            # cujo original mudou desde a última geração
+            if derivadas_ativas():
+                derivadas = enviar_derivadas(pool, manifesto, destino, originais)
+                print(f"🖼️ Derivadas: {derivadas['refs_geradas']} REF(s) geradas, "
+                      f"{derivadas['arquivos_enviados']} arquivo(s) enviados, {derivadas['falhas']} falha(s)")
+            
+            print(f"🔌 Sessões FTP devolvidas ao pool")
             
         except ftplib.error_perm as e:
             upload_failed = len(images)
@@ -1600,7 +1529,7 @@ def start_simple_server():
     print(f"   • PIL: ❌ (não usado nesta versão)")
     print("=" * 50)
     
-    server = HTTPServer(('0.0.0.0', port), SimpleUploadHandler)
+    server = ServidorHTTPConcorrente(('0.0.0.0', port), SimpleUploadHandler)
     
     try:
         server.serve_forever()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Etapa de transcodificação das imagens antes do upload
+O formato de origem é detectado pelos magic bytes: JPEG segue intacto, sem
+decodificar; PNG/GIF/BMP (e WEBP/TIFF) são convertidos para JPEG em um pool
+de processos, algumas imagens à frente do upload em andamento
+"""
+
+import io
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import threading
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Processos de conversão (TRANSCODE_PROCESSOS, padrão até 4)
+PROCESSOS_PADRAO = int(os.getenv('TRANSCODE_PROCESSOS', str(min(4, os.cpu_count() or 1))))
+# Qualidade do JPEG gerado a partir de PNG/GIF/BMP (mesmos parâmetros de antes)
+QUALIDADE_JPEG = int(os.getenv('JPEG_QUALIDADE', '100'))
+
+# Formatos convertidos para JPEG; o resto (JPEG ou desconhecido) vai como veio
+FORMATOS_CONVERTIDOS = {'PNG', 'GIF', 'BMP', 'WEBP', 'TIFF'}
+
+# O pool nasce dentro de uma thread de requisição: com fork os filhos herdariam
+# locks presos por outras threads, então os processos vêm de forkserver (ou spawn)
+CONTEXTO_PROCESSOS = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+ImagemTranscodificada = namedtuple('ImagemTranscodificada', 'dados formato convertida erro')
+
+
+def detectar_formato(dados):
+    """Formato da imagem pelos primeiros bytes ('JPEG', 'PNG', ...) ou None"""
+    cabecalho = bytes(dados[:12])
+    if cabecalho.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if cabecalho.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if cabecalho[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if cabecalho.startswith(b'BM'):
+        return 'BMP'
+    if cabecalho[:4] == b'RIFF' and cabecalho[8:12] == b'WEBP':
+        return 'WEBP'
+    if cabecalho[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'TIFF'
+    return None
+
+
+def converter_para_jpeg(dados, qualidade=QUALIDADE_JPEG):
+    """Decodifica e regrava como JPEG (roda nos processos do pool)"""
+    img = Image.open(io.BytesIO(dados))
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    jpeg_buffer = io.BytesIO()
+    img.save(jpeg_buffer, 'JPEG', quality=qualidade, optimize=False, progressive=False, subsampling=0)
+    return jpeg_buffer.getvalue()
+
+
+class Transcodificador:
+    """Pool de processos compartilhado para converter imagens não-JPEG"""
+
+    def __init__(self, processos=None):
+        self.processos = max(1, processos or PROCESSOS_PADRAO)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        """Cria o pool na primeira conversão (depois do fork do gunicorn)"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.processos, mp_context=CONTEXTO_PROCESSOS)
+            return self._executor
+
+    def _descartar_pool(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def em_ordem(self, lista_bytes, adiante=None):
+        """
+        Gera ImagemTranscodificada para cada item, na mesma ordem
+
+        Mantém até `adiante` conversões enviadas ao pool antes da imagem
+        consumida agora, para que a conversão das próximas ocorra enquanto
+        o chamador faz o upload da atual. JPEGs não passam pelo pool.
+        """
+        adiante = adiante or self.processos * 2
+        itens = list(lista_bytes)
+        pendentes = {}
+        proximo = 0
+
+        def agendar(ate):
+            nonlocal proximo
+            while proximo < min(ate, len(itens)):
+                dados = itens[proximo]
+                if PIL_AVAILABLE and detectar_formato(dados) in FORMATOS_CONVERTIDOS:
+                    try:
+                        pendentes[proximo] = self._pool().submit(converter_para_jpeg, dados)
+                    except (BrokenProcessPool, OSError, RuntimeError):
+                        # Sem pool utilizável: a conversão acontece na thread atual
+                        self._descartar_pool()
+                proximo += 1
+
+        for i, dados in enumerate(itens):
+            agendar(i + 1 + adiante)
+            formato = detectar_formato(dados)
+            futuro = pendentes.pop(i, None)
+            if not PIL_AVAILABLE or formato not in FORMATOS_CONVERTIDOS:
+                yield ImagemTranscodificada(dados, formato, False, None)
+                continue
+            try:
+                if futuro is not None:
+                    try:
+                        jpeg = futuro.result()
+                    except BrokenProcessPool:
+                        self._descartar_pool()
+                        jpeg = converter_para_jpeg(dados)
+                else:
+                    jpeg = converter_para_jpeg(dados)
+                yield ImagemTranscodificada(jpeg, formato, True, None)
+            except Exception as e:
+                # Falha na conversão: envia os bytes originais, como antes
+                yield ImagemTranscodificada(dados, formato, False, str(e))
+
+    def mapear(self, funcao, itens, adiante=None):
+        """
+        Gera (item, resultado, erro) para funcao(*item) de cada item, na ordem
+
+        Todos os itens passam pelo pool com a mesma janela `adiante` de
+        em_ordem; funcao precisa ser de nível de módulo (vai por pickle).
+        """
+        adiante = adiante or self.processos * 2
+        itens = list(itens)
+        pendentes = {}
+        proximo = 0
+        for i, item in enumerate(itens):
+            while proximo < min(i + 1 + adiante, len(itens)):
+                try:
+                    pendentes[proximo] = self._pool().submit(funcao, *itens[proximo])
+                except (BrokenProcessPool, OSError, RuntimeError):
+                    self._descartar_pool()
+                proximo += 1
+            futuro = pendentes.pop(i, None)
+            try:
+                if futuro is not None:
+                    try:
+                        resultado = futuro.result()
+                    except BrokenProcessPool:
+                        self._descartar_pool()
+                        resultado = funcao(*item)
+                else:
+                    resultado = funcao(*item)
+                yield item, resultado, None
+            except Exception as e:
+                yield item, None, str(e)
+
+
+_transcodificador = None
+_transcodificador_lock = threading.Lock()
+
+
+def obter_transcodificador():
+    """Transcodificador compartilhado do processo"""
+    global _transcodificador
+    with _transcodificador_lock:
+        if _transcodificador is None:
+            _transcodificador = Transcodificador()
+        return _transcodificador
@@ -4,9 +4,12 @@
 Sistema de upload via FTP para extração de imagens Excel - VERSÃO CORRIGIDA
 """
 
-import ftplib
 import os
+import time
 from excel_image_extractor import ExcelImageExtractor
+from imagem_memoria import buffer_imagem
+from pool_ftp import obter_pool
+from metricas import registrar_transferencia
 import logging
 
 # Configuração de logging
@@ -98,42 +101,24 @@ class FTPImageExtractorCorrigido(ExcelImageExtractor):
             
             logger.debug(f"Fazendo upload FTP de {local_file_path} ({file_size} bytes) como {remote_filename}")
             
-            # Conecta via FTP
-            with ftplib.FTP(timeout=300) as ftp:  # Timeout de 5 minutos
-                ftp.connect(self.ftp_host, 21)  # Conecta explicitamente na porta 21
-                ftp.login(self.ftp_user, self.ftp_password)
-                
-                # Cria diretórios se não existirem
-                try:
-                    ftp.mkd('public_html')
-                    logger.debug("Diretório 'public_html' criado")
-                except:
-                    logger.debug("Diretório 'public_html' já existe")
-                
-                try:
-                    ftp.cwd('public_html')
-                    ftp.mkd('images')
-                    logger.debug("Diretório 'images' criado")
-                except:
-                    logger.debug("Diretório 'images' já existe")
-                
-                try:
-                    ftp.cwd('images')
-                    ftp.mkd('products')
-                    logger.debug("Diretório 'products' criado")
-                except:
-                    logger.debug("Diretório 'products' já existe")
-                
-                # Volta para o diretório raiz
-                ftp.cwd('/')
-                
-                # Caminho completo para upload
-                remote_path = f"public_html/images/products/{remote_filename}"
-                
-                # Abre arquivo local e faz upload
-                with open(local_file_path, 'rb') as file:
-                    ftp.storbinary(f'STOR {remote_path}', file)
-                    
+            with open(local_file_path, 'rb') as file:
+                image_bytes = file.read()
+            
+            # Sessão do pool compartilhado, já autenticada e em public_html/images/products
+            # (diretórios criados uma vez, na abertura da sessão)
+            pool = obter_pool(self.ftp_host, self.ftp_user, self.ftp_password, 'public_html/images/products', timeout=300)
+            remote_path = f"public_html/images/products/{remote_filename}"
+            
+            def enviar(ftp):
+                ftp.storbinary(f'STOR {remote_filename}', buffer_imagem(image_bytes))
+            inicio = time.perf_counter()
+            try:
+                pool.executar(enviar)
+            except Exception as e:
+                registrar_transferencia('ftp', time.perf_counter() - inicio, erro=e)
+                raise
+            registrar_transferencia('ftp', time.perf_counter() - inicio, file_size)
+            
             logger.info(f"Upload FTP concluído: {remote_path}")
             logger.info(f"Imagem disponível em: https://ideolog.ia.br/images/products/{remote_filename}")
             return True
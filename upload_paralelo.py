@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Estágio de upload concorrente
+Distribui a lista de imagens entre N sessões FTP simultâneas e mantém a mesma
+contabilidade de uploads_successful / uploads_failed / errors
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Número padrão de sessões simultâneas (ajustar ao limite do provedor)
+MAX_CONEXOES_PADRAO = int(os.getenv('FTP_MAX_CONEXOES', '4'))
+
+
+def enviar_em_paralelo(imagens, enviar, max_conexoes=None, ao_concluir=None):
+    """
+    Envia as imagens usando até max_conexoes uploads simultâneos
+
+    Args:
+        imagens: lista de dicts com pelo menos a chave 'ref'
+        enviar: função enviar(image_data) -> bool (False ou exceção indicam falha)
+        max_conexoes: número de uploads simultâneos (padrão FTP_MAX_CONEXOES)
+        ao_concluir: callback opcional ao_concluir(image_data, ok, segundos, erro),
+            chamado na thread que coleta os resultados assim que cada upload termina
+
+    Returns:
+        dict com uploads_successful, uploads_failed, errors, upload_timings,
+        upload_elapsed e upload_connections
+    """
+    max_conexoes = max(1, max_conexoes or MAX_CONEXOES_PADRAO)
+    uploads_successful = 0
+    uploads_failed = 0
+    errors = []
+    timings = [None] * len(imagens)
+
+    def tarefa(image_data):
+        inicio = time.perf_counter()
+        try:
+            ok = bool(enviar(image_data))
+            erro = None if ok else f"Falha no upload da imagem para REF: {image_data['ref']}"
+        except Exception as e:
+            ok = False
+            erro = f"Erro no upload da imagem para REF {image_data['ref']}: {str(e)}"
+        return ok, erro, time.perf_counter() - inicio
+
+    inicio_total = time.perf_counter()
+    if imagens:
+        with ThreadPoolExecutor(max_workers=min(max_conexoes, len(imagens))) as executor:
+            futuros = {executor.submit(tarefa, image_data): i for i, image_data in enumerate(imagens)}
+            for futuro in as_completed(futuros):
+                i = futuros[futuro]
+                ok, erro, segundos = futuro.result()
+                if ok:
+                    uploads_successful += 1
+                else:
+                    uploads_failed += 1
+                    errors.append(erro)
+                timings[i] = {
+                    'ref': imagens[i]['ref'],
+                    'seconds': round(segundos, 4),
+                    'success': ok
+                }
+                if ao_concluir is not None:
+                    ao_concluir(imagens[i], ok, segundos, erro)
+
+    return {
+        'uploads_successful': uploads_successful,
+        'uploads_failed': uploads_failed,
+        'errors': errors,
+        'upload_timings': timings,
+        'upload_elapsed': round(time.perf_counter() - inicio_total, 4),
+        'upload_connections': max_conexoes
+    }
@@ -4,16 +4,18 @@
 Sistema de upload via SSH/SFTP para extração de imagens Excel
 """
 
-import paramiko
 import os
-import io
 from excel_image_extractor import ExcelImageExtractor
+from sftp_lote import SessaoSFTP
 import logging
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Diretório remoto das imagens (relativo ao home do usuário SSH)
+DIRETORIO_REMOTO = 'public_html/wp-content/themes/products'
+
 class SSHImageExtractor(ExcelImageExtractor):
     """Classe para extrair imagens de planilhas Excel e fazer upload via SSH/SFTP"""
     
@@ -32,82 +34,34 @@ class SSHImageExtractor(ExcelImageExtractor):
         self.ssh_user = ssh_user
         self.ssh_password = ssh_password
         
+        # Uma sessão SSH reaproveitada por todos os uploads (aberta no primeiro)
+        self.sessao = SessaoSFTP(ssh_host, ssh_port, ssh_user, ssh_password, timeout=60, log=logger.debug)
+        
         # Chama construtor pai (sem FTP)
         super().__init__("", "", "")
     
-    def upload_to_ssh(self, local_file_path: str, remote_filename: str) -> bool:
+    def upload_to_ssh(self, image_bytes: bytes, remote_filename: str) -> bool:
         """
-        Faz upload do arquivo para o servidor via SSH/SFTP
+        Faz upload dos bytes da imagem para o servidor via SSH/SFTP
         
         Args:
-            local_file_path: Caminho do arquivo local
+            image_bytes: Conteúdo da imagem em memória
             remote_filename: Nome do arquivo no servidor
             
         Returns:
             True se upload foi bem-sucedido
         """
         try:
-            # Verifica se arquivo existe e tem conteúdo
-            if not os.path.exists(local_file_path):
-                logger.error(f"Arquivo local não encontrado: {local_file_path}")
+            if not image_bytes:
+                logger.error(f"Imagem vazia: {remote_filename}")
                 return False
             
-            file_size = os.path.getsize(local_file_path)
-            if file_size == 0:
-                logger.error(f"Arquivo local está vazio: {local_file_path}")
-                return False
-            
-            logger.debug(f"Fazendo upload SSH de {local_file_path} ({file_size} bytes) como {remote_filename}")
-            
-            # Conecta via SSH
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            ssh.connect(
-                hostname=self.ssh_host,
-                port=self.ssh_port,
-                username=self.ssh_user,
-                password=self.ssh_password,
-                timeout=60
-            )
-            
-            # Usa SFTP para upload
-            sftp = ssh.open_sftp()
-            
-            # Cria diretórios se não existirem
-            try:
-                sftp.mkdir('public_html')
-                logger.debug("Diretório 'public_html' criado")
-            except:
-                logger.debug("Diretório 'public_html' já existe")
-            
-            try:
-                sftp.mkdir('public_html/wp-content')
-                logger.debug("Diretório 'wp-content' criado")
-            except:
-                logger.debug("Diretório 'wp-content' já existe")
+            logger.debug(f"Fazendo upload SSH de {len(image_bytes)} bytes como {remote_filename}")
             
-            try:
-                sftp.mkdir('public_html/wp-content/themes')
-                logger.debug("Diretório 'themes' criado")
-            except:
-                logger.debug("Diretório 'themes' já existe")
-            
-            try:
-                sftp.mkdir('public_html/wp-content/themes/products')
-                logger.debug("Diretório 'products' criado")
-            except:
-                logger.debug("Diretório 'products' já existe")
-            
-            # Caminho completo para upload
-            remote_path = f"public_html/wp-content/themes/products/{remote_filename}"
-            
-            # Faz upload do arquivo
-            sftp.put(local_file_path, remote_path)
-            
-            # Fecha conexões
-            sftp.close()
-            ssh.close()
+            # Sessão já autenticada; diretórios criados só no primeiro upload
+            remote_path = f"{DIRETORIO_REMOTO}/{remote_filename}"
+            self.sessao.conectar()
+            self.sessao.enviar(image_bytes, remote_path)
             
             logger.info(f"Upload SSH concluído: {remote_path}")
             logger.info(f"Imagem disponível em: https://gpreto.space/wp-content/themes/products/{remote_filename}")
@@ -152,34 +106,26 @@ class SSHImageExtractor(ExcelImageExtractor):
             images = self.extract_images_from_worksheet(worksheet, start_row, photo_column)
             stats['images_found'] = len(images)
             
-            # Processa cada REF
+            # Associa cada REF à imagem da mesma linha
+            arquivos = []
             for ref_row, ref_value in ref_data:
                 try:
                     # Encontra imagem associada na mesma linha
                     image = self.find_image_for_ref(ref_row, images)
                     
                     if image:
-                        temp_path = None
-                        try:
-                            # Salva imagem temporariamente
-                            temp_path = self.save_image_to_temp(image, ref_value)
-                            
-                            # Faz upload via SSH
-                            remote_filename = f"{ref_value}.jpg"
-                            if self.upload_to_ssh(temp_path, remote_filename):
-                                stats['uploads_successful'] += 1
-                                logger.info(f"✅ REF {ref_value} (linha {ref_row}) processada com sucesso")
-                            else:
-                                stats['uploads_failed'] += 1
-                                
-                        finally:
-                            # Remove arquivo temporário se foi criado
-                            if temp_path and os.path.exists(temp_path):
-                                try:
-                                    os.remove(temp_path)
-                                    logger.debug(f"Arquivo temporário removido: {temp_path}")
-                                except Exception as e:
-                                    logger.warning(f"Erro ao remover arquivo temporário {temp_path}: {e}")
+                        # Bytes da imagem em memória, sem arquivo temporário
+                        image_bytes = self.get_image_bytes(image)
+                        if not image_bytes:
+                            logger.error(f"Imagem vazia: {ref_value}.jpg")
+                            stats['uploads_failed'] += 1
+                            continue
+                        arquivos.append({
+                            'ref': ref_value,
+                            'row': ref_row,
+                            'dados': image_bytes,
+                            'caminho': f"{DIRETORIO_REMOTO}/{ref_value}.jpg"
+                        })
                     else:
                         logger.warning(f"Nenhuma imagem encontrada para REF {ref_value} (linha {ref_row}) na coluna {photo_column}")
                         
@@ -191,6 +137,27 @@ class SSHImageExtractor(ExcelImageExtractor):
             
             workbook.close()
             
+            # Upload em lote: uma sessão SSH, vários canais SFTP em paralelo
+            if arquivos:
+                try:
+                    resultado = self.sessao.enviar_lote(arquivos)
+                except Exception as e:
+                    error_msg = f"Erro na sessão SSH: {e}"
+                    logger.error(error_msg)
+                    stats['errors'].append(error_msg)
+                    stats['uploads_failed'] += len(arquivos)
+                    return stats
+                finally:
+                    self.sessao.fechar()
+                stats['uploads_successful'] += resultado['uploads_successful']
+                stats['uploads_failed'] += resultado['uploads_failed']
+                stats['errors'].extend(resultado['errors'])
+                for arquivo, timing in zip(arquivos, resultado['upload_timings']):
+                    if timing['success']:
+                        logger.info(f"✅ REF {arquivo['ref']} (linha {arquivo['row']}) processada com sucesso")
+                for erro in resultado['errors']:
+                    logger.error(erro)
+            
         except Exception as e:
             error_msg = f"Erro geral no processamento: {e}"
             logger.error(error_msg)